@@ -0,0 +1,344 @@
+import json
+import os
+import sys
+import threading
+import time
+from typing import List
+
+import numpy as np
+
+from base_logger import Logs
+from embedding_index import EmbeddingIndex, normalize_rows
+
+logger = Logs(warnings=True, name="ann-index")
+
+
+class _GrowingMatrix:
+    """Матрица с амортизированным добавлением строк"""
+
+    def __init__(self, dim: int, rows: np.ndarray = None):
+        rows = np.zeros((0, dim), dtype=np.float32) if rows is None else np.asarray(rows, dtype=np.float32)
+        self.size = len(rows)
+        self._data = np.zeros((max(16, self.size), dim), dtype=np.float32)
+        self._data[:self.size] = rows
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._data[:self.size]
+
+    def append(self, row) -> int:
+        if self.size == len(self._data):
+            self._data = np.concatenate([self._data, np.zeros_like(self._data)])
+        self._data[self.size] = row
+        self.size += 1
+        return self.size - 1
+
+
+class IVFIndex:
+    """
+    Приближённый поиск (IVF): векторы вопросов и ответов разбиты k-means на n_lists кластеров,
+    при запросе просматриваются только nprobe ближайших кластеров, а найденные пары
+    пересчитываются точной формулой EmbeddingIndex (max(вопрос, ответ) + тема / 2).
+
+    nprobe - ручка точность/скорость: nprobe = n_lists даёт точный поиск.
+    Поддерживает добавление и удаление пар без перестройки и сохранение на диск.
+    add/remove/search/save потокобезопасны: add заменяет массивы, по которым идёт поиск.
+    """
+
+    def __init__(self, nprobe: int = 8):
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self.signature = None  # чем был построен индекс (для проверки актуальности после загрузки)
+
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self._lists = []  # номер кластера -> [pair_id * 2 + (0 - вопрос, 1 - ответ)]
+        self._list_arrays = {}
+
+        self._headers = None  # _GrowingMatrix
+        self._header_keys = {}  # (json_name, header) -> header_id
+        self._questions = None
+        self._answers = None
+        self._header_ids = np.zeros(0, dtype=np.int64)
+        self._metadata = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._pair_keys = {}  # (json_name, question) -> [pair_id]
+
+    def __len__(self):
+        return int(self._alive.sum())
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def _kmeans(vectors: np.ndarray, n_lists: int, iterations: int = 10, sample_size: int = 50000) -> np.ndarray:
+        """Сферический k-means (векторы нормированы, близость - скалярное произведение)"""
+        rng = np.random.default_rng(0)
+        if len(vectors) > sample_size:
+            vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            empty = np.bincount(assignment, minlength=n_lists) == 0
+            sums[empty] = centroids[empty]  # пустой кластер остаётся на месте
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def _assign(self, vectors: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(vectors[i:i + chunk] @ self.centroids.T, axis=1)
+            for i in range(0, len(vectors), chunk)
+        ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+    def build(self, index: EmbeddingIndex, n_lists: int = None, signature=None):
+        """Строит индекс по EmbeddingIndex. По умолчанию n_lists ~ 4 * sqrt(число векторов)"""
+        start_time = time.time()
+        h, p = index.n_headers, index.n_pairs
+        dim = index.dim
+
+        self.signature = signature
+        self._headers = _GrowingMatrix(dim, index.vectors[:h])
+        self._questions = _GrowingMatrix(dim, index.vectors[h:h + p])
+        self._answers = _GrowingMatrix(dim, index.vectors[h + p:])
+        self._header_keys = {key: header_id for header_id, key in enumerate(index.headers)}
+        self._header_ids = index.header_ids.astype(np.int64)
+        self._metadata = list(index.metadata)
+        self._alive = np.ones(p, dtype=bool)
+        self._pair_keys = {}
+        for pair_id, meta in enumerate(self._metadata):
+            self._pair_keys.setdefault((meta["json_name"], meta["question"]), []).append(pair_id)
+
+        vectors = np.concatenate([self._questions.data, self._answers.data])
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+        self.centroids = self._kmeans(vectors, n_lists) if len(vectors) else np.zeros((1, dim), dtype=np.float32)
+
+        assignment = self._assign(vectors)
+        # Вектор вопроса пары i имеет номер i, ответа - p + i; кодируем как i * 2 + вид
+        entries = np.concatenate([np.arange(p) * 2, np.arange(p) * 2 + 1])
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(self.n_lists + 1))
+        self._lists = [entries[order[bounds[i]:bounds[i + 1]]].tolist() for i in range(self.n_lists)]
+        self._list_arrays = {}
+        logger.logging(f"IVF индекс: {p} пар, {self.n_lists} кластеров, {time.time() - start_time:.2f}s")
+
+    def add(self, json_name: str, header: str, header_embedding, question: str, answer: str,
+            question_embedding, answer_embedding):
+        """Добавляет пару без перестройки индекса"""
+        question_vector = normalize_rows(question_embedding)[0]
+        answer_vector = normalize_rows(answer_embedding)[0]
+        header_key = (json_name, header)
+        with self._lock:
+            if self.centroids.shape[1] == 0:
+                self._allocate(len(question_vector))
+            header_id = self._header_keys.get(header_key)
+            if header_id is None:
+                header_id = self._headers.append(normalize_rows(header_embedding)[0])
+                self._header_keys[header_key] = header_id
+
+            pair_id = self._questions.append(question_vector)
+            self._answers.append(answer_vector)
+            # Добавления редкие, поэтому np.append (копия) здесь дешевле, чем списки при каждом поиске
+            self._header_ids = np.append(self._header_ids, header_id)
+            self._metadata.append({"json_name": json_name, "header": header, "question": question, "answer": answer})
+            self._alive = np.append(self._alive, True)
+            self._pair_keys.setdefault((json_name, question), []).append(pair_id)
+
+            for kind, list_id in enumerate(self._assign(np.stack([question_vector, answer_vector]))):
+                self._lists[list_id].append(pair_id * 2 + kind)
+                self._list_arrays.pop(list_id, None)
+
+    def _allocate(self, dim: int):
+        """
+        Индекс, построенный по пустому датасету, не знает размерность (dim = 0): матрицы выделяются
+        при первом add, все пары попадают в один кластер до следующей перестройки
+        """
+        self._headers = _GrowingMatrix(dim)
+        self._questions = _GrowingMatrix(dim)
+        self._answers = _GrowingMatrix(dim)
+        self.centroids = np.zeros((1, dim), dtype=np.float32)
+        self._lists = [[]]
+        self._list_arrays = {}
+
+    def remove(self, json_name: str, question: str) -> int:
+        """Удаляет пары с этим вопросом из файла json_name. Возвращает число удалённых"""
+        with self._lock:
+            pair_ids = self._pair_keys.pop((json_name, question), [])
+            for pair_id in pair_ids:
+                self._alive[pair_id] = False
+        return len(pair_ids)
+
+    def _list_array(self, list_id: int) -> np.ndarray:
+        array = self._list_arrays.get(list_id)
+        if array is None:
+            array = np.array(self._lists[list_id], dtype=np.int64)
+            self._list_arrays[list_id] = array
+        return array
+
+    def search(self, query_embedding, top_k=3, nprobe: int = None) -> List[dict]:
+        """Top-k пар (формат как у EmbeddingIndex.search)"""
+        with self._lock:
+            if not self._metadata or top_k <= 0:
+                return []
+            query = normalize_rows(query_embedding)[0]
+            nprobe = max(1, min(nprobe or self.nprobe, self.n_lists))
+
+            centroid_scores = self.centroids @ query
+            if nprobe < self.n_lists:
+                probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            else:
+                probe = np.arange(self.n_lists)
+            entries = np.concatenate([self._list_array(list_id) for list_id in probe])
+            pair_ids = np.unique(entries >> 1)
+            pair_ids = pair_ids[self._alive[pair_ids]]
+            if not len(pair_ids):
+                return []
+
+            header_ids = self._header_ids[pair_ids]
+            header_similarity = (self._headers.data @ query)[header_ids]
+            question_similarity = self._questions.data[pair_ids] @ query
+            answer_similarity = self._answers.data[pair_ids] @ query
+            similarity = np.maximum(question_similarity, answer_similarity) + header_similarity / 2
+
+            if top_k < len(pair_ids):
+                top = np.sort(np.argpartition(-similarity, top_k - 1)[:top_k])
+            else:
+                top = np.arange(len(pair_ids))
+            top = top[np.argsort(-similarity[top], kind="stable")]
+
+            return [
+                {
+                    **self._metadata[pair_ids[i]],
+                    "similarity": float(similarity[i]),
+                    "header_similarity": float(header_similarity[i]),
+                    "question_similarity": float(question_similarity[i]),
+                    "answer_similarity": float(answer_similarity[i])
+                }
+                for i in top
+            ]
+
+    def search_many(self, query_embeddings, top_k=5) -> List[dict]:
+        """Как EmbeddingIndex.search_many: лучшая схожесть по всем запросам, без повторов вопросов"""
+        best = {}
+        for query_embedding in normalize_rows(query_embeddings):
+            for item in self.search(query_embedding, top_k=top_k * 4):
+                if item["question"] not in best or item["similarity"] > best[item["question"]]["similarity"]:
+                    best[item["question"]] = item
+        return sorted(best.values(), key=lambda item: item["similarity"], reverse=True)[:top_k]
+
+    def save(self, path: str):
+        """Сохраняет индекс: path (.npz с матрицами) и path + '.meta' (JSON). Запись атомарная"""
+        with self._lock:
+            self._save(path)
+
+    def _save(self, path: str):
+        lengths = np.array([len(items) for items in self._lists], dtype=np.int64)
+        flat = np.array([entry for items in self._lists for entry in items], dtype=np.int64)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            headers=self._headers.data,
+            questions=self._questions.data,
+            answers=self._answers.data,
+            header_ids=self._header_ids,
+            alive=self._alive,
+            list_lengths=lengths,
+            list_entries=flat
+        )
+        meta = {
+            "signature": self.signature,
+            "nprobe": self.nprobe,
+            "headers": [list(key) for key, _ in sorted(self._header_keys.items(), key=lambda item: item[1])],
+            "metadata": self._metadata
+        }
+        with open(f"{path}.meta.tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{path}.meta.tmp", f"{path}.meta")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(f"{path}.meta", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        data = np.load(path)
+
+        ann = cls(nprobe=meta["nprobe"])
+        ann.signature = meta["signature"]
+        ann.centroids = data["centroids"]
+        dim = ann.centroids.shape[1]
+        ann._headers = _GrowingMatrix(dim, data["headers"])
+        ann._questions = _GrowingMatrix(dim, data["questions"])
+        ann._answers = _GrowingMatrix(dim, data["answers"])
+        ann._header_ids = data["header_ids"]
+        ann._alive = data["alive"]
+        ann._header_keys = {tuple(key): header_id for header_id, key in enumerate(meta["headers"])}
+        ann._metadata = meta["metadata"]
+        for pair_id, item in enumerate(ann._metadata):
+            if ann._alive[pair_id]:
+                ann._pair_keys.setdefault((item["json_name"], item["question"]), []).append(pair_id)
+
+        bounds = np.concatenate([[0], np.cumsum(data["list_lengths"])])
+        entries = data["list_entries"]
+        ann._lists = [entries[bounds[i]:bounds[i + 1]].tolist() for i in range(len(bounds) - 1)]
+        return ann
+
+
+def benchmark(index: EmbeddingIndex, queries: np.ndarray, top_k: int = 10, nprobes=(1, 2, 4, 8, 16, 32, 64)):
+    """Сравнение IVF с точным поиском: recall@top_k и среднее время запроса"""
+    start_time = time.time()
+    exact = [{item["question"] for item in index.search(query, top_k)} for query in queries]
+    exact_ms = (time.time() - start_time) / len(queries) * 1000
+    print(f"exact: {exact_ms:.2f} ms/query")
+
+    ann = IVFIndex()
+    ann.build(index)
+    for nprobe in nprobes:
+        if nprobe > ann.n_lists:
+            break
+        start_time = time.time()
+        found = [{item["question"] for item in ann.search(query, top_k, nprobe=nprobe)} for query in queries]
+        ann_ms = (time.time() - start_time) / len(queries) * 1000
+        recall = np.mean([len(a & b) / max(1, len(b)) for a, b in zip(found, exact)])
+        print(f"ivf nprobe={nprobe:3d}/{ann.n_lists}: recall@{top_k}={recall:.3f}, {ann_ms:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    # python ann_index.py [папка dataset_embeddings] - иначе синтетические данные
+    if len(sys.argv) > 1:
+        from embedding_store import EmbeddingsStore
+
+        store = EmbeddingsStore(sys.argv[1], storage_format="npy" if "npy" in sys.argv[2:] else "json")
+        store.refresh(force=True)
+        bench_index = store.get_index()
+        rng = np.random.default_rng(1)
+        pair_rows = rng.choice(bench_index.n_pairs, min(200, bench_index.n_pairs), replace=False)
+        bench_queries = bench_index.vectors[bench_index.n_headers + pair_rows]
+        bench_queries = bench_queries + rng.normal(scale=0.02, size=bench_queries.shape).astype(np.float32)
+    else:
+        rng = np.random.default_rng(1)
+        n_pairs, dim, n_topics = 50000, 1024, 200
+        topics = normalize_rows(rng.normal(size=(n_topics, dim)))
+        topic_of = rng.integers(0, n_topics, n_pairs)
+        questions = normalize_rows(topics[topic_of] + rng.normal(scale=0.05, size=(n_pairs, dim)))
+        answers = normalize_rows(topics[topic_of] + rng.normal(scale=0.05, size=(n_pairs, dim)))
+        bench_index = EmbeddingIndex(
+            np.concatenate([topics, questions, answers]).astype(np.float32),
+            topic_of.astype(np.int32),
+            [("bench.json", f"topic {i}") for i in range(n_topics)],
+            [{"json_name": "bench.json", "header": f"topic {t}", "question": f"q{i}", "answer": f"a{i}"}
+             for i, t in enumerate(topic_of)]
+        )
+        bench_queries = normalize_rows(topics[rng.integers(0, n_topics, 200)] + rng.normal(scale=0.05, size=(200, dim)))
+    benchmark(bench_index, bench_queries)
+
+    # Индекс по пустому датасету: первое добавление выделяет матрицы, пара сразу находится
+    empty_ann = IVFIndex()
+    empty_ann.build(EmbeddingIndex.empty())
+    first = rng.normal(size=bench_index.dim)
+    empty_ann.add("new.json", "topic", first, "q", "a", first, first)
+    assert [item["question"] for item in empty_ann.search(first, top_k=1)] == ["q"]
+    print("empty index + add: ok")
@@ -0,0 +1,297 @@
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import numpy as np
+
+try:
+    import sounddevice as sd
+except Exception as e:
+    sd = None
+    print(f"Cant import sounddevice. Only 'null' output device will work. Error: {e}")
+
+from base_logger import Logs, Color
+from errors import DeviceNotFound
+
+logger = Logs(warnings=True, name="audio-output")
+
+NULL_DEVICE = "null"  # устройство-заглушка для headless Linux и проверки без звуковой карты
+
+_device_indices = {}
+
+
+def get_device_index_by_name(device_name):
+    """Индекс устройства по части имени. sd.query_devices() вызывается один раз на имя"""
+    if device_name not in _device_indices:
+        devices = sd.query_devices()
+        for i, device in enumerate(devices):
+            if device_name.lower() in device['name'].lower():
+                _device_indices[device_name] = i
+                break
+        else:
+            raise DeviceNotFound(f"Нет такого устройства: {device_name}. Устройства: {devices}")
+    return _device_indices[device_name]
+
+
+class NullOutputStream:
+    """
+    Заглушка sd.OutputStream: callback вызывается в реальном темпе из своего потока,
+    звук отбрасывается (или сохраняется в captured при capture=True)
+    """
+
+    def __init__(self, samplerate, channels, callback, blocksize, capture=False, **kwargs):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.callback = callback
+        self.blocksize = blocksize
+        self.capture = capture
+        self.captured = []  # (время блока, блок)
+        self._running = False
+        self._thread = None
+
+    @property
+    def time(self) -> float:
+        return time.monotonic()
+
+    def _run(self):
+        block_time = self.blocksize / self.samplerate
+        next_time = time.monotonic()
+        while self._running:
+            outdata = np.zeros((self.blocksize, self.channels), dtype='float32')
+            self.callback(outdata, self.blocksize, SimpleNamespace(outputBufferDacTime=next_time), None)
+            if self.capture:
+                self.captured.append((next_time, outdata))
+            next_time += block_time
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="null-output")
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+
+
+class DeviceOutput:
+    """Один OutputStream и своя позиция (cursor) в общей ленте кадров движка"""
+
+    def __init__(self, engine, device_name: str, capture: bool = False):
+        self.engine = engine
+        self.device_name = device_name
+        self.cursor = 0  # номер следующего кадра общей ленты
+        self._fade_left = 0  # сколько кадров затухания осталось (0 - затухания нет)
+
+        kwargs = dict(
+            samplerate=engine.samplerate,
+            channels=engine.channels,
+            dtype='float32',
+            blocksize=engine.blocksize,
+            callback=self._callback
+        )
+        if device_name == NULL_DEVICE:
+            self.stream = NullOutputStream(capture=capture, **kwargs)
+        else:
+            self.stream = sd.OutputStream(device=get_device_index_by_name(device_name), latency='low', **kwargs)
+        self.stream.start()
+        # Сдвиг часов потока относительно time.monotonic (для общего старта на всех устройствах)
+        self._clock_offset = self.stream.time - time.monotonic()
+
+    def _callback(self, outdata, frames, time_info, status):
+        outdata.fill(0)
+        engine = self.engine
+        filled = 0
+        with engine.lock:
+            if self.cursor == engine.start_frame and engine.start_at:
+                # Ожидание общего старта: первый кадр выходит на всех устройствах в один момент
+                dac_time = (time_info.outputBufferDacTime or self.stream.time) - self._clock_offset
+                wait_frames = round((engine.start_at - dac_time) * engine.samplerate)
+                if wait_frames >= frames:
+                    return
+                filled = max(0, wait_frames)
+
+            while filled < frames:
+                chunk = engine.chunk_at(self.cursor)
+                if chunk is None:
+                    break
+                start_frame, pcm, creation_time = chunk
+                position = self.cursor - start_frame
+                take = min(frames - filled, len(pcm) - position)
+
+                if engine.stop_signal.stopped_after(creation_time):
+                    # Перебивание: короткое затухание вместо щелчка, затем пропуск остановленных чанков
+                    if not self._fade_left:
+                        self._fade_left = engine.fade_frames
+                    take = min(take, self._fade_left)
+                    gain = (self._fade_left - np.arange(take, dtype='float32')) / engine.fade_frames
+                    outdata[filled:filled + take] = pcm[position:position + take] * gain[:, None]
+                    self._fade_left -= take
+                    filled += take
+                    self.cursor += take
+                    if not self._fade_left:
+                        self.cursor = engine.skip_stopped(self.cursor)
+                    continue
+
+                self._fade_left = 0
+                outdata[filled:filled + take] = pcm[position:position + take]
+                filled += take
+                self.cursor += take
+            engine.trim()
+
+    def close(self):
+        self.stream.close()
+
+
+class AudioOutputEngine:
+    """
+    Долгоживущий вывод звука на несколько устройств.
+
+    Все чанки пишутся в общую ленту кадров; у каждого устройства свой callback-поток
+    OutputStream и своя позиция в ленте. После тишины воспроизведение начинается
+    на всех устройствах одновременно (start_delay_ms, с точностью до сэмпла по часам потоков).
+    При перебивании stop_signal звук затухает за fade_ms и останавливается в течение одного блока.
+    Формат (частота, каналы) берётся из первого чанка, остальные приводятся к нему.
+    """
+
+    def __init__(self, device_names: list, stop_signal, fade_ms: float = 8, block_ms: float = 5,
+                 start_delay_ms: float = 40, capture: bool = False):
+        self.device_names = list(device_names)
+        self.stop_signal = stop_signal
+        self.fade_ms = fade_ms
+        self.block_ms = block_ms
+        self.start_delay_ms = start_delay_ms
+        self.capture = capture
+
+        self.samplerate = None
+        self.channels = None
+        self.blocksize = None
+        self.fade_frames = None
+        self.devices = []
+
+        self.lock = threading.Lock()
+        self.chunks = deque()  # (start_frame, pcm, creation_time), лента без разрывов
+        self.end_frame = 0
+        self.start_frame = 0
+        self.start_at = 0.0
+
+    def _open(self, samplerate: int, channels: int):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = max(1, round(samplerate * self.block_ms / 1000))
+        self.fade_frames = max(1, round(samplerate * self.fade_ms / 1000))
+        for device_name in self.device_names:
+            try:
+                self.devices.append(DeviceOutput(self, device_name, capture=self.capture))
+            except Exception as e:
+                logger.logging(f"Error opening output device {device_name}: {e}")
+        if not self.devices:
+            logger.logging(f"No output device opened from {self.device_names}, audio will be dropped",
+                           color=Color.YELLOW)
+
+    def _conform(self, pcm, samplerate: int):
+        """Приводит чанк к формату движка"""
+        pcm = np.asarray(pcm, dtype='float32')
+        if pcm.ndim == 1:
+            pcm = pcm[:, None]
+        if samplerate != self.samplerate:
+            frames = round(len(pcm) * self.samplerate / samplerate)
+            source_x = np.arange(len(pcm)) / samplerate
+            target_x = np.arange(frames) / self.samplerate
+            pcm = np.stack([np.interp(target_x, source_x, pcm[:, c]) for c in range(pcm.shape[1])], axis=1)
+            pcm = pcm.astype('float32')
+        if pcm.shape[1] != self.channels:
+            if self.channels == 1:
+                pcm = pcm.mean(axis=1, keepdims=True)
+            else:
+                pcm = np.repeat(pcm[:, :1], self.channels, axis=1)
+        return np.ascontiguousarray(pcm)
+
+    def write(self, pcm, samplerate: int, creation_time: float = None):
+        """Добавляет PCM (frames, channels) в конец ленты"""
+        creation_time = time.time() if creation_time is None else creation_time
+        if self.samplerate is None:
+            pcm = np.asarray(pcm, dtype='float32')
+            self._open(samplerate, 1 if pcm.ndim == 1 else pcm.shape[1])
+        if not self.devices:
+            # Некому проигрывать (устройства не открылись или движок закрыт): лента не должна расти
+            return
+        pcm = self._conform(pcm, samplerate)
+        if not len(pcm):
+            return
+        with self.lock:
+            if all(device.cursor >= self.end_frame for device in self.devices):
+                # Все устройства молчат - новый общий старт
+                for device in self.devices:
+                    device.cursor = self.end_frame
+                self.start_frame = self.end_frame
+                self.start_at = time.monotonic() + self.start_delay_ms / 1000
+            self.chunks.append((self.end_frame, pcm, creation_time))
+            self.end_frame += len(pcm)
+
+    def chunk_at(self, frame: int):
+        for chunk in self.chunks:
+            if chunk[0] <= frame < chunk[0] + len(chunk[1]):
+                return chunk
+        return None
+
+    def skip_stopped(self, frame: int) -> int:
+        """Первый кадр после frame, который не остановлен перебиванием"""
+        for start_frame, pcm, creation_time in self.chunks:
+            if start_frame + len(pcm) <= frame:
+                continue
+            if not self.stop_signal.stopped_after(creation_time):
+                return max(frame, start_frame)
+        return self.end_frame
+
+    def trim(self):
+        """Удаляет чанки, которые уже проиграны на всех устройствах"""
+        min_cursor = min((device.cursor for device in self.devices), default=self.end_frame)
+        while self.chunks and self.chunks[0][0] + len(self.chunks[0][1]) <= min_cursor:
+            self.chunks.popleft()
+
+    def is_idle(self) -> bool:
+        with self.lock:
+            return all(device.cursor >= self.end_frame for device in self.devices)
+
+    def close(self):
+        for device in self.devices:
+            device.close()
+        self.devices = []
+
+
+if __name__ == "__main__":
+    # Проверка без звуковой карты: python audio_output.py
+    from barge_in import BargeInSignal
+
+    signal = BargeInSignal()
+    engine = AudioOutputEngine([NULL_DEVICE, NULL_DEVICE], stop_signal=signal, capture=True)
+    samplerate = 24000
+    tone = (0.5 * np.cos(2 * np.pi * 440 * np.arange(samplerate) / samplerate)).astype('float32')
+    for part in np.array_split(tone, 4):  # 4 чанка по 250 мс - на стыках не должно быть разрывов
+        engine.write(part, samplerate)
+
+    time.sleep(0.6)
+    stop_time = time.monotonic()
+    signal.stop()
+    time.sleep(0.2)
+    devices = list(engine.devices)
+    engine.close()
+
+    broken = AudioOutputEngine(["нет такого устройства"], stop_signal=signal)
+    for part in np.array_split(tone, 4):
+        broken.write(part, samplerate)
+    print(f"без устройств в ленте чанков: {len(broken.chunks)}")
+
+    for device in devices:
+        block_time = device.stream.blocksize / samplerate
+        output = np.concatenate([block for _, block in device.stream.captured])[:, 0]
+        sound = np.flatnonzero(np.abs(output) > 1e-6)
+        first_time = device.stream.captured[0][0] + sound[0] / samplerate
+        last_time = device.stream.captured[0][0] + sound[-1] / samplerate
+        played = output[sound[0]:sound[-1] + 1]
+        gapless = np.allclose(played[:-engine.fade_frames], tone[:len(played) - engine.fade_frames])
+        print(f"старт: {first_time:.4f}, без разрывов: {gapless}, "
+              f"тишина через {(last_time - stop_time) * 1000:.1f} мс после перебивания")
@@ -0,0 +1,90 @@
+import threading
+import time
+
+from base_logger import Logs
+
+logger = Logs(warnings=False, name="barge-in")
+
+
+class BargeInSignal:
+    """
+    Сигнал перебивания: время, после которого всё созданное раньше аудио нужно остановить.
+
+    Значение хранится в памяти процесса: чтение - обычное чтение float (без блокировок и диска),
+    ожидающие проигрыватели просыпаются через Condition сразу после stop().
+    Если рекордер и проигрыватель работают в разных процессах, передайте sql_database:
+    время дополнительно пишется в DictSQL под ключом 'time_stop_playing', а фоновый поток раз в
+    sql_poll_interval переносит его из базы в память. Читатели (в т.ч. аудио-колбэк) базу не трогают.
+    """
+
+    def __init__(self, sql_database=None, sql_key: str = 'time_stop_playing', sql_poll_interval: float = 0.1):
+        self.sql_database = sql_database
+        self.sql_key = sql_key
+        self.sql_poll_interval = sql_poll_interval
+        self._stop_time = 0.0
+        self._condition = threading.Condition()
+
+        if sql_database is not None:
+            threading.Thread(target=self._poll_sql, daemon=True, name="barge-in-sql").start()
+
+    def stop(self, timestamp: float = None):
+        """Перебивание: остановить всё аудио, созданное раньше timestamp (по умолчанию - сейчас)"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._condition:
+            self._stop_time = timestamp
+            self._condition.notify_all()
+        if self.sql_database is not None:
+            self.sql_database[self.sql_key] = timestamp
+
+    def stop_time(self) -> float:
+        return self._stop_time
+
+    def _poll_sql(self):
+        """Переносит время перебивания из другого процесса (DictSQL) в память и будит ожидающих"""
+        while True:
+            try:
+                timestamp = float(self.sql_database.get(self.sql_key, 0))
+            except Exception as e:
+                logger.logging(f"Error reading {self.sql_key}: {e}")
+                timestamp = 0.0
+            if timestamp > self._stop_time:
+                with self._condition:
+                    self._stop_time = max(self._stop_time, timestamp)
+                    self._condition.notify_all()
+            time.sleep(self.sql_poll_interval)
+
+    def stopped_after(self, timestamp: float) -> bool:
+        """Было ли перебивание после timestamp"""
+        return self.stop_time() > timestamp
+
+    def wait_stop(self, timestamp: float, timeout: float) -> bool:
+        """Ждёт перебивания после timestamp не дольше timeout. True - если оно произошло"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self.stopped_after(timestamp):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+
+if __name__ == "__main__":
+    signal = BargeInSignal()
+    created = time.time()
+    delays = []
+
+    def player():
+        signal.wait_stop(created, timeout=5)
+        delays.append(time.perf_counter() - stop_called)
+
+    threads = [threading.Thread(target=player) for _ in range(2)]  # по потоку на устройство вывода
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    stop_called = time.perf_counter()
+    signal.stop()
+    for thread in threads:
+        thread.join()
+    print("Задержка остановки:", ", ".join(f"{delay * 1e6:.0f} мкс" for delay in delays))
@@ -4,16 +4,26 @@ from network_tools import NetworkToolsAPI
 from network_tools.sql_storage import DictSQL
 
 import secret
+from barge_in import BargeInSignal
+from chat_history_store import ChatHistoryStore
+from embedding_cache import EmbeddingCache
 from embedding_tools import EmbeddingTools
 from event_manager import EventManager
+from user_directory import UserDirectory
 
 discord_proxies = secret.discord_proxies
 discord_proxy = discord_proxies["https"] if discord_proxies else None
 
 network_client = NetworkToolsAPI(secret.network_tools_api)
 discord_client = DiscordClient(secret_token=secret.auth_token_discord, device=ClientDevice.android, afk=True, proxy_uri=discord_proxy)
-embedding_tools = EmbeddingTools(secret.cohere_api_keys, 'dataset', proxies=secret.cohere_proxies, network_client=network_client)
+embedding_cache = EmbeddingCache(secret.embedding_cache_path, max_size_mb=secret.embedding_cache_max_mb)
+embedding_tools = EmbeddingTools(secret.cohere_api_keys, 'dataset', proxies=secret.cohere_proxies, network_client=network_client, cache=embedding_cache)
 embedding_tools.process_folder()
+embedding_tools.load_dataset()
 sql_database = DictSQL('chat_history')
 sql_database_discord = DictSQL('sql_database_discord')
+chat_history_store = ChatHistoryStore(secret.chat_history_path, keep_messages=secret.chat_history_keep_messages,
+                                      max_age_days=secret.chat_history_max_age_days)
+user_directory = UserDirectory(sql_database_discord, flush_interval=secret.known_users_flush_interval)
+barge_in = BargeInSignal(sql_database if secret.barge_in_sql_fallback else None)
 event_manager = EventManager()
@@ -0,0 +1,155 @@
+import json
+import sqlite3
+import threading
+import time
+
+from base_logger import Logs
+
+logger = Logs(warnings=True, name="chat-history")
+
+
+class ChatHistoryStore:
+    """
+    История сообщений по каналам в SQLite: только добавление, ключ (channel_id, seq).
+
+    Сообщение пишется одной строкой, старая история не перечитывается и не сериализуется заново.
+    recent() читает с конца по индексу только то, что влезет в промпт.
+    Хранение ограничено keep_messages на канал и max_age_days; удалённое место возвращается
+    файлу через incremental_vacuum каждые compact_every добавлений.
+    """
+
+    def __init__(self, path: str = "chat_history.db", keep_messages: int = 2000, max_age_days: float = None,
+                 compact_every: int = 500):
+        self.path = path
+        self.keep_messages = keep_messages
+        self.max_age_days = max_age_days
+        self.compact_every = compact_every
+        self._appends = 0
+        self._migrated = set()
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # действует только для новой базы
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "channel_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+            "size INTEGER NOT NULL, created REAL NOT NULL, PRIMARY KEY (channel_id, seq)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_created ON messages (created)")
+        self._conn.commit()
+
+    def append(self, channel_id, messages: list) -> int:
+        """Добавляет сообщения {"role", "content"} в конец истории канала. Возвращает seq последнего"""
+        channel_id = str(channel_id)
+        now = time.time()
+        with self._lock:
+            last = self._conn.execute(
+                "SELECT MAX(seq) FROM messages WHERE channel_id = ?", (channel_id,)
+            ).fetchone()[0]
+            seq = -1 if last is None else last
+            rows = []
+            for message in messages:
+                seq += 1
+                content = json.dumps(message.get("content", ""), ensure_ascii=False)
+                rows.append((channel_id, seq, message.get("role", ""), content, len(content), now))
+            self._conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+            self._appends += 1
+            if self.compact_every and self._appends % self.compact_every == 0:
+                self._compact()
+        return seq
+
+    def recent(self, channel_id, max_messages: int = None, max_chars: int = None) -> list:
+        """
+        Последние сообщения канала (от старых к новым): не больше max_messages и примерно max_chars символов.
+        Сообщение, на котором превышен max_chars, тоже возвращается - его обрежет format_messages
+        """
+        query = "SELECT role, content, size FROM messages WHERE channel_id = ? ORDER BY seq DESC"
+        params = [str(channel_id)]
+        if max_messages is not None:
+            query += " LIMIT ?"
+            params.append(max_messages)
+        messages = []
+        total = 0
+        with self._lock:
+            for role, content, size in self._conn.execute(query, params):
+                messages.append({"role": role, "content": json.loads(content)})
+                total += size
+                if max_chars is not None and total >= max_chars:
+                    break
+        messages.reverse()
+        return messages
+
+    def count(self, channel_id) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE channel_id = ?", (str(channel_id),)
+            ).fetchone()[0]
+
+    def clear(self, channel_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE channel_id = ?", (str(channel_id),))
+            self._conn.commit()
+
+    def migrate(self, channel_id, legacy_db, key: str):
+        """Один раз переносит историю-список legacy_db[key] (DictSQL) в хранилище и очищает старый ключ"""
+        if key in self._migrated:
+            return
+        legacy = legacy_db.get(key, [])
+        if legacy:
+            if not self.count(channel_id):
+                self.append(channel_id, legacy[-self.keep_messages:] if self.keep_messages else legacy)
+                logger.logging(f"История {key} перенесена: {len(legacy)} сообщений")
+            legacy_db[key] = []
+        self._migrated.add(key)
+
+    def compact(self):
+        """Удаляет сообщения сверх keep_messages на канал и старше max_age_days, освобождает место в файле"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        removed = 0
+        if self.keep_messages:
+            removed += self._conn.execute(
+                "DELETE FROM messages WHERE (channel_id, seq) IN ("
+                "SELECT m.channel_id, m.seq FROM messages m JOIN "
+                "(SELECT channel_id, MAX(seq) AS last FROM messages GROUP BY channel_id) c "
+                "ON m.channel_id = c.channel_id WHERE m.seq <= c.last - ?)",
+                (self.keep_messages,)
+            ).rowcount
+        if self.max_age_days:
+            removed += self._conn.execute(
+                "DELETE FROM messages WHERE created < ?", (time.time() - self.max_age_days * 86400,)
+            ).rowcount
+        self._conn.commit()
+        if removed:
+            self._conn.execute("PRAGMA incremental_vacuum")
+            logger.logging(f"История сообщений: удалено {removed} старых сообщений")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    # Время добавления сообщения не должно зависеть от длины истории канала
+    db_path = os.path.join(tempfile.mkdtemp(), "history.db")
+    store = ChatHistoryStore(db_path, keep_messages=5000, compact_every=0)
+    pair = [{"role": "user", "content": "Привет! " * 20}, {"role": "bot", "content": "Ответ " * 40}]
+    for checkpoint in (1000, 5000, 20000):
+        while store.count("channel") < checkpoint:
+            store.append("channel", pair)
+        start_time = time.perf_counter()
+        for _ in range(100):
+            store.append("channel", pair)
+            store.recent("channel", max_messages=15, max_chars=2000)
+        print(f"{checkpoint} сообщений: append+recent {(time.perf_counter() - start_time) * 10:.2f} ms")
+    store.compact()
+    print(f"После compact: {store.count('channel')} сообщений, файл {os.path.getsize(db_path) / 2 ** 20:.1f} MB")
+    store.close()
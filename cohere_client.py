@@ -0,0 +1,209 @@
+import asyncio
+import threading
+import time
+from typing import List
+
+import aiohttp
+from requests import RequestException
+
+from base_logger import Logs
+
+logger = Logs(warnings=True, name="cohere-client")
+
+COHERE_EMBED_URL = "https://api.cohere.com/v2/embed"
+EMBED_BATCH_SIZE = 96  # максимум текстов в одном запросе Cohere v2/embed
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов для одного ключа"""
+
+    def __init__(self, calls_per_minute: float, capacity: float = None):
+        self.rate = calls_per_minute / 60
+        self.capacity = capacity or calls_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до следующего запроса"""
+        self._refill(now)
+        wait_tokens = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait_tokens, self.blocked_until - now, 0.0)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Ключ получил 429 - не использовать его seconds секунд"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class AsyncCohereClient:
+    """
+    Асинхронный клиент Cohere v2/embed.
+
+    Работает в собственном фоновом event loop: один пул соединений на все потоки и все loop'ы.
+    Запросы распределяются по всем ключам (у каждого свой TokenBucket), ключ с 429 временно
+    откладывается, и запрос сразу уходит на другой ключ вместо сна всего потока.
+    aembed() можно вызывать из любого event loop, отмена задачи отменяет и HTTP запрос.
+    embed() - синхронная обёртка.
+    """
+
+    def __init__(self, api_keys: list, proxies: dict = None, pool_size: int = 16, calls_per_minute: float = 100):
+        self._keys = list(api_keys)
+        self._buckets = {key: TokenBucket(calls_per_minute) for key in self._keys}
+        self._uses = {key: 0 for key in self._keys}
+        self.proxy = proxies.get("https") if proxies else None
+        self.pool_size = pool_size
+
+        self._loop = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def keys(self) -> list:
+        return list(self._keys)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True, name="cohere-client").start()
+            return self._loop
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=60)
+            )
+        return self._session
+
+    def _remove_key(self, api_key: str):
+        if api_key in self._keys:
+            logger.logging(f"removed: {api_key}")
+            self._keys.remove(api_key)
+
+    async def _acquire_key(self) -> str:
+        """Ключ, который освободится раньше остальных (при равенстве - наименее использованный)"""
+        while True:
+            if not self._keys:
+                raise Exception("All Cohere API keys exhausted")
+            now = time.monotonic()
+            api_key = min(self._keys, key=lambda key: (self._buckets[key].wait_time(now), self._uses[key]))
+            wait = self._buckets[api_key].wait_time(now)
+            if wait <= 0:
+                self._buckets[api_key].take(now)
+                self._uses[api_key] += 1
+                return api_key
+            await asyncio.sleep(min(wait, 1.0))
+
+    def _handle_rate_limit(self, response_text: str, attempt: int, base_delay: float, api_key: str):
+        """Обработка различных типов ограничений скорости."""
+        if "1000 API calls / month" in response_text:
+            # Удаляем ключ навсегда
+            self._remove_key(api_key)
+            return
+        if "calls / minute" in response_text:
+            delay = 20.0
+        elif "Please wait and try again later" in response_text:
+            delay = 10.0
+        else:
+            delay = base_delay * (attempt + 1)
+        logger.logging(f"Слишком много запросов. Ключ отложен на {delay} с")
+        self._buckets[api_key].block(delay)
+
+    async def _embed(
+            self,
+            texts: List[str],
+            model: str,
+            input_type: str,
+            embedding_type: str,
+            max_retries: int,
+            base_delay: float
+    ) -> List[List[float]]:
+        if not texts:
+            raise ValueError("Text parameter cannot be empty")
+        if len(texts) > EMBED_BATCH_SIZE:
+            raise ValueError(f"Too many texts in one request: {len(texts)} > {EMBED_BATCH_SIZE}")
+        if not self._keys:
+            raise Exception("No Cohere API keys available")
+
+        payload = {
+            "model": model,
+            "texts": texts,
+            "input_type": input_type,
+            "embedding_types": [embedding_type]
+        }
+        session = await self._get_session()
+        start_time = time.time()
+
+        for attempt in range(max_retries):
+            api_key = await self._acquire_key()
+            headers = {
+                "accept": "application/json",
+                "content-type": "application/json",
+                "Authorization": f"bearer {api_key}"
+            }
+
+            try:
+                async with session.post(COHERE_EMBED_URL, json=payload, headers=headers, proxy=self.proxy) as response:
+                    if response.status == 429:  # Rate limit
+                        self._handle_rate_limit(await response.text(), attempt, base_delay, api_key)
+                        continue
+                    elif response.status == 401:  # Unauthorized
+                        self._remove_key(api_key)
+                        continue
+                    elif response.status in (502, 503, 504):
+                        await asyncio.sleep(base_delay * (attempt + 1))
+                        continue
+                    response.raise_for_status()
+                    result = await response.json()
+
+                embeddings = result["embeddings"][embedding_type]
+                logger.logging(f"Получен эмбеддинг ({len(texts)} шт.): {time.time() - start_time:.2f}s")
+                return embeddings
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+                logger.logging(f"Request failed: {str(e)}")
+                if attempt == max_retries - 1:
+                    raise
+
+        raise RequestException(f"Failed to get embedding after {max_retries} attempts")
+
+    async def aembed(
+            self,
+            texts: List[str],
+            model: str = "embed-english-v3.0",
+            input_type: str = "classification",
+            embedding_type: str = "float",
+            max_retries: int = 45,
+            base_delay: float = 1.0
+    ) -> List[List[float]]:
+        """Эмбеддинги texts. Можно ждать из любого event loop"""
+        future = asyncio.run_coroutine_threadsafe(
+            self._embed(texts, model, input_type, embedding_type, max_retries, base_delay),
+            self._ensure_loop()
+        )
+        return await asyncio.wrap_future(future)
+
+    def embed(
+            self,
+            texts: List[str],
+            model: str = "embed-english-v3.0",
+            input_type: str = "classification",
+            embedding_type: str = "float",
+            max_retries: int = 45,
+            base_delay: float = 1.0
+    ) -> List[List[float]]:
+        """Синхронная обёртка над aembed (нельзя вызывать из потока самого клиента)"""
+        future = asyncio.run_coroutine_threadsafe(
+            self._embed(texts, model, input_type, embedding_type, max_retries, base_delay),
+            self._ensure_loop()
+        )
+        return future.result()
@@ -1,17 +1,21 @@
 import asyncio
 import re
-import time
 import traceback
 
 from discord_user.types import DiscordMessage, PresenceStatus, EventType
 from network_tools import ImageModels, AspectRatio
 
 import secret
-from base_classes import discord_client, event_manager, sql_database_discord, embedding_tools, network_client
+from base_classes import discord_client, event_manager, sql_database_discord, embedding_tools, network_client, \
+    chat_history_store, user_directory
 from base_logger import Logs, Color
 from event_manager import EventTypeForManager
 from functions import format_messages, save_answer_to_history, convert_answer_to_json, remove_emojis, \
-    download_image_path_from_message
+    download_image_path_from_message, StageTimer
+from json_stream import JsonArrayStreamParser
+from rate_limiter import RateLimiter
+from reply_scheduler import ReplyScheduler, PRIORITY_DM, PRIORITY_PING, PRIORITY_NAME, PRIORITY_EVERY_MESSAGE, \
+    PRIORITY_NO_REPLY
 from tts_tools import tts_audio_with_play
 
 activity = secret.activity
@@ -24,7 +28,11 @@ trigger_names = secret.trigger_names
 
 chat_gpt_model = secret.chat_gpt_model
 internet_access = secret.internet_access
+stream_reply_actions = secret.stream_reply_actions
 max_results_deepsearch = secret.max_results_deepsearch
+memories_latency_budget = secret.memories_latency_budget
+max_length_history = secret.max_length_history
+max_length_history_messages = secret.max_length_history_messages
 
 reply_on_every_message = secret.reply_on_every_message
 handling_chat_ids = secret.handling_chat_ids
@@ -33,6 +41,7 @@ say_greeting_text = secret.say_greeting_text
 max_reactions = secret.max_reactions
 send_message_limit = secret.send_message_limit
 message_delay = secret.message_delay
+max_reply_delay = secret.max_reply_delay
 
 speed = secret.tts_speed
 lang = secret.tts_lang
@@ -45,60 +54,87 @@ current_voice_chat_id = None
 current_voice_chat_members = []
 greeted_users = []  # пользователи, с которыми приветствовался бот
 
-message_counts = {"all": {"count": 0, "last_time": 0.0}}
-
-
-def is_limit_reached(limit_keys: list[str], current_time: float) -> bool:
-    """Проверяет, достигнут ли лимит для списка ключей (например, [guild_id, channel_id]) и 'all'.
-    Возвращает True, если любой лимит достигнут, иначе False. Увеличивает счетчики, если лимиты не достигнуты."""
-    # Проверка общего лимита "all" (всегда выполняется, если задан)
-    print(f"Сообщение отправлено: {limit_keys}")
-    print("message_counts", message_counts)
-    if "all" in send_message_limit:
-        if "all" not in message_counts:
-            message_counts["all"] = {"count": 0, "last_time": 0}
-        limit = send_message_limit["all"]
-        time_diff = current_time - message_counts["all"]["last_time"]
-        if time_diff < limit["time"]:
-            if message_counts["all"]["count"] >= limit["count"]:
-                return True  # Превышен общий лимит
-        else:
-            # Сбрасываем только если время вышло
-            message_counts["all"]["count"] = 0
-            message_counts["all"]["last_time"] = current_time
-
-    # Проверка лимитов для каждого ключа в списке
-    for limit_key in limit_keys:
-        # Определяем лимит: конкретный, если есть, иначе "default"
-        limit = send_message_limit.get(limit_key, send_message_limit.get("default"))
+rate_limiter = RateLimiter(send_message_limit, sql_database_discord if secret.persist_rate_limits else None)
 
-        # Если лимита нет, пропускаем проверку
-        if limit is None:
-            continue
 
-        # Если ключ еще не в message_counts, создаем его
-        if limit_key not in message_counts:
-            message_counts[limit_key] = {"count": 0, "last_time": 0}
-
-        # Проверка времени и лимита для конкретного ключа
-        time_diff = current_time - message_counts[limit_key]["last_time"]
-        if time_diff < limit["time"]:
-            if message_counts[limit_key]["count"] >= limit["count"]:
-                return True  # Лимит достигнут
-        else:
-            # Сбрасываем только если время вышло
-            message_counts[limit_key]["count"] = 0
-            message_counts[limit_key]["last_time"] = current_time
+async def check_rate_limit(message: DiscordMessage):
+    """
+    Резервирует ответ в лимите сообщений (сервер, канал, пользователь и общий "all").
+    Возвращает 0, если отвечать можно сейчас, иначе - через сколько секунд лимит освободится.
+    Если ждать дольше max_reply_delay - ставит реакцию ⏳ и возвращает None: ответа не будет
+    """
+    guild_id = str(message.guild_id)
+    channel_id = str(message.channel_id)
+    user_id = str(message.author.id)
+    limit_keys = [guild_id, channel_id] + ([user_id] if user_id in send_message_limit else [])
+    wait = rate_limiter.try_acquire(limit_keys)
+    if wait > max_reply_delay:
+        logger.logging(f"Достигнут лимит на сообщения: {limit_keys} (ещё {wait:.0f}s)", color=Color.PURPLE)
+        await discord_client.set_reaction(
+            chat_id=message.channel_id,
+            message_id=message.message_id,
+            reaction="⏳"
+        )
+        return None
+    if wait:
+        logger.logging(f"Ответ отложен на {wait:.1f}s из-за лимита: {limit_keys}", color=Color.PURPLE)
+    return wait
+
+
+async def retrieve_memories(text: str, image_task, query_embedding_task, formatted_chat_history: str,
+                            timer: StageTimer) -> str:
+    """DeepSearch по памяти персонажа. Расширение запроса через GPT стартует, как только готова картинка"""
+    image_input = await image_task
+    search_prompts = await timer.run("prompt_expansion", embedding_tools.aexpand_search_prompts(
+        text,
+        file_path=image_input,
+        formatted_chat_history=formatted_chat_history
+    ))
+    query_embedding = await query_embedding_task
+    prompt_embeddings = []
+    if search_prompts:
+        prompt_embeddings = await timer.run(
+            "prompt_embeddings",
+            embedding_tools.aget_embeddings(search_prompts, max_retries=20)
+        )
+    return await asyncio.to_thread(
+        embedding_tools.search_memories,
+        [query_embedding] + prompt_embeddings,
+        max_results=max_results_deepsearch
+    )
 
-    # Увеличиваем счетчики, если лимиты не достигнуты
-    if "all" in send_message_limit:
-        message_counts["all"]["count"] += 1
-    for limit_key in limit_keys:
-        limit = send_message_limit.get(limit_key, send_message_limit.get("default"))
-        if limit is not None:  # Увеличиваем только если лимит задан
-            message_counts[limit_key]["count"] += 1
 
-    return False
+async def wait_memories(memories_task, query_embedding_task, timer: StageTimer) -> str:
+    """
+    Ждёт память не дольше memories_latency_budget от начала ответа.
+    Если DeepSearch не успел - поиск только по эмбеддингу исходного запроса (если он уже готов).
+    """
+    try:
+        return await asyncio.wait_for(
+            asyncio.shield(memories_task),
+            timeout=max(0.0, memories_latency_budget - timer.elapsed())
+        )
+    except asyncio.TimeoutError:
+        memories_task.cancel()
+        logger.logging(f"memories_character - превышен бюджет {memories_latency_budget}s")
+    except Exception as e:
+        logger.logging(f"Error in memories_character: {e}")
+
+    # Эмбеддинг исходного запроса ждём только в пределах оставшегося бюджета
+    try:
+        query_embedding = await asyncio.wait_for(
+            asyncio.shield(query_embedding_task),
+            timeout=max(0.0, memories_latency_budget - timer.elapsed())
+        )
+    except Exception as e:
+        query_embedding_task.cancel()
+        logger.logging(f"memories_character - нет эмбеддинга запроса: {e!r}")
+        return ""
+    return await asyncio.to_thread(
+        embedding_tools.search_memories,
+        [query_embedding],
+        max_results=max_results_deepsearch
+    )
 
 
 def get_nick(message: DiscordMessage):
@@ -110,52 +146,120 @@ def get_nick(message: DiscordMessage):
     # return nickname
 
 
-async def on_message_thread(message: DiscordMessage):
-    text = message.text
-    nickname = get_nick(message)
-    # замена всех <@...> на имена известных пользователей. Включая своё имя, но подставив в него character_name
-    known_users = sql_database_discord.get("known_users", {})
-    known_users[str(message.author.id)] = nickname
-    sql_database_discord["known_users"] = known_users
-
-    mentions = re.findall(r"<@(\d+)>", text)
-
-    for mention in mentions:
-        user_id = str(mention)
-        # Заменяем упоминание твоего имени
-        if user_id == discord_client.info.user_id:
-            text = text.replace(f"<@{mention}>", character_name)
-        elif user_id in known_users:
-            # Заменяем на имя известного пользователя
-            nickname_this = known_users[user_id]
-            text = text.replace(f"<@{mention}>", nickname_this)
-        # Если пользователя нет в known_users, можно оставить оригинальное упоминание
+async def chatgpt_answer_chunks(prompt: str, file_path=None):
+    """
+    Куски текста ответа GPT для JsonArrayStreamParser.
+    network_client.chatgpt_api отдаёт ответ целиком, поэтому сейчас это один кусок и stream_reply_actions
+    ничего не ускоряет; потоковый источник (или fake_llm_stream) подключается сюда без изменений в разборе.
+    """
+    answer_gpt = await asyncio.to_thread(
+        network_client.chatgpt_api,
+        prompt=prompt,
+        model=chat_gpt_model,
+        internet_access=internet_access,
+        file_path=file_path
+    )
+    yield answer_gpt.response.text
 
-    response_text = None
-    image_input = None
 
-    logger.logging(f"Got message. {nickname}: {text}")
+async def dispatch_action(action: dict, message: DiscordMessage, nickname: str, state: dict):
+    """Выполняет одно действие из ответа GPT. state - счётчики и текст ответа в рамках одного ответа"""
+    if not isinstance(action, dict):
+        return
+    if action.get("event_type") != "reaction":  # todo Если будут другие события
+        # Отправка сообщения
+        if state["messages"]:  # пауза между сообщениями
+            await asyncio.sleep(message_delay)
+
+        # Найти кому ответить
+        reply_to = action.get("reply_to", "") or ""
+        reply_message = None
+        if reply_to.lower() == nickname.lower() or not reply_to:
+            reply_message = message
+        else:
+            history_messages = discord_client.get_messages(message.channel_id)
+            history_messages = reversed(history_messages)
+            for history_message in history_messages:
+                if reply_to.lower() == get_nick(history_message).lower():
+                    reply_message = history_messages
+                    break
+
+        message_text = remove_emojis(action.get("text", ""))
+        image_desc = action.get("image")
+
+        if image_desc:
+            # Генерация и отправка картинки
+            image_prompt = image_desc
+            for image_group in network_client.image_generate_api(
+                    [ImageModels.gemini],
+                    image_prompt,
+                    AspectRatio.ratio_3x2,
+                    send_url=True
+            ):
+                if image_group and len(image_group) > 0:
+                    try:
+                        await discord_client.send_message(
+                            chat_id=message.channel_id,
+                            text=message_text + f"[̤̮]({image_group[0]})",
+                            reply_message=reply_message if state["messages"] == 0 else None
+                        )
+                    except Exception as e:  # если история чата скрыта, будет ошибка
+                        logger.logging(f"Error in send 1: {e}")
+                        await discord_client.send_message(
+                            chat_id=message.channel_id,
+                            text=message_text + f"[̤̮]({image_group[0]})"
+                        )
+        elif message_text.strip():
+            # Отправка текстового сообщения
+            try:  # если история чата скрыта, будет ошибка
+                await discord_client.send_message(
+                    chat_id=message.channel_id,
+                    text=message_text,
+                    reply_message=reply_message if state["messages"] == 0 else None
+                )
+            except Exception as e:
+                logger.logging(f"Error in send 1: {e}")
+                await discord_client.send_message(
+                    chat_id=message.channel_id,
+                    text=message_text
+                )
+        state["messages"] += 1
+        response_text = state["response_text"]
+        response_text = message_text if not response_text else f"{response_text}\n{message_text}"
+        if image_desc:
+            response_text += f"\n<image>{image_desc}</image>"
+        state["response_text"] = response_text
+
+    elif action.get("event_type") == "reaction":
+        # Установка реакции
+        reaction = action.get("reaction")
+        if reaction and state["reactions"] < max_reactions:
+            await discord_client.set_reaction(
+                chat_id=message.channel_id,
+                message_id=message.message_id,
+                reaction=reaction
+            )
+            state["reactions"] += 1
 
-    # Получаем контекст
-    if message.channel_id == current_voice_chat_id:
-        context = EventTypeForManager.voice_chat_text_messages
-    else:
-        context = None
 
-    chat_history_key = f'chat_history_{message.channel_id}'
+def prepare_text(message: DiscordMessage, nickname: str) -> str:
+    """Текст сообщения, где <@...> заменены на имена известных пользователей (своё - на character_name)"""
+    user_directory.remember(message.author.id, nickname)
+    return user_directory.rewrite_mentions(message.text, discord_client.info.user_id, character_name)
 
-    if '/clear' in message.text:
-        sql_database_discord[chat_history_key] = []
-        logger.logging(f"История очищена для: {chat_history_key}")
-        return
 
-    chat_history = sql_database_discord.get(chat_history_key, [])
+def reply_priority(message: DiscordMessage, text: str) -> int:
+    """Приоритет ответа: ЛС > пинг или ответ на сообщение бота > упоминание имени > reply_on_every_message"""
+    if not message.guild_id:
+        return PRIORITY_DM
     # Проверка упоминаний
     mention_ids = [mention["id"] for mention in message.mentions]
     user_ping = discord_client.info.user_id in mention_ids
     print("message.mentions", message.mentions, user_ping)
     if message.referenced_message:
         user_ping = user_ping or discord_client.info.user_id == message.referenced_message.author.id
+    if user_ping:
+        return PRIORITY_PING
     # mention_here = message.mention_everyone
     name_mention = any(
         obj.lower() in text.lower() for obj in [
@@ -165,44 +269,85 @@ async def on_message_thread(message: DiscordMessage):
             character_name
         ] + trigger_names
     )
+    if name_mention:
+        return PRIORITY_NAME
+    if reply_on_every_message:
+        return PRIORITY_EVERY_MESSAGE
+    return PRIORITY_NO_REPLY
 
-    if user_ping or name_mention or reply_on_every_message or not message.guild_id:
-        # Проверка лимита сообщений
-        current_time = time.time()
-        guild_id = str(message.guild_id)
-        channel_id = str(message.channel_id)
-        if is_limit_reached([guild_id, channel_id], current_time):
-            logger.logging(f"Достигнут лимит на сообщения: {[guild_id, channel_id]}", color=Color.PURPLE)
-            await discord_client.set_reaction(
-                chat_id=message.channel_id,
-                message_id=message.message_id,
-                reaction="⏳"
-            )
-        else:
+
+async def on_message_thread(channel_id: str, items: list, shed: bool = False):
+    """
+    Ответ на пачку сообщений одного канала (items: (message, nickname, text, priority) из reply_scheduler).
+    Отвечает на самое важное из последних сообщений, которые требуют ответа, остальные сообщения пачки
+    попадают в промпт как новые сообщения канала. shed - пачка слишком долго ждала: только сохранение в историю.
+    Возвращает число секунд, если ответ упёрся в лимит сообщений: reply_scheduler выдаст пачку снова
+    """
+    chat_history_key = f'chat_history_{channel_id}'
+    chat_history_store.migrate(channel_id, sql_database_discord, chat_history_key)
+
+    batch = []  # (message, nickname, text, priority)
+    for item in items:
+        if '/clear' in item[0].text:
+            chat_history_store.clear(channel_id)
+            logger.logging(f"История очищена для: {chat_history_key}")
+            batch.clear()  # сообщения до /clear тоже не сохраняются
+            continue
+        batch.append(item)
+    if not batch:
+        return
+    if len(batch) > 1:
+        logger.logging(f"Пачка из {len(batch)} сообщений: {channel_id}")
+
+    response_text = None
+    image_input = None
+
+    # Получаем контекст
+    if channel_id == current_voice_chat_id:
+        context = EventTypeForManager.voice_chat_text_messages
+    else:
+        context = None
+
+    chat_history = chat_history_store.recent(channel_id, max_length_history_messages, max_length_history)
+    reply_to = [item for item in batch if item[3] != PRIORITY_NO_REPLY]
+
+    if reply_to and not shed:
+        message, nickname, text, _ = min(reversed(reply_to), key=lambda item: item[3])
+        # Остальные сообщения, пришедшие пока бот отвечал, идут в тот же промпт
+        new_messages = "\n".join(f"{item[1]}: {item[2]}" for item in batch if item[0] is not message)
+
+        # Проверка лимита сообщений: короткое ожидание - пачка возвращается в очередь канала
+        # (воркер не занят, новые сообщения канала попадут в неё же), длинное - реакция ⏳
+        wait = await check_rate_limit(message)
+        if wait:
+            return wait
+        if wait is not None:
             try:
                 asyncio.ensure_future(discord_client.send_typing(message.channel_id))
+                timer = StageTimer()
 
-                formatted_chat_history = format_messages(chat_history)
-
-                image_input = await asyncio.to_thread(download_image_path_from_message, message)
+                # Независимые этапы стартуют одновременно: картинка, эмбеддинг запроса, история
+                image_task = asyncio.ensure_future(
+                    timer.run("image", asyncio.to_thread(download_image_path_from_message, message))
+                )
+                query_embedding_task = memories_task = None
+                if text and text.strip():
+                    query_embedding_task = asyncio.ensure_future(
+                        timer.run("query_embedding", embedding_tools.aget_embedding(text, max_retries=20))
+                    )
+                with timer.stage("history"):
+                    formatted_chat_history = format_messages(chat_history)
+                if query_embedding_task:
+                    memories_task = asyncio.ensure_future(timer.run("memories", retrieve_memories(
+                        text, image_task, query_embedding_task, formatted_chat_history, timer
+                    )))
+
+                image_input = await image_task
                 print("img input", image_input)
 
                 memories_character = ""  # значение по умолчанию
-                try:
-                    memories_character = await asyncio.wait_for(
-                        asyncio.to_thread(embedding_tools.get_memories,
-                                          text,
-                                          deepsearch=True,
-                                          file_path=image_input,
-                                          formatted_chat_history=formatted_chat_history,
-                                          max_results=max_results_deepsearch
-                                          ),
-                        timeout=60.0  #  время в секундах
-                    )
-                except asyncio.TimeoutError:
-                    logger.logging("memories_character - timed out")
-                except Exception as e:
-                    logger.logging(f"Error in memories_character: {e}")
+                if memories_task:
+                    memories_character = await wait_memories(memories_task, query_embedding_task, timer)
 
                 prompt_words = str(text).count(" ")
                 if image_input:
@@ -225,127 +370,73 @@ async def on_message_thread(message: DiscordMessage):
                     f"# Примеры вывода\n{answer_json_examples}\n\n"  # для Json
                     f"# История сообщений\n"
                     f"{formatted_chat_history}\n\n"  # '# Nickname\nText\n# Char\nText'
+                    + (f"# Новые сообщения\n{new_messages}\n\n" if new_messages else "") +
                     f"# Текущий запрос {nickname}\n"
                     f"{text}"
                 ).replace("NUM_SENTENCES", num_sentences, 1)
 
-                answer_gpt = await asyncio.to_thread(
-                    network_client.chatgpt_api,
-                    prompt=full_prompt,
-                    model=chat_gpt_model,
-                    internet_access=internet_access,
-                    file_path=image_input
-                )
-
-                converted, json_answer = convert_answer_to_json(
-                    answer_gpt.response.text,
-                    end_symbol="]",
-                    start_symbol="[",
-                    keys=[]
-                )
-
-                send_reactions = 0
-                send_messages = 0
-
-                # Обработка JSON-ответа
-                for n_action, action in enumerate(json_answer):
-                    if action.get("event_type") != "reaction": # todo Если будут другие события
-                        # Отправка сообщения
-
-                        # Найти кому ответить
-                        reply_to = action.get("reply_to", "")
-                        reply_message = None
-                        if reply_to.lower() == nickname.lower() or not reply_to:
-                            reply_message = message
-                        else:
-                            history_messages = discord_client.get_messages(message.channel_id)
-                            history_messages = reversed(history_messages)
-                            for history_message in history_messages:
-                                if reply_to.lower() == get_nick(history_message).lower():
-                                    reply_message = history_messages
-                                    break
-
-                        message_text = remove_emojis(action.get("text", ""))
-                        image_desc = action.get("image")
-
-                        if image_desc:
-                            # Генерация и отправка картинки
-                            image_prompt = image_desc
-                            for image_group in network_client.image_generate_api(
-                                    [ImageModels.gemini],
-                                    image_prompt,
-                                    AspectRatio.ratio_3x2,
-                                    send_url=True
-                            ):
-                                if image_group and len(image_group) > 0:
-                                    try:
-                                        await discord_client.send_message(
-                                            chat_id=message.channel_id,
-                                            text=message_text + f"[̤̮]({image_group[0]})",
-                                            reply_message=reply_message if send_messages == 0 else None
-                                        )
-                                    except Exception as e:  # если история чата скрыта, будет ошибка
-                                        logger.logging(f"Error in send 1: {e}")
-                                        await discord_client.send_message(
-                                            chat_id=message.channel_id,
-                                            text=message_text + f"[̤̮]({image_group[0]})"
-                                        )
-                        elif message_text.strip():
-                            # Отправка текстового сообщения
-                            try:  # если история чата скрыта, будет ошибка
-                                await discord_client.send_message(
-                                    chat_id=message.channel_id,
-                                    text=message_text,
-                                    reply_message=reply_message if send_messages == 0 else None
-                                )
-                            except Exception as e:
-                                logger.logging(f"Error in send 1: {e}")
-                                await discord_client.send_message(
-                                    chat_id=message.channel_id,
-                                    text=message_text
-                                )
-                        send_messages += 1
-                        if n_action != len(json_answer) - 1:  # не последний ивент
-                            await asyncio.sleep(message_delay)
-                        response_text = message_text if not response_text else f"{response_text}\n{message_text}"
-                        if image_desc:
-                            response_text += f"\n<image>{image_desc}</image>"
-
-                    elif action.get("event_type") == "reaction":
-                        # Установка реакции
-                        reaction = action.get("reaction")
-                        if reaction and send_reactions < max_reactions:
-                            await discord_client.set_reaction(
-                                chat_id=message.channel_id,
-                                message_id=message.message_id,
-                                reaction=reaction
-                            )
-                            send_reactions += 1
+                # С stream_reply_actions действия отправляются по мере того,
+                # как в ответе GPT заканчивается очередной объект
+                state = {"messages": 0, "reactions": 0, "response_text": None}
+                answer_text = ""
+                with timer.stage("answer"):
+                    parser = JsonArrayStreamParser() if stream_reply_actions else None
+                    async for chunk in chatgpt_answer_chunks(full_prompt, image_input):
+                        answer_text += chunk
+                        if parser is None:
+                            continue
+                        for action in parser.feed(chunk):
+                            if "first_action" not in timer.stages:
+                                timer.stages["first_action"] = timer.elapsed()
+                            await dispatch_action(action, message, nickname, state)
+
+                    if not state["messages"] and not state["reactions"]:
+                        # Разбор ответа целиком (или потоковый парсер ничего не разобрал)
+                        converted, json_answer = convert_answer_to_json(
+                            answer_text,
+                            end_symbol="]",
+                            start_symbol="[",
+                            keys=[]
+                        )
+                        if not converted:
+                            logger.logging(f"Не конвертировался ответ: {answer_text[:200]}")
+                            json_answer = []
+                        for action in json_answer:
+                            await dispatch_action(action, message, nickname, state)
+                response_text = state["response_text"]
+                logger.logging(f"Этапы ответа: {timer.summary()}", color=Color.CYAN)
             except Exception as e:
                 logger.logging(f"CRITICAL ERROR IN DS_USER: {traceback.format_exc()}")
-    elif text is not None:
-        logger.logging(f"Skip reply: {text[:20]}")
-
-    # Сохранение в память
-    if context and text:
-        event_manager.create_event(
-            f"{nickname}: {text}",
-            context=context,
-            static=False
-        )
-    elif image_input or text:
-        chat_history = save_answer_to_history(
-            chat_history=chat_history,
-            prompt=text,
-            user_nickname=nickname,
-            answer=response_text,
-            character_nickname=character_name
-        )
-        sql_database_discord[chat_history_key] = chat_history
     else:
-        logger.logging(f"Пропуск сохранения ответа: {message.text} ({nickname}, <@{message.author.id}>)")
+        for _, _, text, _ in batch:
+            if text is not None:
+                logger.logging(f"Skip reply: {text[:20]}")
+
+    # Сохранение в память: сообщения пачки по порядку, ответ после них
+    new_history = []
+    for message, nickname, text, _ in batch:
+        if context and text:
+            event_manager.create_event(
+                f"{nickname}: {text}",
+                context=context,
+                static=False
+            )
+        elif image_input or text:
+            save_answer_to_history(new_history, prompt=text, user_nickname=nickname, answer=None,
+                                   character_nickname=None)
+        else:
+            logger.logging(f"Пропуск сохранения ответа: {message.text} ({nickname}, <@{message.author.id}>)")
+    if new_history:
+        save_answer_to_history(new_history, prompt=None, user_nickname=None, answer=response_text,
+                               character_nickname=character_name)
+        chat_history_store.append(channel_id, new_history)
 
-    logger.logging(f"end generate: {message.channel_id}")
+    logger.logging(f"end generate: {channel_id}")
+
+
+# Ограниченный пул ответов: приоритеты, очередь каждого канала, пропуск устаревших пачек
+reply_scheduler = ReplyScheduler(on_message_thread, workers=secret.reply_workers, max_wait=secret.max_reply_wait,
+                                 coalesce=secret.coalesce_messages)
 
 
 @discord_client.message_handler
@@ -357,7 +448,11 @@ async def on_message(message: DiscordMessage):
     # print("in_handle_guild", in_handle_guild)
     if message.author.id == discord_client.info.user_id or (not in_handle_channel and not in_handle_guild):
         return
-    asyncio.ensure_future(on_message_thread(message))
+    nickname = get_nick(message)
+    text = prepare_text(message, nickname)
+    logger.logging(f"Got message. {nickname}: {text}")
+    priority = reply_priority(message, text)
+    reply_scheduler.submit(str(message.channel_id), priority, (message, nickname, text, priority))
 
 
 @discord_client.on_start
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from base_logger import Logs
+
+logger = Logs(warnings=True, name="embedding-cache")
+
+
+class EmbeddingCache:
+    """
+    Постоянный кэш эмбеддингов в SQLite, общий для всех перезапусков.
+
+    Ключ - sha256(model, input_type, embedding_type, text), так что одинаковый текст
+    всегда даёт одну запись. При превышении max_size_mb удаляются давно не использованные записи.
+    """
+
+    def __init__(self, path: str = "embedding_cache.db", max_size_mb: float = 512):
+        self.path = path
+        self.max_size = int(max_size_mb * 2 ** 20)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(text: str, model: str, input_type: str, embedding_type: str) -> str:
+        return hashlib.sha256("\0".join((model, input_type, embedding_type, text)).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _encode(embedding, embedding_type: str) -> bytes:
+        if embedding_type == "float":
+            return np.asarray(embedding, dtype=np.float32).tobytes()
+        return json.dumps(embedding).encode("utf-8")
+
+    @staticmethod
+    def _decode(value: bytes, embedding_type: str) -> list:
+        if embedding_type == "float":
+            return np.frombuffer(value, dtype=np.float32).tolist()
+        return json.loads(value)
+
+    def get_many(self, texts: list, model: str, input_type: str, embedding_type: str) -> dict:
+        """Возвращает {text: embedding} для найденных в кэше текстов"""
+        keys = {self.make_key(text, model, input_type, embedding_type): text for text in texts}
+        found = {}
+        with self._lock:
+            key_list = list(keys)
+            for i in range(0, len(key_list), 500):  # ограничение SQLite на число параметров
+                chunk = key_list[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, value in rows:
+                    found[keys[key]] = self._decode(value, embedding_type)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, self.make_key(text, model, input_type, embedding_type)) for text in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, embeddings: dict, model: str, input_type: str, embedding_type: str):
+        """Сохраняет {text: embedding}"""
+        now = time.time()
+        rows = []
+        for text, embedding in embeddings.items():
+            value = self._encode(embedding, embedding_type)
+            rows.append((self.make_key(text, model, input_type, embedding_type), value, len(value), now))
+
+        with self._lock:
+            for key, value, size, _ in rows:
+                old = self._conn.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+                self._total_size += size - (old[0] if old else 0)
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+            if self._total_size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Удаляет самые старые по использованию записи, пока кэш не станет меньше 90% лимита"""
+        target = self.max_size * 0.9
+        removed = 0
+        while self._total_size > target:
+            rows = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key, _ in rows])
+            self._total_size -= sum(size for _, size in rows)
+            removed += len(rows)
+        self._conn.commit()
+        logger.logging(f"Кэш эмбеддингов: удалено {removed} записей, размер {self._total_size / 2 ** 20:.1f} MB")
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": count,
+            "size_mb": self._total_size / 2 ** 20
+        }
@@ -0,0 +1,266 @@
+import json
+import os
+from typing import List
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Нормирует строки матрицы (нулевые строки остаются нулевыми)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EmbeddingIndex:
+    """
+    Индекс пар вопрос-ответ для быстрого поиска.
+
+    Все эмбеддинги лежат в одной непрерывной нормированной float32 матрице в порядке
+    [заголовки; вопросы; ответы], поэтому запрос оценивается одним умножением матрицы на вектор.
+    metadata[i] описывает i-ю пару, header_ids[i] - номер её заголовка.
+    """
+
+    def __init__(self, vectors: np.ndarray, header_ids: np.ndarray, headers: List[tuple], metadata: List[dict]):
+        self.vectors = vectors
+        self.header_ids = header_ids
+        self.headers = headers  # [(json_name, header), ...]
+        self.metadata = metadata  # [{"json_name", "header", "question", "answer"}, ...]
+
+        self.n_headers = len(headers)
+        self.n_pairs = len(metadata)
+
+    def __len__(self):
+        return self.n_pairs
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int32), [], [])
+
+    @classmethod
+    def from_dataset(cls, embeddings_dataset: dict):
+        """Строит индекс из словаря {json_name: {header: [{"embedings"}, {qa}, ...]}}"""
+        headers = []
+        header_vectors = []
+        question_vectors = []
+        answer_vectors = []
+        header_ids = []
+        metadata = []
+
+        for json_name, json_data in embeddings_dataset.items():
+            for header, items in json_data.items():
+                if not items:
+                    continue
+                header_id = len(headers)
+                headers.append((json_name, header))
+                header_vectors.append(items[0]["embedings"])
+
+                for qa in items[1:]:
+                    header_ids.append(header_id)
+                    question_vectors.append(qa["embeddings_question"])
+                    answer_vectors.append(qa["embeddings_answer"])
+                    metadata.append({
+                        "json_name": json_name,
+                        "header": header,
+                        "question": qa["question"],
+                        "answer": qa["answer"]
+                    })
+
+        if not headers:
+            return cls.empty()
+
+        vectors = normalize_rows(np.array(header_vectors + question_vectors + answer_vectors, dtype=np.float32))
+        return cls(vectors, np.array(header_ids, dtype=np.int32), headers, metadata)
+
+    @classmethod
+    def concat(cls, indexes: list):
+        """Объединяет несколько индексов в один"""
+        indexes = [index for index in indexes if index.n_headers]
+        if not indexes:
+            return cls.empty()
+        if len(indexes) == 1:
+            return indexes[0]
+
+        headers = []
+        metadata = []
+        header_ids = []
+        header_parts, question_parts, answer_parts = [], [], []
+        for index in indexes:
+            h, p = index.n_headers, index.n_pairs
+            header_ids.append(index.header_ids + len(headers))
+            headers.extend(index.headers)
+            metadata.extend(index.metadata)
+            header_parts.append(index.vectors[:h])
+            question_parts.append(index.vectors[h:h + p])
+            answer_parts.append(index.vectors[h + p:])
+
+        vectors = np.ascontiguousarray(np.concatenate(header_parts + question_parts + answer_parts), dtype=np.float32)
+        return cls(vectors, np.concatenate(header_ids).astype(np.int32), headers, metadata)
+
+    def to_dataset(self) -> dict:
+        """Обратное преобразование в {json_name: {header: [{"embedings"}, {qa}, ...]}} (векторы - строки матрицы)"""
+        h, p = self.n_headers, self.n_pairs
+        dataset = {}
+        for header_id, (json_name, header) in enumerate(self.headers):
+            dataset.setdefault(json_name, {})[header] = [{"embedings": self.vectors[header_id]}]
+        for i, meta in enumerate(self.metadata):
+            dataset[meta["json_name"]][meta["header"]].append({
+                "question": meta["question"],
+                "answer": meta["answer"],
+                "embeddings_question": self.vectors[h + i],
+                "embeddings_answer": self.vectors[h + p + i]
+            })
+        return dataset
+
+    def save(self, path: str, dtype: str = "float32"):
+        """
+        Сохраняет индекс в бинарном виде: path (.npy, матрица [заголовки; вопросы; ответы])
+        и path без расширения + .meta (JSON с текстами). Файлы заменяются атомарно.
+        На Windows заменить файл, открытый через memmap, нельзя: перед записью индекс, загруженный
+        из path с mmap=True, нужно отпустить (см. EmbeddingsStore.write_file).
+        """
+        base = os.path.splitext(path)[0]
+        meta = {"dtype": dtype, "headers": [list(item) for item in self.headers], "pairs": []}
+        for header_id, item in zip(self.header_ids.tolist(), self.metadata):
+            meta["pairs"].append([header_id, item["question"], item["answer"]])
+
+        tmp_meta = f"{base}.meta.tmp"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        tmp_vectors = f"{base}.tmp.npy"
+        np.save(tmp_vectors, np.ascontiguousarray(self.vectors, dtype=dtype))
+
+        os.replace(tmp_meta, f"{base}.meta")
+        os.replace(tmp_vectors, f"{base}.npy")
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """Загружает индекс, сохранённый через save(). float32 открывается через memmap без копирования"""
+        base = os.path.splitext(path)[0]
+        with open(f"{base}.meta", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        vectors = np.load(f"{base}.npy", mmap_mode='r' if mmap else None)
+        if vectors.dtype != np.float32:
+            # float16 на диске хранится компактно, но считается в float32
+            vectors = vectors.astype(np.float32)
+
+        headers = [tuple(item) for item in meta["headers"]]
+        header_ids = np.array([pair[0] for pair in meta["pairs"]], dtype=np.int32)
+        metadata = [
+            {"json_name": headers[header_id][0], "header": headers[header_id][1], "question": question, "answer": answer}
+            for header_id, question, answer in meta["pairs"]
+        ]
+        if not headers:
+            return cls.empty()
+        return cls(vectors, header_ids, headers, metadata)
+
+    def score(self, query_embedding) -> tuple:
+        """
+        Схожесть запроса со всеми парами.
+
+        Returns:
+            (similarity, header_similarity, question_similarity, answer_similarity) - массивы длиной n_pairs
+        """
+        query = normalize_rows(query_embedding)[0]
+        scores = self.vectors @ query
+
+        h, p = self.n_headers, self.n_pairs
+        header_similarity = scores[:h][self.header_ids]
+        question_similarity = scores[h:h + p]
+        answer_similarity = scores[h + p:]
+        # Максимальная схожесть (вопрос или ответ) + половина схожести с темой
+        similarity = np.maximum(question_similarity, answer_similarity) + header_similarity / 2
+        return similarity, header_similarity, question_similarity, answer_similarity
+
+    def score_many(self, query_embeddings) -> np.ndarray:
+        """Схожесть нескольких запросов со всеми парами одним умножением матриц. Форма: (число запросов, n_pairs)"""
+        scores = normalize_rows(query_embeddings) @ self.vectors.T
+
+        h, p = self.n_headers, self.n_pairs
+        return np.maximum(scores[:, h:h + p], scores[:, h + p:]) + scores[:, :h][:, self.header_ids] / 2
+
+    @property
+    def question_ids(self) -> np.ndarray:
+        """Номер уникального текста вопроса для каждой пары (для удаления дублей)"""
+        if getattr(self, "_question_ids", None) is None:
+            _, self._question_ids = np.unique([item["question"] for item in self.metadata], return_inverse=True)
+        return self._question_ids
+
+    @staticmethod
+    def _top_ids(similarity: np.ndarray, top_k: int) -> np.ndarray:
+        """Номера top_k лучших по убыванию (при равенстве - в исходном порядке)"""
+        if top_k < len(similarity):
+            top_ids = np.sort(np.argpartition(-similarity, top_k - 1)[:top_k])
+        else:
+            top_ids = np.arange(len(similarity))
+        return top_ids[np.argsort(-similarity[top_ids], kind="stable")]
+
+    def _top_unique_ids(self, similarity: np.ndarray, top_k: int) -> np.ndarray:
+        """Как _top_ids, но каждый текст вопроса встречается один раз (с лучшей схожестью)"""
+        question_ids = self.question_ids
+        candidates = min(self.n_pairs, top_k * 4)
+        while True:
+            top_ids = self._top_ids(similarity, candidates)
+            _, first = np.unique(question_ids[top_ids], return_index=True)
+            top_ids = top_ids[np.sort(first)]
+            if len(top_ids) >= top_k or candidates >= self.n_pairs:
+                return top_ids[:top_k]
+            candidates = min(self.n_pairs, candidates * 4)
+
+    def _items(self, ids, similarity, header_similarity, question_similarity, answer_similarity) -> List[dict]:
+        return [
+            {
+                **self.metadata[pair_id],
+                "similarity": float(similarity[i]),
+                "header_similarity": float(header_similarity[i]),
+                "question_similarity": float(question_similarity[i]),
+                "answer_similarity": float(answer_similarity[i])
+            }
+            for i, pair_id in enumerate(ids)
+        ]
+
+    def search(self, query_embedding, top_k=3) -> List[dict]:
+        """Top-k пар по схожести с запросом (формат как у EmbeddingTools.search_similar_questions)"""
+        if not self.n_pairs or top_k <= 0:
+            return []
+
+        similarity, header_similarity, question_similarity, answer_similarity = self.score(query_embedding)
+        top_ids = self._top_ids(similarity, top_k)
+        return self._items(
+            top_ids,
+            similarity[top_ids],
+            header_similarity[top_ids],
+            question_similarity[top_ids],
+            answer_similarity[top_ids]
+        )
+
+    def search_many(self, query_embeddings, top_k=5) -> List[dict]:
+        """
+        Top-k пар сразу по нескольким запросам: у пары берётся лучшая схожесть среди запросов,
+        повторяющиеся вопросы убираются. Все запросы считаются одним умножением матриц.
+        """
+        if not self.n_pairs or top_k <= 0:
+            return []
+
+        queries = normalize_rows(query_embeddings)
+        similarity_matrix = self.score_many(queries)
+        best_query = similarity_matrix.argmax(axis=0)
+        similarity = similarity_matrix[best_query, np.arange(self.n_pairs)]
+        top_ids = self._top_unique_ids(similarity, top_k)
+
+        # Составляющие схожести нужны только для отобранных пар
+        h, p = self.n_headers, self.n_pairs
+        top_queries = queries[best_query[top_ids]]
+        header_similarity = np.einsum("ij,ij->i", top_queries, self.vectors[self.header_ids[top_ids]])
+        question_similarity = np.einsum("ij,ij->i", top_queries, self.vectors[h + top_ids])
+        answer_similarity = np.einsum("ij,ij->i", top_queries, self.vectors[h + p + top_ids])
+        return self._items(top_ids, similarity[top_ids], header_similarity, question_similarity, answer_similarity)
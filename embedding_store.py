@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from base_logger import Logs
+from embedding_index import EmbeddingIndex
+
+logger = Logs(warnings=True, name="embedding-store")
+
+STORAGE_EXTENSIONS = {"json": ".json", "npy": ".npy"}
+
+
+def json_name_of(path: str) -> str:
+    """Имя датасета, под которым файл виден в поиске ('name.json' и для .json, и для .npy)"""
+    return os.path.splitext(os.path.basename(path))[0] + ".json"
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def read_embeddings_file(path: str) -> dict:
+    """
+    Читает файл dataset_embeddings (.json или .npy) в формате {header: [{"embedings"}, {qa}, ...]}.
+    .npy читается в память без memmap: результат обычно изменяют и записывают поверх того же файла
+    """
+    if path.endswith(".npy"):
+        return EmbeddingIndex.load(path, mmap=False).to_dataset().get(json_name_of(path), {})
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_embeddings_file(path: str, data: dict, dtype: str = "float32"):
+    """Записывает файл dataset_embeddings. Формат определяется расширением пути"""
+    if path.endswith(".npy"):
+        EmbeddingIndex.from_dataset({json_name_of(path): data}).save(path, dtype=dtype)
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=_json_default)
+
+
+def convert_json_folder(folder: str, dtype: str = "float32"):
+    """Одноразовая конвертация всех name.json в папке в name.npy + name.meta"""
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith('.json'):
+            continue
+        json_path = os.path.join(folder, filename)
+        npy_path = os.path.splitext(json_path)[0] + ".npy"
+        start_time = time.time()
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        write_embeddings_file(npy_path, data, dtype=dtype)
+        logger.logging(f"{filename} -> {os.path.basename(npy_path)} ({dtype}): "
+                       f"{os.path.getsize(json_path) / 2 ** 20:.1f} MB -> {os.path.getsize(npy_path) / 2 ** 20:.1f} MB, "
+                       f"{time.time() - start_time:.2f}s")
+
+
+class EmbeddingsStore:
+    """
+    Резидентное хранилище dataset_embeddings.
+
+    Файлы читаются один раз и держатся в памяти вместе с готовым EmbeddingIndex.
+    Изменённые на диске файлы определяются по (mtime, size) и перечитываются по одному,
+    проверка диска выполняется не чаще check_interval секунд.
+    В формате "npy" матрицы открываются через memmap: старт почти мгновенный, а несколько
+    процессов бота делят одни и те же страницы в page cache.
+    """
+
+    def __init__(self, folder: str, check_interval: float = 5.0, storage_format: str = "json"):
+        if storage_format not in STORAGE_EXTENSIONS:
+            raise ValueError(f"Unknown storage format: {storage_format}")
+        self.folder = folder
+        self.check_interval = check_interval
+        self.storage_format = storage_format
+        self.extension = STORAGE_EXTENSIONS[storage_format]
+
+        self._files = {}  # json_name -> {"path", "stat", "index"}
+        self._combined = {}  # tuple(json_names) -> EmbeddingIndex
+        self._last_check = 0.0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _file_stat(path: str):
+        paths = [path, os.path.splitext(path)[0] + ".meta"] if path.endswith(".npy") else [path]
+        try:
+            stats = [os.stat(p) for p in paths]
+        except OSError:
+            return None
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+    def _load_file(self, path: str, stat) -> bool:
+        json_name = json_name_of(path)
+        try:
+            if path.endswith(".npy"):
+                index = EmbeddingIndex.load(path)
+            else:
+                # В памяти остаётся только индекс: разобранный JSON со списками float в разы больше
+                with open(path, 'r', encoding='utf-8') as f:
+                    index = EmbeddingIndex.from_dataset({json_name: json.load(f)})
+        except (OSError, ValueError) as e:
+            logger.logging(f"Error loading {path}: {e}")
+            return False
+
+        self._files[json_name] = {"path": path, "stat": stat, "index": index}
+        logger.logging(f"Загружен датасет: {os.path.basename(path)}")
+        return True
+
+    def refresh(self, force: bool = False):
+        """Перечитывает только новые и изменённые файлы, удаляет пропавшие"""
+        with self._lock:
+            if not force and time.time() - self._last_check < self.check_interval:
+                return
+            self._last_check = time.time()
+
+            if not os.path.isdir(self.folder):
+                return
+
+            changed = False
+            on_disk = set()
+            for filename in os.listdir(self.folder):
+                if not filename.endswith(self.extension):
+                    continue
+                json_name = json_name_of(filename)
+                on_disk.add(json_name)
+                path = os.path.join(self.folder, filename)
+                stat = self._file_stat(path)
+                cached = self._files.get(json_name)
+                if stat is not None and (cached is None or cached["stat"] != stat):
+                    changed |= self._load_file(path, stat)
+
+            for json_name in list(self._files):
+                in_folder = os.path.abspath(os.path.dirname(self._files[json_name]["path"])) == os.path.abspath(self.folder)
+                if json_name not in on_disk and in_folder:
+                    del self._files[json_name]
+                    changed = True
+
+            if changed:
+                self._combined.clear()
+
+    def signature(self) -> str:
+        """Отпечаток текущего состояния файлов (меняется при любом изменении датасета)"""
+        with self._lock:
+            state = sorted((json_name, entry["path"], entry["stat"]) for json_name, entry in self._files.items())
+        return hashlib.sha1(repr(state).encode("utf-8")).hexdigest()
+
+    def update_file(self, path: str, data: dict):
+        """Обновляет файл в памяти после записи на диск (без повторного чтения JSON)"""
+        json_name = json_name_of(path)
+        with self._lock:
+            self._files[json_name] = {
+                "path": path,
+                "stat": self._file_stat(path),
+                "index": EmbeddingIndex.from_dataset({json_name: data})
+            }
+            self._combined.clear()
+
+    def write_file(self, path: str, data: dict, dtype: str = "float32"):
+        """
+        Записывает файл на диск и обновляет его в памяти.
+        Старый memmap файла отпускается до замены: на Windows файл, открытый через memmap, заменить нельзя
+        """
+        json_name = json_name_of(path)
+        with self._lock:
+            self._files.pop(json_name, None)
+            self._combined.clear()
+            write_embeddings_file(path, data, dtype=dtype)
+            self.update_file(path, data)
+
+    def _json_names(self, json_files=None) -> tuple:
+        if json_files is None:
+            return tuple(sorted(self._files))
+
+        json_names = []
+        for file_path in json_files:
+            json_name = json_name_of(file_path)
+            if json_name not in self._files:
+                path = os.path.splitext(file_path)[0] + self.extension
+                stat = self._file_stat(path)
+                if stat is None or not self._load_file(path, stat):
+                    logger.logging(f"Warning: File {file_path} does not exist")
+                    continue
+            json_names.append(json_name)
+        return tuple(json_names)
+
+    def get_dataset(self, json_files=None) -> dict:
+        """То же, что EmbeddingTools.get_embeddings_dataset, но из памяти (словари собираются из индекса по запросу)"""
+        self.refresh()
+        with self._lock:
+            return {
+                json_name: self._files[json_name]["index"].to_dataset().get(json_name, {})
+                for json_name in self._json_names(json_files)
+            }
+
+    def get_index(self, json_files=None) -> EmbeddingIndex:
+        """Индекс по указанным файлам (или по всем). Объединённые индексы кэшируются до изменения файлов"""
+        self.refresh()
+        with self._lock:
+            key = self._json_names(json_files)
+            index = self._combined.get(key)
+            if index is None:
+                index = EmbeddingIndex.concat([self._files[json_name]["index"] for json_name in key])
+                self._combined[key] = index
+            return index
+
+
+if __name__ == "__main__":
+    # python embedding_store.py dataset/dataset_embeddings [float32|float16]
+    convert_json_folder(
+        sys.argv[1] if len(sys.argv) > 1 else os.path.join("dataset", "dataset_embeddings"),
+        dtype=sys.argv[2] if len(sys.argv) > 2 else "float32"
+    )
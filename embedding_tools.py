@@ -1,45 +1,65 @@
+import asyncio
+import atexit
 import json
 import os
+import threading
 import time
-from functools import lru_cache
 from typing import List, Union
 
 import numpy as np
-import requests
 from network_tools import NetworkToolsAPI
-from requests import RequestException
-from requests.adapters import HTTPAdapter
-from scipy.spatial.distance import cosine
-from urllib3.util.retry import Retry
 
 import secret
+from ann_index import IVFIndex
 from base_logger import Logs
+from cohere_client import AsyncCohereClient, EMBED_BATCH_SIZE
+from embedding_cache import EmbeddingCache
+from embedding_index import EmbeddingIndex
+from embedding_store import EmbeddingsStore, STORAGE_EXTENSIONS, read_embeddings_file, json_name_of
 from functions import convert_answer_to_json
 
 logger = Logs(warnings=True, name="embedding-tools")
 
 search_dataset_prompt = secret.search_dataset_prompt
 search_dataset_model = secret.search_dataset_model
+dataset_check_interval = secret.dataset_check_interval
+embeddings_storage = secret.embeddings_storage
+embeddings_storage_dtype = secret.embeddings_storage_dtype
+cohere_pool_size = secret.cohere_pool_size
+cohere_calls_per_minute = secret.cohere_calls_per_minute
+memory_search_backend = secret.memory_search_backend
+ann_nprobe = secret.ann_nprobe
+ann_index_path = secret.ann_index_path
+ANN_SAVE_DELAY = 30  # секунд: изменения IVF индекса пишутся на диск одной записью, а не на каждое add/remove
 
 
 class EmbeddingTools:
-    def __init__(self, cohere_api_keys: list, dataset_folder, proxies=None, network_client: NetworkToolsAPI = None):
+    def __init__(self, cohere_api_keys: list, dataset_folder, proxies=None, network_client: NetworkToolsAPI = None,
+                 cache: EmbeddingCache = None):
         """Инициализация с токеном HF и папкой для поиска"""
-        self.cohere_api_keys = cohere_api_keys
-        self._all_cohere_api_keys: list = cohere_api_keys
+        self.client = AsyncCohereClient(
+            cohere_api_keys,
+            proxies=proxies,
+            pool_size=cohere_pool_size,
+            calls_per_minute=cohere_calls_per_minute
+        )
+        self.cache = cache
         self.network_client = network_client
         self.dataset_folder = dataset_folder
         self.dataset_json_folder = os.path.join(self.dataset_folder, "dataset_json")
         self.dataset_embeddings_folder = os.path.join(self.dataset_folder, "dataset_embeddings")
+        self.storage_format = embeddings_storage
+        self.dataset_store = EmbeddingsStore(
+            self.dataset_embeddings_folder,
+            check_interval=dataset_check_interval,
+            storage_format=self.storage_format
+        )
+        self.search_backend = memory_search_backend
+        self._ann = None
+        self._ann_lock = threading.Lock()
+        self._ann_save_timer = None
+        atexit.register(self.save_ann)
 
-        self.req_session = requests.Session()
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
-        self.req_session.mount('http://', HTTPAdapter(max_retries=retries))
-        self.req_session.mount('https://', HTTPAdapter(max_retries=retries))
-        if proxies:
-            self.req_session.proxies = proxies
-
-    @lru_cache(maxsize=10 ** 5)
     def get_embedding(
             self,
             text: Union[str, List[str]],
@@ -49,126 +69,105 @@ class EmbeddingTools:
             max_retries: int = 45,
             base_delay: float = 1.0
     ) -> List[float]:
-        """
-        Генерация эмбеддинга через Cohere API v2/embed с улучшенной обработкой лимитов и ошибок.
-
-        Args:
-            text: Текст или список текстов для получения эмбеддингов
-            model: Название модели
-            input_type: Тип ввода (search_document, search_query, classification, clustering, image)
-            embedding_type: Тип возвращаемых эмбеддингов (float, int8, uint8, binary, ubinary)
-            max_retries: Максимальное количество попыток
-            base_delay: Базовая задержка между повторными попытками в секундах
-
-        Returns:
-            Список чисел с плавающей точкой представляющих эмбеддинг
-
-        Raises:
-            ValueError: Некорректные входные параметры
-            RequestException: Ошибка при запросе к API после всех попыток
-            Exception: Отсутствуют API ключи
-        """
-
-        def _handle_rate_limit(response_text: str, attempt: int, base_delay: float, api_key: str,
-                               current_keys: list) -> float:
-            """Обработка различных типов ограничений скорости."""
-            if "calls / minute" in response_text:
-                return 20.0
-            elif "Please wait and try again later" in response_text:
-                return 10.0
-            elif "1000 API calls / month" in response_text:
-                # Удаляем ключ навсегда
-                if api_key in self._all_cohere_api_keys:
-                    logger.logging(f"removed: {api_key}")
-                    self._all_cohere_api_keys.remove(api_key)
-                if api_key in current_keys:
-                    current_keys.remove(api_key)
-                return None  # Сигнализируем, что ключ удалён и нужно продолжить с новым
-            return base_delay * (attempt + 1)
-
-        # Валидация входных параметров
-        if not text:
+        """Эмбеддинг одного текста (для списка - эмбеддинг первого). См. get_embeddings"""
+        texts = [text] if isinstance(text, str) else list(text)[:1]
+        return self.get_embeddings(
+            texts,
+            model=model,
+            input_type=input_type,
+            embedding_type=embedding_type,
+            max_retries=max_retries,
+            base_delay=base_delay
+        )[0]
+
+    def get_embeddings(
+            self,
+            texts: List[str],
+            model: str = "embed-english-v3.0",
+            input_type: str = "classification",
+            embedding_type: str = "float",
+            max_retries: int = 45,
+            base_delay: float = 1.0
+    ) -> List[List[float]]:
+        """Эмбеддинги для списка текстов: сначала из постоянного кэша, недостающие - запросами к Cohere"""
+        if not texts:
             raise ValueError("Text parameter cannot be empty")
-        if not self.cohere_api_keys and not self._all_cohere_api_keys:
-            raise Exception("No Cohere API keys available")
-
-        # Подготовка запроса
-        payload = {
-            "model": model,
-            "texts": [text] if isinstance(text, str) else text,
-            "input_type": input_type,
-            "embedding_types": [embedding_type]
-        }
-
-        headers_template = {
-            "accept": "application/json",
-            "content-type": "application/json"
-        }
 
-        start_time = time.time()
-        current_keys = self.cohere_api_keys or self._all_cohere_api_keys
-
-        for attempt in range(max_retries):
-            if not current_keys:
-                print(f"No keys. Update: {self._all_cohere_api_keys}")
-                current_keys = self._all_cohere_api_keys
-                if not current_keys:
-                    raise Exception("All Cohere API keys exhausted")
-
-            api_key = current_keys[0]
-            # print(f"use: {api_key}")
-            headers = {**headers_template, "Authorization": f"bearer {api_key}"}
-
-            try:
-                response = self.req_session.post(
-                    "https://api.cohere.com/v2/embed",
-                    json=payload,
-                    headers=headers
-                )
-                status_code = response.status_code
-                if status_code == 429:  # Rate limit
-                    delay = _handle_rate_limit(response.text, attempt, base_delay, api_key, current_keys)
-                    if delay is None:  # Ключ был удалён из-за лимита 1000 вызовов в месяц
-                        continue
-                    print(f"Слишком много запросов. Ждём {delay} с")
-                    time.sleep(delay)
-                    continue
-                elif status_code == 401:  # Unauthorized
-                    if api_key in self._all_cohere_api_keys:
-                        logger.logging(f"removed: {api_key}")
-                        self._all_cohere_api_keys.remove(api_key)
-                    current_keys.pop(0)
-                    continue
-                response.raise_for_status()
-                result = response.json()
-                embeddings = result["embeddings"][embedding_type][0]
-
-                logger.logging(f"Получен эмбеддинг: {time.time() - start_time:.2f}s")
-                return embeddings
-
-            except Exception as e:
-                logger.logging(f"Request failed: {str(e)}")
-                if attempt == max_retries - 1:
-                    raise
-
-            current_keys = current_keys[1:] or self._all_cohere_api_keys
-
-        raise RequestException(f"Failed to get embedding after {max_retries} attempts")
+        found = self.cache.get_many(texts, model, input_type, embedding_type) if self.cache else {}
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        fetched = {}
+        # Cohere принимает не больше EMBED_BATCH_SIZE текстов за запрос
+        for start in range(0, len(missing), EMBED_BATCH_SIZE):
+            batch = missing[start:start + EMBED_BATCH_SIZE]
+            fetched.update(zip(batch, self.client.embed(
+                batch,
+                model=model,
+                input_type=input_type,
+                embedding_type=embedding_type,
+                max_retries=max_retries,
+                base_delay=base_delay
+            )))
+        if fetched and self.cache:
+            self.cache.put_many(fetched, model, input_type, embedding_type)
+        found.update(fetched)
+
+        return [found[text] for text in texts]
+
+    async def aget_embeddings(
+            self,
+            texts: List[str],
+            model: str = "embed-english-v3.0",
+            input_type: str = "classification",
+            embedding_type: str = "float",
+            max_retries: int = 45,
+            base_delay: float = 1.0
+    ) -> List[List[float]]:
+        """Асинхронная версия get_embeddings (не занимает поток на время запроса и ретраев)"""
+        if not texts:
+            raise ValueError("Text parameter cannot be empty")
 
-    def process_json_file(self, file_path):
-        """Обрабатывает один JSON-файл и добавляет недостающие эмбеддинги"""
+        found = self.cache.get_many(texts, model, input_type, embedding_type) if self.cache else {}
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        fetched = {}
+        # Cohere принимает не больше EMBED_BATCH_SIZE текстов за запрос
+        for start in range(0, len(missing), EMBED_BATCH_SIZE):
+            batch = missing[start:start + EMBED_BATCH_SIZE]
+            fetched.update(zip(batch, await self.client.aembed(
+                batch,
+                model=model,
+                input_type=input_type,
+                embedding_type=embedding_type,
+                max_retries=max_retries,
+                base_delay=base_delay
+            )))
+        if fetched and self.cache:
+            self.cache.put_many(fetched, model, input_type, embedding_type)
+        found.update(fetched)
+
+        return [found[text] for text in texts]
+
+    async def aget_embedding(self, text: str, **kwargs) -> List[float]:
+        """Асинхронная версия get_embedding"""
+        return (await self.aget_embeddings([text], **kwargs))[0]
+
+    def _load_for_processing(self, file_path):
+        """Читает файл из dataset_json и уже посчитанные для него эмбеддинги"""
         with open(file_path, 'r', encoding='utf-8') as f:
             input_data = json.load(f)
 
         filename = os.path.basename(file_path)
-        embeddings_file_path = os.path.join(self.dataset_embeddings_folder, filename)
+        embeddings_file_path = self.get_embeddings_file_path(filename)
 
         if os.path.exists(embeddings_file_path):
-            with open(embeddings_file_path, 'r', encoding='utf-8') as f:
-                embeddings_data = json.load(f)
+            embeddings_data = read_embeddings_file(embeddings_file_path)
         else:
             embeddings_data = {}
 
+        return input_data, embeddings_data
+
+    @staticmethod
+    def _merge_embeddings(input_data, embeddings_data, embed):
+        """Собирает итоговый файл эмбеддингов, запрашивая недостающие через embed(text)"""
         result = {}
 
         for header, items in input_data.items():
@@ -179,7 +178,7 @@ class EmbeddingTools:
                 existing_items = embeddings_data[header]
                 header_embedding = existing_items[0]["embedings"]
             else:
-                header_embedding = self.get_embedding(header)
+                header_embedding = embed(header)
                 existing_items = [{"embedings": header_embedding}]
 
             qa_pairs = []
@@ -195,8 +194,8 @@ class EmbeddingTools:
                         "embeddings_answer" in existing_qa_dict[question]):
                     qa_pairs.append(existing_qa_dict[question])
                 else:
-                    question_embedding = self.get_embedding(question)
-                    answer_embedding = self.get_embedding(answer)
+                    question_embedding = embed(question)
+                    answer_embedding = embed(answer)
                     qa_pairs.append({
                         "question": question,
                         "answer": answer,
@@ -211,24 +210,122 @@ class EmbeddingTools:
 
         return result
 
+    def process_json_file(self, file_path):
+        """Обрабатывает один JSON-файл и добавляет недостающие эмбеддинги"""
+        input_data, embeddings_data = self._load_for_processing(file_path)
+        return self._merge_embeddings(input_data, embeddings_data, self.get_embedding)
+
+    def _load_checkpoint(self, checkpoint_path) -> dict:
+        """Читает уже полученные эмбеддинги прерванного запуска"""
+        embeddings = {}
+        if not os.path.exists(checkpoint_path):
+            return embeddings
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # строка, оборванная при прерывании
+                embeddings[record["text"]] = record["embedding"]
+        logger.logging(f"Продолжение с чекпоинта: {len(embeddings)} эмбеддингов")
+        return embeddings
+
+    def embed_texts_batched(self, texts, checkpoint_path=None, batch_size=EMBED_BATCH_SIZE) -> dict:
+        """
+        Эмбеддинги для списка текстов пачками по batch_size.
+        Повторы убираются, каждая пачка дописывается в checkpoint_path (JSONL),
+        так что прерванный запуск продолжится с того же места.
+
+        Returns:
+            {text: embedding}
+        """
+        embeddings = self._load_checkpoint(checkpoint_path) if checkpoint_path else {}
+        missing = [text for text in dict.fromkeys(texts) if text not in embeddings]
+        if not missing:
+            return embeddings
+
+        total = len(missing)
+        done = 0
+        start_time = time.time()
+        logger.logging(f"Нужно получить эмбеддингов: {total} (пачки по {batch_size})")
+
+        checkpoint = open(checkpoint_path, 'a', encoding='utf-8') if checkpoint_path else None
+        try:
+            for i in range(0, total, batch_size):
+                batch = missing[i:i + batch_size]
+                batch_embeddings = self.get_embeddings(batch)
+                for text, embedding in zip(batch, batch_embeddings):
+                    embeddings[text] = embedding
+                    if checkpoint:
+                        checkpoint.write(json.dumps({"text": text, "embedding": embedding}, ensure_ascii=False) + "\n")
+                if checkpoint:
+                    checkpoint.flush()
+
+                done += len(batch)
+                spent = time.time() - start_time
+                speed = done / spent if spent else 0.0
+                eta = (total - done) / speed if speed else 0.0
+                logger.logging(f"Эмбеддинги: {done}/{total} ({speed:.1f} текстов/с, осталось ~{eta:.0f}s)")
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+        return embeddings
+
+    def _is_up_to_date(self, filename: str) -> bool:
+        """Файл эмбеддингов записан после последнего изменения исходного JSON - пересчитывать нечего"""
+        embeddings_file_path = self.get_embeddings_file_path(filename)
+        paths = [embeddings_file_path]
+        if embeddings_file_path.endswith(".npy"):
+            paths.append(os.path.splitext(embeddings_file_path)[0] + ".meta")
+        try:
+            written = min(os.path.getmtime(path) for path in paths)
+        except OSError:
+            return False
+        return written >= os.path.getmtime(os.path.join(self.dataset_json_folder, filename))
+
+    @staticmethod
+    def _pairs(embeddings_data) -> dict:
+        """Темы и пары без векторов - для сравнения содержимого файлов эмбеддингов"""
+        return {
+            header: [(item.get("question"), item.get("answer")) for item in items[1:]]
+            for header, items in embeddings_data.items() if items
+        }
+
     def process_folder(self):
-        """Обрабатывает JSON-файлы из dataset_json и сохраняет в dataset_embeddings"""
+        """
+        Обрабатывает JSON-файлы из dataset_json и сохраняет в dataset_embeddings.
+        Файлы, эмбеддинги которых новее исходного JSON, не читаются и не перезаписываются
+        """
         os.makedirs(self.dataset_embeddings_folder, exist_ok=True)
 
+        loaded = {}
         for filename in os.listdir(self.dataset_json_folder):
-            if filename.endswith('.json'):
-                input_file_path = os.path.join(self.dataset_json_folder, filename)
-                output_file_path = os.path.join(self.dataset_embeddings_folder, filename)
+            if filename.endswith('.json') and not self._is_up_to_date(filename):
+                loaded[filename] = self._load_for_processing(os.path.join(self.dataset_json_folder, filename))
+
+        # Сначала собираем все недостающие тексты по всем файлам, затем получаем их пачками
+        missing_texts = []
+        for input_data, embeddings_data in loaded.values():
+            self._merge_embeddings(input_data, embeddings_data, lambda text: missing_texts.append(text))
 
-                processed_data = self.process_json_file(input_file_path)
+        checkpoint_path = os.path.join(self.dataset_embeddings_folder, ".checkpoint.jsonl")
+        embeddings = self.embed_texts_batched(missing_texts, checkpoint_path=checkpoint_path) if missing_texts else {}
 
-                with open(output_file_path, 'w', encoding='utf-8') as f:
-                    json.dump(processed_data, f, ensure_ascii=False, indent=2)
+        for filename, (input_data, embeddings_data) in loaded.items():
+            processed_data = self._merge_embeddings(input_data, embeddings_data, embeddings.__getitem__)
+            # Перезапись меняет mtime, а по нему проверяется актуальность IVF индекса - пишем только изменённое
+            if self._pairs(processed_data) != self._pairs(embeddings_data):
+                self.dataset_store.write_file(self.get_embeddings_file_path(filename), processed_data,
+                                              dtype=embeddings_storage_dtype)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
 
     def remove_question_from_header(self, json_filename: str, question_text: str):
         """Удаляет вопрос по тексту из всех тем указанного JSON (и в dataset_json, и в dataset_embeddings)"""
         json_path = os.path.join(self.dataset_json_folder, json_filename)
-        embed_path = os.path.join(self.dataset_embeddings_folder, json_filename)
+        embed_path = self.get_embeddings_file_path(json_filename)
 
         # === Удаление из dataset_json ===
         if os.path.exists(json_path):
@@ -251,8 +348,7 @@ class EmbeddingTools:
 
         # === Удаление из dataset_embeddings ===
         if os.path.exists(embed_path):
-            with open(embed_path, 'r', encoding='utf-8') as f:
-                embed_data = json.load(f)
+            embed_data = read_embeddings_file(embed_path)
 
             modified = False
             for header, items in embed_data.items():
@@ -268,16 +364,15 @@ class EmbeddingTools:
                     modified = True
 
             if modified:
-                with open(embed_path, 'w', encoding='utf-8') as f:
-                    json.dump(embed_data, f, ensure_ascii=False, indent=2)
+                self.dataset_store.write_file(embed_path, embed_data, dtype=embeddings_storage_dtype)
+                self._update_ann(lambda ann: ann.remove(json_name_of(embed_path), question_text))
 
         else:
             logger.logging(f"Файл не найден: {embed_path}")
     def add_qa_to_header(self, header, question, answer, output_file):
-        """Добавляет вопрос и ответ в указанный заголовок в выходном JSON"""
+        """Добавляет вопрос и ответ в указанный заголовок в выходном файле (.json или .npy)"""
         if os.path.exists(output_file):
-            with open(output_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = read_embeddings_file(output_file)
         else:
             data = {}
 
@@ -285,6 +380,7 @@ class EmbeddingTools:
         answer_embedding = self.get_embedding(answer)
 
         if header in data:
+            header_embedding = data[header][0]["embedings"]
             data[header].append({
                 "question": question,
                 "answer": answer,
@@ -303,8 +399,74 @@ class EmbeddingTools:
                 }
             ]
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self.dataset_store.write_file(output_file, data, dtype=embeddings_storage_dtype)
+        self._update_ann(lambda ann: ann.add(
+            json_name_of(output_file), header, header_embedding,
+            question, answer, question_embedding, answer_embedding
+        ))
+
+    def get_search_index(self, specific_files=None):
+        """
+        Индекс для get_memories. При memory_search_backend = "ivf" поиск по всем файлам идёт через
+        приближённый IVFIndex (строится один раз, хранится на диске, перестраивается при изменении файлов извне).
+        Поиск по отдельным файлам всегда точный.
+        """
+        index = self.dataset_store.get_index(specific_files)
+        if self.search_backend != "ivf" or specific_files is not None:
+            return index
+
+        signature = self.dataset_store.signature()
+        with self._ann_lock:
+            if self._ann is None and os.path.exists(ann_index_path):
+                try:
+                    self._ann = IVFIndex.load(ann_index_path)
+                    self._ann.nprobe = ann_nprobe
+                except Exception as e:
+                    logger.logging(f"Error loading ANN index: {e}")
+            if self._ann is None or self._ann.signature != signature:
+                self._ann = IVFIndex(nprobe=ann_nprobe)
+                self._ann.build(index, signature=signature)
+                self._ann.save(ann_index_path)
+            return self._ann
+
+    def _update_ann(self, update):
+        """
+        Инкрементальное изменение IVF индекса вместо перестройки.
+        На диск индекс пишется через ANN_SAVE_DELAY секунд после первого изменения (и при выходе)
+        """
+        with self._ann_lock:
+            if self._ann is None:
+                return
+            update(self._ann)
+            self._ann.signature = self.dataset_store.signature()
+            if self._ann_save_timer is None:
+                self._ann_save_timer = threading.Timer(ANN_SAVE_DELAY, self.save_ann)
+                self._ann_save_timer.daemon = True
+                self._ann_save_timer.start()
+
+    def save_ann(self):
+        """Сохраняет IVF индекс, если есть несохранённые изменения"""
+        with self._ann_lock:
+            if self._ann_save_timer is None:
+                return
+            self._ann_save_timer.cancel()
+            self._ann_save_timer = None
+            ann = self._ann
+        try:
+            ann.save(ann_index_path)
+        except Exception as e:
+            logger.logging(f"Error saving ANN index: {e}")
+
+    def get_embeddings_file_path(self, json_filename: str) -> str:
+        """Путь к файлу эмбеддингов для файла из dataset_json с учётом формата хранения"""
+        name = os.path.splitext(json_filename)[0]
+        return os.path.join(self.dataset_embeddings_folder, name + STORAGE_EXTENSIONS[self.storage_format])
+
+    def load_dataset(self):
+        """Загружает dataset_embeddings в память (вызывается один раз при старте)"""
+        self.dataset_store.refresh(force=True)
+        if self.search_backend == "ivf":
+            self.get_search_index()  # загрузка или перестройка IVF - при старте, а не в первом get_memories
 
     def get_embeddings_dataset(self, json_files=None):
         """Загружает данные из нескольких JSON. Если json_files - None, то все файлы JSON"""
@@ -312,126 +474,62 @@ class EmbeddingTools:
 
         if json_files is None:
             folder = self.dataset_embeddings_folder
-            json_files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.json')]
+            extension = STORAGE_EXTENSIONS[self.storage_format]
+            json_files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(extension)]
 
         for file_path in json_files:
+            file_path = os.path.splitext(file_path)[0] + STORAGE_EXTENSIONS[self.storage_format]
             if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                filename = os.path.basename(file_path)
-                embeddings_dataset[filename] = data
+                filename = os.path.splitext(os.path.basename(file_path))[0] + ".json"
+                embeddings_dataset[filename] = read_embeddings_file(file_path)
             else:
                 logger.logging(f"Warning: File {file_path} does not exist")
 
         return embeddings_dataset
 
     def search_similar_questions(self, query, embeddings_dataset, top_k=3):
-        """Поиск наиболее похожих вопросов в данных нескольких JSON"""
-        query_embedding = np.array(self.get_embedding(query, max_retries=20))
-
-        results = []
-
-        for json_name, json_data in embeddings_dataset.items():
-            for header, items in json_data.items():
-                header_embedding = np.array(items[0]["embedings"])
-                header_similarity = 1 - cosine(query_embedding, header_embedding)
-
-                for qa in items[1:]:
-                    question_embedding = np.array(qa["embeddings_question"])
-                    answer_embedding = np.array(qa["embeddings_answer"])
-
-                    # Считаем схожесть с вопросом и ответом
-                    question_similarity = 1 - cosine(query_embedding, question_embedding)
-                    answer_similarity = 1 - cosine(query_embedding, answer_embedding)
-
-                    # Используем максимальную схожесть (вопрос или ответ)
-                    similarity = max(question_similarity, answer_similarity)
-
-                    results.append({
-                        "json_name": json_name,
-                        "header": header,
-                        "question": qa["question"],
-                        "answer": qa["answer"],
-                        "similarity": similarity + (header_similarity / 2),
-                        "header_similarity": header_similarity,
-                        "question_similarity": question_similarity,
-                        "answer_similarity": answer_similarity
-                    })
-
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        return results[:top_k]
+        """Поиск наиболее похожих вопросов в данных нескольких JSON (или в готовом индексе)"""
+        query_embedding = self.get_embedding(query, max_retries=20)
 
-    def _process_prompt(self, prompt, embeddings_dataset):
-        """Обработка одного промпта"""
-        try:
-            return self.search_similar_questions(prompt, embeddings_dataset, top_k=100)
-        except Exception as e:
-            logger.logging(f"ERROR processing prompt '{prompt}': {e}")
+        if isinstance(embeddings_dataset, dict):
+            index = EmbeddingIndex.from_dataset(embeddings_dataset)
+        else:
+            index = embeddings_dataset  # EmbeddingIndex или IVFIndex
+        return index.search(query_embedding, top_k=top_k)
+
+    def expand_search_prompts(self, query, file_path=None, formatted_chat_history="") -> list:
+        """DeepSearch: GPT составляет поисковые запросы в датасет. Возвращает запросы (без самого query)"""
+        if formatted_chat_history:
+            formatted_chat_history = f"# История сообщения\n{formatted_chat_history}\n\n"
+        answer_gpt = self.network_client.chatgpt_api(
+            f"{search_dataset_prompt}\n\n{formatted_chat_history}\n\n# Текущий запрос\n{query}",
+            model=search_dataset_model,
+            file_path=file_path
+        )
+        converted, json_answer = convert_answer_to_json(
+            answer_gpt.response.text,
+            end_symbol="]",
+            start_symbol="[",
+            keys=[]
+        )
+        if not converted:
+            logger.logging(f"Не конвертировался ответ: {json_answer}")
             return []
+        return [str(prompt) for prompt in json_answer if prompt]
 
-    def get_memories(
-            self,
-            query,
-            specific_files=None,
-            min_results=1,
-            max_results=5,
-            deepsearch=False,
-            file_path=None,
-            formatted_chat_history=""
-    ):
-        search_prompts = []
-        if deepsearch:
-            if not self.network_client:
-                logger.logging("Не указан network_client. Нельзя делать DeepSearch")
-                return ""
-            if formatted_chat_history:
-                formatted_chat_history = f"# История сообщения\n{formatted_chat_history}\n\n"
-            answer_gpt = self.network_client.chatgpt_api(
-                f"{search_dataset_prompt}\n\n{formatted_chat_history}\n\n# Текущий запрос\n{query}",
-                model=search_dataset_model,
-                file_path=file_path
-            )
-            converted, json_answer = convert_answer_to_json(
-                answer_gpt.response.text,
-                end_symbol="]",
-                start_symbol="[",
-                keys=[]
-            )
-            if not converted:
-                logger.logging(f"Не конвертировался ответ: {json_answer}")
-                search_prompts.append(query)
-            else:
-                search_prompts = json_answer
-
-        search_prompts.append(query)
-
-        all_similar_items = []
-        questions_was = set()  # Используем set для более быстрой проверки уникальности
-
-        # Получаем embeddings_dataset один раз перед параллельной обработкой
-        embeddings_dataset = self.get_embeddings_dataset(specific_files)
+    async def aexpand_search_prompts(self, query, file_path=None, formatted_chat_history="") -> list:
+        """Асинхронная версия expand_search_prompts"""
+        return await asyncio.to_thread(self.expand_search_prompts, query, file_path, formatted_chat_history)
 
-        # Параллельная обработка всех промптов
-        with ThreadPoolExecutor() as executor:
-            # Запускаем обработку всех промптов параллельно
-            future_to_prompt = {
-                executor.submit(self._process_prompt, prompt, embeddings_dataset): prompt
-                for prompt in search_prompts
-            }
-
-            # Собираем результаты по мере их готовности
-            for future in future_to_prompt:
-                try:
-                    similar_items = future.result()
-                    for item in similar_items:
-                        if item['question'] not in questions_was:
-                            all_similar_items.append(item)
-                            questions_was.add(item['question'])
-                except Exception as e:
-                    logger.logging(f"ERROR in future result: {e}")
+    def search_memories(self, query_embeddings, specific_files=None, max_results=5) -> str:
+        """Поиск по уже готовым эмбеддингам запросов и форматирование результата"""
+        # Индекс берётся из резидентного хранилища, диск не читается
+        embeddings_dataset = self.get_search_index(specific_files)
+        return self.format_memories(embeddings_dataset.search_many(query_embeddings, top_k=max_results))
 
+    @staticmethod
+    def format_memories(all_similar_items) -> str:
         # Сортировка и фильтрация результатов
-        all_similar_items = sorted(all_similar_items, key=lambda x: x['similarity'], reverse=True)[:max_results]
         all_similar_items = sorted(all_similar_items, key=lambda x: x['similarity'])
         all_similar_items = [item for item in all_similar_items if item['similarity'] > 0.80]
 
@@ -456,6 +554,33 @@ class EmbeddingTools:
 
         return output_result
 
+    def get_memories(
+            self,
+            query,
+            specific_files=None,
+            min_results=1,
+            max_results=5,
+            deepsearch=False,
+            file_path=None,
+            formatted_chat_history=""
+    ):
+        search_prompts = []
+        if deepsearch:
+            if not self.network_client:
+                logger.logging("Не указан network_client. Нельзя делать DeepSearch")
+                return ""
+            search_prompts = self.expand_search_prompts(query, file_path, formatted_chat_history)
+
+        search_prompts.append(query)
+
+        # Эмбеддинги всех промптов одним запросом, оценка всех промптов одним умножением матриц
+        try:
+            query_embeddings = self.get_embeddings(list(dict.fromkeys(search_prompts)), max_retries=20)
+        except Exception as e:
+            logger.logging(f"ERROR getting embeddings for prompts {search_prompts}: {e}")
+            return ""
+        return self.search_memories(query_embeddings, specific_files=specific_files, max_results=max_results)
+
 
 # Пример использования
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+import json
+import os
+import sys
+import wave
+from collections import deque
+
+import numpy as np
+
+try:
+    import webrtcvad
+except Exception:
+    webrtcvad = None  # для офлайн-проверки без webrtcvad используется порог по энергии
+
+
+class Endpointer:
+    """
+    Определение границ фраз по покадровому решению VAD.
+
+    process(index, is_speech) получает номер кадра и решение VAD и возвращает события:
+      ("speech", offset, length) - кадры [offset, offset + length) относятся к текущей фразе
+                                   (первое такое событие открывает фразу)
+      ("end", offset)            - фраза закончилась
+    Что умеет:
+      - начало речи засчитывается, только если в окне start_window речи не меньше start_ratio
+        (одиночные щелчки не открывают фразу), при этом в фразу попадает pre_roll до окна;
+      - паузы внутри фразы отдаются с задержкой: если фраза закончилась, хвост тишины обрезается
+        до keep_trailing, в распознавание не уходят длинные тишины;
+      - фраза длиннее max_utterance режется на ближайшей паузе (и жёстко через 25% сверху);
+      - порог тишины подстраивается под паузы говорящего: pause_factor * среднее пауз внутри фраз,
+        в пределах [min_silence, max_silence].
+    """
+
+    def __init__(self, frame_ms: int = 30, silence_duration: float = 0.7, pre_roll: float = 0.3,
+                 start_window: float = 0.15, start_ratio: float = 0.6, keep_trailing: float = 0.15,
+                 max_utterance: float = 15.0, adaptive: bool = True, min_silence: float = 0.4,
+                 max_silence: float = 1.5, pause_factor: float = 2.0):
+        def frames(seconds):
+            return max(1, round(seconds * 1000 / frame_ms))
+
+        self.frame_ms = frame_ms
+        self.pre_roll_frames = frames(pre_roll)
+        self.start_window = deque(maxlen=frames(start_window))
+        self.start_needed = max(1, round(self.start_window.maxlen * start_ratio))
+        self.keep_trailing_frames = frames(keep_trailing)
+        self.max_frames = frames(max_utterance)
+        self.hard_max_frames = round(self.max_frames * 1.25)
+        self.adaptive = adaptive
+        self.min_silence_frames = frames(min_silence)
+        self.max_silence_frames = frames(max_silence)
+        self.pause_factor = pause_factor
+        self.silence_frames = frames(silence_duration)  # текущий порог конца фразы
+
+        self.first_index = None  # первый кадр, который видел endpointer (раньше pre-roll не берётся)
+        self.last_end = 0  # кадры до этого номера уже отданы, повторно не отдаются
+        self.in_utterance = False
+        self.utterance_frames = 0
+        self.pending_start = 0  # пауза внутри фразы, которая ещё не отдана
+        self.pending_count = 0
+        self.average_pause = None
+
+    @property
+    def silence_duration(self) -> float:
+        return self.silence_frames * self.frame_ms / 1000
+
+    def _learn_pause(self, pause_frames: int):
+        if not self.adaptive or pause_frames < 2:  # одиночные кадры - дрожание VAD, а не пауза
+            return
+        if self.average_pause is None:
+            self.average_pause = pause_frames
+        else:
+            self.average_pause = 0.8 * self.average_pause + 0.2 * pause_frames
+        self.silence_frames = int(min(self.max_silence_frames,
+                                      max(self.min_silence_frames, round(self.average_pause * self.pause_factor))))
+
+    def _end(self, events: list, keep: int):
+        keep = min(keep, self.pending_count)
+        if keep:
+            events.append(("speech", self.pending_start, keep))
+        end = self.pending_start + keep if self.pending_count else self.pending_start
+        events.append(("end", end))
+        self.last_end = end
+        self.in_utterance = False
+        self.utterance_frames = 0
+        self.pending_count = 0
+        self.start_window.clear()
+
+    def process(self, index: int, is_speech: bool) -> list:
+        events = []
+        if self.first_index is None:
+            self.first_index = index
+
+        if not self.in_utterance:
+            self.start_window.append(is_speech)
+            if sum(self.start_window) >= self.start_needed:
+                offset = max(index - len(self.start_window) + 1 - self.pre_roll_frames, self.first_index, self.last_end)
+                events.append(("speech", offset, index - offset + 1))
+                self.in_utterance = True
+                self.utterance_frames = index - offset + 1
+                self.pending_count = 0
+                self.pending_start = index + 1
+            return events
+
+        if is_speech:
+            if self.pending_count:
+                self._learn_pause(self.pending_count)
+                events.append(("speech", self.pending_start, self.pending_count))
+                self.utterance_frames += self.pending_count
+                self.pending_count = 0
+            events.append(("speech", index, 1))
+            self.utterance_frames += 1
+            self.pending_start = index + 1
+        else:
+            if not self.pending_count:
+                self.pending_start = index
+            self.pending_count += 1
+            if self.pending_count >= self.silence_frames:
+                self._end(events, self.keep_trailing_frames)
+                return events
+
+        total = self.utterance_frames + self.pending_count
+        if total >= self.hard_max_frames or (total >= self.max_frames and self.pending_count >= 3):
+            # Слишком длинная фраза: режем на паузе (или жёстко), следующая речь откроет новую фразу
+            if not self.pending_count:
+                self.pending_start = index + 1
+            self._end(events, self.keep_trailing_frames)
+        return events
+
+    def flush(self) -> list:
+        """Конец записи: закрыть открытую фразу"""
+        events = []
+        if self.in_utterance:
+            self._end(events, self.keep_trailing_frames)
+        return events
+
+
+def segments_from_events(events: list, frame_ms: int = 30) -> list:
+    """События endpointer -> [(начало, конец, отдано кадров)] в секундах"""
+    segments = []
+    start = shipped = None
+    for event in events:
+        if event[0] == "speech":
+            if start is None:
+                start, shipped = event[1], 0
+            shipped += event[2]
+        elif start is not None:
+            segments.append((start * frame_ms / 1000, event[1] * frame_ms / 1000, shipped))
+            start = None
+    return segments
+
+
+def vad_decisions(path: str, frame_ms: int = 30, aggressiveness: int = 1) -> list:
+    """Решения VAD для WAV 16 bit mono: webrtcvad, если установлен, иначе порог по энергии"""
+    with wave.open(path, 'rb') as wav:
+        sample_rate = wav.getframerate()
+        pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    frame_size = sample_rate * frame_ms // 1000
+    frames = pcm[:len(pcm) // frame_size * frame_size].reshape(-1, frame_size)
+    if webrtcvad is not None:
+        vad = webrtcvad.Vad(aggressiveness)
+        return [vad.is_speech(frame.tobytes(), sample_rate) for frame in frames]
+    energy = np.sqrt((frames.astype(np.float32) ** 2).mean(axis=1))
+    threshold = max(300.0, np.percentile(energy, 20) * 3)
+    return list(energy > threshold)
+
+
+def evaluate(decisions: list, labels: list, endpointer: Endpointer) -> dict:
+    """
+    Сравнение найденных фраз с разметкой labels [[начало, конец], ...] (сек).
+    clipped_onsets - фраз, у которых обрезано начало; trailing_silence - сколько тишины после
+    конца речи ушло в распознавание; shipped_ratio - отдано аудио / размеченная речь
+    """
+    events = []
+    for index, is_speech in enumerate(decisions):
+        events.extend(endpointer.process(index, is_speech))
+    events.extend(endpointer.flush())
+    segments = segments_from_events(events, endpointer.frame_ms)
+
+    frame = endpointer.frame_ms / 1000
+    clipped = start_errors = trailing = 0.0
+    starts = 0
+    for n, (label_start, label_end) in enumerate(labels):
+        previous_end = labels[n - 1][1] if n else float("-inf")
+        next_start = labels[n + 1][0] if n + 1 < len(labels) else float("inf")
+        covering = [segment for segment in segments if segment[0] < label_end and segment[1] > label_start]
+        if not covering:
+            clipped += 1
+            continue
+        first, last = covering[0], covering[-1]
+        clipped += first[0] > label_start + frame
+        if first[0] >= previous_end:  # фраза не склеена с предыдущей
+            start_errors += abs(first[0] - label_start)
+            starts += 1
+        if last[1] <= next_start:
+            trailing += max(0.0, last[1] - label_end)
+    speech = sum(end - start for start, end in labels) or 1.0
+    return {
+        "labelled": len(labels),
+        "detected": len(segments),
+        "clipped_onsets": int(clipped),
+        "mean_start_error": round(start_errors / max(1, starts), 3),
+        "trailing_silence": round(trailing, 2),
+        "shipped_ratio": round(sum(segment[2] for segment in segments) * frame / speech, 2),
+        "silence_duration": round(endpointer.silence_duration, 2)
+    }
+
+
+if __name__ == "__main__":
+    # python endpointer.py a.wav b.wav  - рядом с каждым WAV разметка a.json: {"segments": [[0.5, 2.1], ...]}
+    # python endpointer.py              - размеченная фикстура tests/fixtures/speech_8k.wav
+    wav_paths = sys.argv[1:] or [os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                              "tests", "fixtures", "speech_8k.wav")]
+    for wav_path in wav_paths:
+        with open(os.path.splitext(wav_path)[0] + ".json", 'r', encoding='utf-8') as f:
+            wav_labels = json.load(f)["segments"]
+        decisions = vad_decisions(wav_path)
+        print(wav_path)
+        print("  endpointer:", evaluate(decisions, wav_labels, Endpointer()))
+        print("  пауза 0.7с:", evaluate(decisions, wav_labels, Endpointer(pre_roll=0.0, keep_trailing=0.7, adaptive=False)))
@@ -1,10 +1,13 @@
+import datetime
 import hashlib
 import json
 import random
 import re
 import string
 import subprocess
+import time
 import uuid
+from contextlib import contextmanager
 
 import magic
 import requests
@@ -71,9 +74,6 @@ def save_answer_to_history(chat_history, prompt, user_nickname, answer, characte
     return chat_history
 
 
-import datetime
-
-
 class Time_Count:
     def __init__(self):
         self.start_time = datetime.datetime.now()
@@ -88,6 +88,34 @@ class Time_Count:
             return spent_time
 
 
+class StageTimer:
+    """Замер длительности этапов ответа, чтобы видеть, куда уходят секунды"""
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.stages = {}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    @contextmanager
+    def stage(self, name: str):
+        stage_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - stage_start
+
+    async def run(self, name: str, awaitable):
+        """await awaitable с замером времени под именем name"""
+        with self.stage(name):
+            return await awaitable
+
+    def summary(self) -> str:
+        stages = " ".join(f"{name}={spent:.2f}s" for name, spent in self.stages.items())
+        return f"{stages} total={self.elapsed():.2f}s"
+
+
 def random_string(length=8, seed=None, input_str=None):
     if not input_str is None:
         # Создаем хэш входной строки
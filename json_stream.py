@@ -0,0 +1,135 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Iterable
+
+from base_logger import Logs
+
+logger = Logs(warnings=True, name="json-stream")
+
+
+class JsonArrayStreamParser:
+    """
+    Инкрементальный парсер JSON-массива объектов из потока текста LLM.
+
+    feed() принимает очередной кусок ответа и возвращает объекты верхнего уровня массива,
+    которые закончились в этом куске. Текст до первого '[' (```json и т.п.) пропускается.
+    Каждый символ просматривается один раз, в памяти держится только незаконченный объект.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0  # до какого символа буфер уже просмотрен
+        self._object_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.array_started = False
+        self.finished = False
+        self.errors = 0
+
+    def feed(self, chunk: str) -> list:
+        objects = []
+        if self.finished or not chunk:
+            return objects
+        self._buffer += chunk
+
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            self._pos += 1
+
+            if not self.array_started:
+                if char == "[":
+                    self.array_started = True
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"' and self._depth > 0:
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._object_start = self._pos - 1
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    if char == "]":  # конец массива
+                        self.finished = True
+                        break
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = self._decode(self._buffer[self._object_start:self._pos])
+                    if obj is not None:
+                        objects.append(obj)
+                    self._object_start = None
+
+        # Просмотренный текст вне объекта больше не нужен
+        drop = self._pos if self._object_start is None else self._object_start
+        self._buffer = self._buffer[drop:]
+        self._pos -= drop
+        if self._object_start is not None:
+            self._object_start = 0
+        return objects
+
+    def _decode(self, text: str):
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError as e:
+            self.errors += 1
+            logger.logging(f"Error decoding streamed object: {e}: {text[:100]}")
+            return None
+        if not isinstance(obj, dict):
+            return None
+        return obj
+
+
+async def aiter_json_array(chunks) -> AsyncIterator[dict]:
+    """Объекты массива по мере их готовности. chunks - async или обычный итератор кусков текста"""
+    parser = JsonArrayStreamParser()
+    if hasattr(chunks, "__aiter__"):
+        async for chunk in chunks:
+            for obj in parser.feed(chunk):
+                yield obj
+    else:
+        for chunk in chunks:
+            for obj in parser.feed(chunk):
+                yield obj
+
+
+async def fake_llm_stream(text: str, chunk_size: int = 8, delay: float = 0.05) -> AsyncIterator[str]:
+    """Локальная имитация потокового ответа LLM: text кусками по chunk_size символов"""
+    for i in range(0, len(text), chunk_size):
+        await asyncio.sleep(delay)
+        yield text[i:i + chunk_size]
+
+
+def split_chunks(text: str, chunk_size: int) -> Iterable[str]:
+    return (text[i:i + chunk_size] for i in range(0, len(text), chunk_size))
+
+
+if __name__ == "__main__":
+    answer = (
+        '```json\n[\n'
+        '  {"event_type": "reaction", "reaction": "👍"},\n'
+        '  {"text": "Привет! Скобки {внутри} [строки] и \\"кавычки\\" не мешают", "reply_to": ""},\n'
+        '  {"text": "Вот картинка", "image": "кот в шляпе"},\n'
+        '  {"text": "И последнее сообщение"}\n'
+        ']\n```'
+    )
+
+    # Разбор на границах кусков проверяется в tests/test_json_stream.py, здесь - когда приходят действия
+    async def demo():
+        start_time = time.time()
+        async for action in aiter_json_array(fake_llm_stream(answer, chunk_size=8, delay=0.05)):
+            print(f"{time.time() - start_time:.2f}s: {action}")
+        print(f"Весь ответ: {time.time() - start_time:.2f}s")
+
+    asyncio.run(demo())
@@ -4,12 +4,13 @@ import threading
 import time
 
 import secret
-from base_classes import embedding_tools, network_client, discord_client, sql_database, event_manager
+from base_classes import embedding_tools, network_client, discord_client, sql_database, event_manager, \
+    chat_history_store
 from event_manager import EventTypeForManager
 from ds_user import activate_handlers
 from functions import format_messages, save_answer_to_history, remove_emojis
 from record import AudioProcessor
-from tts_tools import TTSQueue, tts_audio_with_play
+from tts_tools import TTSQueue, tts_stream_with_play
 from base_logger import Logs
 
 logger = Logs(warnings=True, name="main")
@@ -20,6 +21,7 @@ character_name = secret.character_name
 voice_gpt_model = secret.voice_gpt_model
 internet_access = secret.internet_access
 max_length_history = secret.max_length_history
+max_length_history_messages = secret.max_length_history_messages
 max_event_length = secret.max_event_length
 
 speed = secret.tts_speed
@@ -29,51 +31,84 @@ model_id = secret.tts_model
 
 clear_history_on_restart = secret.clear_history_on_restart
 
-active_threads = []  # Список кортежей: (thread, stop_event, text)
+VOICE_HISTORY = "voice"  # канал голосовой истории в chat_history_store
+
+max_voice_turns = secret.max_voice_turns
+
+voice_loop = None  # event loop discord_client, на нём выполняются голосовые ответы
+voice_turns = []  # Список кортежей: (task, stop_event, text)
+voice_turn_semaphore = asyncio.Semaphore(max_voice_turns)
 
 
 def on_speak_text_thread(text: str):
-    global active_threads
+    """Колбэк распознавания (поток record.py): передаёт фразу в event loop бота"""
+    asyncio.run_coroutine_threadsafe(start_voice_turn(text), voice_loop)
 
+
+async def start_voice_turn(text: str):
     combined_text = text  # Изначально используем новый текст
 
-    # Если есть активные потоки, объединяем их текст с новым и прерываем
-    if active_threads:
-        # Собираем текст от всех активных потоков
-        for thread, stop_event, prev_text in active_threads:
-            if thread.is_alive():
-                combined_text = prev_text + " " + combined_text  # Объединяем предыдущий текст с новым
-                stop_event.set()  # Устанавливаем флаг прерывания
-                thread.join(timeout=0.1)  # Ждём завершения с небольшим таймаутом
-        active_threads.clear()  # Очищаем список после прерывания
-
-    # Создаём новый поток с объединённым текстом и собственным stop_event
-    stop_event = threading.Event()  # Уникальный stop_event для нового потока
-    new_thread = threading.Thread(target=on_speak_text, args=(combined_text, stop_event))
-    active_threads.append((new_thread, stop_event, combined_text))  # Добавляем кортеж (поток, stop_event, текст)
-    new_thread.start()
-
-
-def on_speak_text(text: str, stop_event: threading.Event):
-    # sql_database['time_stop_playing'] = time.time()
-    print("on_speak_text", text)
-
-    # Проверяем флаг прерывания перед началом длительных операций
-    if stop_event.is_set():
-        print("Thread interrupted before processing")
-        return
-
-    # Динамическая загрузка знаний из базы данных
-    memories_character = embedding_tools.get_memories(text)
-    if stop_event.is_set():
-        print("Thread interrupted during memory loading")
-        return
-
-    chat_history = sql_database.get('chat_history_voice', [])
+    # Если есть незавершённые ответы, объединяем их текст с новым и отменяем их
+    for task, stop_event, prev_text in voice_turns:
+        if not task.done():
+            combined_text = prev_text + " " + combined_text  # Объединяем предыдущий текст с новым
+            stop_event.set()  # Останавливает TTS, который работает в потоках
+            task.cancel()  # Отменяет ожидание и HTTP запросы эмбеддингов
+    voice_turns.clear()
+
+    stop_event = threading.Event()
+    task = asyncio.ensure_future(on_speak_text(combined_text, stop_event))
+    turn = (task, stop_event, combined_text)
+    voice_turns.append(turn)
+    task.add_done_callback(lambda _: voice_turns.remove(turn) if turn in voice_turns else None)
+
+
+def voice_answer_chunks(prompt: str):
+    """
+    Куски ответа голосовой модели. network_client.chatgpt_api отдаёт ответ целиком,
+    поэтому сейчас это один кусок; потоковый источник подключается здесь
+    """
+    answer_gpt = network_client.chatgpt_api(
+        prompt=prompt,
+        model=voice_gpt_model,
+        internet_access=internet_access
+    )
+    yield answer_gpt.response.text
+
+
+async def on_speak_text(text: str, stop_event: threading.Event):
+    logger.logging(f"on_speak_text: {text}")
+    await voice_turn_semaphore.acquire()  # не больше max_voice_turns ответов одновременно
+    workers = []  # поток GPT + TTS этого ответа
+    try:
+        await speak_answer(text, stop_event, workers)
+    except asyncio.CancelledError:
+        stop_event.set()
+        logger.logging("Voice turn cancelled")
+        raise
+    except Exception as e:
+        logger.logging(f"Error in voice turn: {e}")
+    finally:
+        # Синхронный chatgpt_api в потоке не отменить: слот занят, пока поток не вернётся,
+        # иначе частые перебивания запускают больше запросов к GPT, чем max_voice_turns
+        if workers and not workers[0].done():
+            workers[0].add_done_callback(lambda _: voice_turn_semaphore.release())
+        else:
+            voice_turn_semaphore.release()
+
+
+async def speak_answer(text: str, stop_event: threading.Event, workers: list):
+    # Динамическая загрузка знаний из базы данных (aiohttp запрос отменяется вместе с задачей)
+    try:
+        query_embedding = await embedding_tools.aget_embedding(text, max_retries=20)
+        memories_character = await asyncio.to_thread(embedding_tools.search_memories, [query_embedding])
+    except Exception as e:
+        # Без памяти ответ всё равно нужен
+        logger.logging(f"Error in voice memories search: {e}")
+        memories_character = ""
+
+    chat_history = chat_history_store.recent(VOICE_HISTORY, max_length_history_messages, max_length_history)
     formatted_chat_history = format_messages(chat_history, max_length=max_length_history)
-    if stop_event.is_set():
-        print("Thread interrupted during history formatting")
-        return
 
     contexts = [
         EventTypeForManager.current_voice_chat_members,
@@ -82,9 +117,6 @@ def on_speak_text(text: str, stop_event: threading.Event):
     ]
     recent_events = event_manager.get_events(contexts)
     events_text = event_manager.format_events(recent_events, max_length=max_event_length)
-    if stop_event.is_set():
-        print("Thread interrupted during event formatting")
-        return
 
     full_prompt = (
         f"# Задача\n"
@@ -98,53 +130,47 @@ def on_speak_text(text: str, stop_event: threading.Event):
         f"{text}"
     )
 
-    # Запрос к GPT
-    answer_gpt = network_client.chatgpt_api(
-        prompt=full_prompt,
-        model=voice_gpt_model,
-        internet_access=internet_access
-    )
-    if stop_event.is_set():
-        print("Thread interrupted during GPT response")
-        return
-
-    response_text = remove_emojis(answer_gpt.response.text)
-
-    chat_history = save_answer_to_history(
-        chat_history=chat_history,
-        prompt=text,
-        user_nickname="user",
-        answer=response_text,
-        character_nickname=character_name
-    )
-    sql_database['chat_history_voice'] = chat_history
-    if stop_event.is_set():
-        print("Thread interrupted before TTS")
-        return
-
-    # Вывести через динамики
-    tts_audio_with_play(
-        text=response_text,
+    # Ответ GPT озвучивается по предложениям, не дожидаясь конца генерации.
+    # chatgpt_api синхронный: при отмене задача не ждёт его, а stop_event не даёт озвучить результат;
+    # слот voice_turn_semaphore освобождается только когда поток вернётся (см. on_speak_text)
+    response_parts = []
+
+    def answer_chunks():
+        for chunk in voice_answer_chunks(full_prompt):
+            chunk = remove_emojis(chunk)
+            response_parts.append(chunk)
+            yield chunk
+        # Ответ сохраняется, как только сгенерирован: отмена во время озвучки его уже не теряет
+        chat_history_store.append(VOICE_HISTORY, save_answer_to_history(
+            chat_history=[],
+            prompt=text,
+            user_nickname="user",
+            answer="".join(response_parts),
+            character_nickname=character_name
+        ))
+
+    worker = asyncio.ensure_future(asyncio.to_thread(
+        tts_stream_with_play,
+        answer_chunks(),
         speed=speed,
         lang=lang,
         voice_id=voice_id,
         model_id=model_id,
         stop_event=stop_event
-    )
-
-    # Удаляем завершившийся поток из списка активных
-    current_thread = threading.current_thread()
-    for thread, event, _ in active_threads:
-        if thread == current_thread:
-            active_threads.remove((thread, event, text))
-            break
+    ))
+    workers.append(worker)
+    # shield: отмена задачи не помечает поток завершённым, пока он на самом деле работает
+    await asyncio.shield(worker)
 
 
 if __name__ == "__main__":
+    chat_history_store.migrate(VOICE_HISTORY, sql_database, 'chat_history_voice')
     if clear_history_on_restart:
-        sql_database['chat_history_voice'] = []
+        chat_history_store.clear(VOICE_HISTORY)
         sql_database['chat_history_chat'] = []
 
+    voice_loop = asyncio.get_event_loop()
+
     processor = AudioProcessor(input_device_name=secret.device_input, embedding_tools=embedding_tools)
     threading.Thread(target=processor.recognize_audio, args=(on_speak_text_thread,)).start()
     threading.Thread(target=processor.record_audio).start()
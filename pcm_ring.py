@@ -0,0 +1,114 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+HEADER_BYTES = 8  # int64: сколько кадров записано за всё время
+
+
+class PCMRingBuffer:
+    """
+    Кольцевой буфер моно PCM int16 в multiprocessing.shared_memory.
+
+    Буфер выделяется один раз и состоит из capacity_frames кадров по frame_samples сэмплов.
+    Кадр адресуется глобальным номером (0, 1, 2, ... за всю сессию): запись не выделяет память,
+    стерео сводится в моно прямо в слот буфера, читатель получает view без копирования.
+    Объект можно передать в другой процесс: он подключится к той же shared memory по имени.
+    Читатель должен успеть обработать кадр, пока буфер не сделал круг (capacity_frames кадров).
+    """
+
+    def __init__(self, capacity_frames: int, frame_samples: int, name: str = None):
+        self.capacity_frames = capacity_frames
+        self.frame_samples = frame_samples
+        self.frame_bytes = frame_samples * 2
+        self.owner = name is None
+        size = HEADER_BYTES + capacity_frames * self.frame_bytes
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+            except TypeError:
+                self.shm = shared_memory.SharedMemory(name=name)
+        self._attach()
+        if self.owner:
+            self._written[0] = 0
+
+    def _attach(self):
+        self._written = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf[:HEADER_BYTES])
+        self._frames = np.ndarray(
+            (self.capacity_frames, self.frame_samples),
+            dtype=np.int16,
+            buffer=self.shm.buf[HEADER_BYTES:HEADER_BYTES + self.capacity_frames * self.frame_bytes]
+        )
+        self._mix = np.empty(self.frame_samples, dtype=np.int32)  # для сведения стерео без выделений
+
+    def __getstate__(self):
+        return {"capacity_frames": self.capacity_frames, "frame_samples": self.frame_samples, "name": self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def written(self) -> int:
+        """Номер следующего кадра (= сколько кадров записано)"""
+        return int(self._written[0])
+
+    def write(self, data, channels: int = 1) -> int:
+        """Записывает кадр (int16, channels каналов) в следующий слот. Возвращает номер кадра"""
+        index = self.written
+        slot = self._frames[index % self.capacity_frames]
+        samples = np.frombuffer(data, dtype=np.int16)
+        if channels == 1:
+            count = min(len(samples), self.frame_samples)
+            slot[:count] = samples[:count]
+        else:
+            count = min(len(samples) // channels, self.frame_samples)
+            interleaved = samples[:count * channels].reshape(count, channels)
+            mix = self._mix[:count]
+            np.add(interleaved[:, 0], interleaved[:, 1], out=mix, dtype=np.int32)
+            for channel in range(2, channels):
+                np.add(mix, interleaved[:, channel], out=mix)
+            np.floor_divide(mix, channels, out=mix)
+            slot[:count] = mix
+        slot[count:] = 0
+        self._written[0] = index + 1  # после данных: читатель не увидит недописанный кадр
+        return index
+
+    def is_available(self, index: int) -> bool:
+        """Кадр записан и ещё не перезаписан"""
+        written = self.written
+        return written - self.capacity_frames <= index < written
+
+    def frame(self, index: int) -> np.ndarray:
+        """View кадра (без копирования). Действителен, пока is_available(index)"""
+        if not self.is_available(index):
+            raise IndexError(f"Frame {index} is not in the ring buffer (written: {self.written})")
+        return self._frames[index % self.capacity_frames]
+
+    def close(self):
+        """Отключается от shared memory; владелец ещё и удаляет её (повторный вызов ничего не делает)"""
+        if self._frames is None:
+            return
+        self._written = self._frames = None
+        try:
+            self.shm.close()
+        finally:
+            if self.owner:
+                self.shm.unlink()
+
+
+if __name__ == "__main__":
+    import tracemalloc
+
+    ring = PCMRingBuffer(capacity_frames=1000, frame_samples=480)
+    stereo = (np.arange(960, dtype=np.int16) % 100).tobytes()
+    tracemalloc.start()
+    for _ in range(100):
+        ring.write(stereo, channels=2)
+    baseline = tracemalloc.get_traced_memory()[0]
+    for _ in range(100_000):  # ~50 минут записи
+        ring.write(stereo, channels=2)
+    print(f"Память после 100000 кадров: {tracemalloc.get_traced_memory()[0] - baseline} байт сверх базовой")
+    expected = np.frombuffer(stereo, dtype=np.int16).reshape(-1, 2).astype(np.int32).sum(axis=1) // 2
+    assert np.array_equal(ring.frame(ring.written - 1), expected)
+    ring.close()
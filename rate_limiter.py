@@ -0,0 +1,125 @@
+import atexit
+import threading
+import time
+from collections import deque
+
+from base_logger import Logs
+
+logger = Logs(warnings=True, name="rate-limiter")
+
+
+class RateLimiter:
+    """
+    Ограничение частоты по ключам (all, сервер, канал, пользователь) скользящим журналом.
+
+    limits: {key: {"count": N, "time": секунды}}; ключ без своего лимита берёт "default",
+    "all" проверяется всегда, если задан. Для ключа хранятся только последние N отметок времени
+    (deque(maxlen=N)), так что проверка O(1) и в любом окне длиной time не больше N событий,
+    без двойных всплесков на границе фиксированного окна.
+    Ключи без событий дольше своего окна удаляются. С sql_database журналы переживают перезапуск.
+    """
+
+    def __init__(self, limits: dict, sql_database=None, sql_key: str = "rate_limits", evict_interval: float = 60):
+        self.limits = limits
+        self.sql_database = sql_database
+        self.sql_key = sql_key
+        self.evict_interval = evict_interval
+        self._logs = {}
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        self._dirty = False
+
+        if sql_database is not None:
+            now = time.time()
+            for key, stamps in sql_database.get(sql_key, {}).items():
+                limit = self._limit(key)
+                if limit:
+                    log = self._logs[key] = deque(maxlen=limit["count"])
+                    log.extend(stamp for stamp in stamps if now - stamp < limit["time"])
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._logs)
+
+    def _limit(self, key: str) -> dict:
+        return self.limits.get(key, self.limits.get("default"))
+
+    def _keys(self, keys: list) -> list:
+        return (["all"] if "all" in self.limits else []) + [key for key in keys if key != "all"]
+
+    def _wait(self, key: str, now: float) -> float:
+        limit = self._limit(key)
+        log = self._logs.get(key)
+        if not limit or not log or len(log) < limit["count"]:
+            return 0.0
+        return max(0.0, log[0] + limit["time"] - now)
+
+    def time_until_allowed(self, keys: list, now: float = None) -> float:
+        """Сколько секунд ждать, пока событие по всем ключам станет разрешено (0 - можно сейчас)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return max((self._wait(key, now) for key in self._keys(keys)), default=0.0)
+
+    def try_acquire(self, keys: list, now: float = None) -> float:
+        """
+        Если по всем ключам можно - записывает событие и возвращает 0.
+        Иначе ничего не записывает и возвращает время до разрешения
+        """
+        now = time.time() if now is None else now
+        keys = self._keys(keys)
+        with self._lock:
+            wait = max((self._wait(key, now) for key in keys), default=0.0)
+            if wait:
+                return wait
+            for key in keys:
+                limit = self._limit(key)
+                if limit:
+                    log = self._logs.get(key)
+                    if log is None:
+                        log = self._logs[key] = deque(maxlen=limit["count"])
+                    log.append(now)
+            self._dirty = True
+            periodic = now - self._last_evict > self.evict_interval
+            if periodic:
+                self._evict(now)
+        if periodic:
+            self.save()  # журналы сохраняются вместе с очисткой, а не на каждое событие
+        return 0.0
+
+    def _evict(self, now: float):
+        """Удаляет ключи, у которых последнее событие старше окна лимита"""
+        self._last_evict = now
+        for key in [key for key, log in self._logs.items()
+                    if not log or now - log[-1] >= (self._limit(key) or {"time": 0})["time"]]:
+            del self._logs[key]
+
+    def save(self):
+        if self.sql_database is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {key: list(log) for key, log in self._logs.items()}
+            self._dirty = False
+        try:
+            self.sql_database[self.sql_key] = state
+        except Exception as e:
+            logger.logging(f"Не удалось сохранить лимиты: {e}")
+
+
+if __name__ == "__main__":
+    # Фиксированное окно пропускало 2 * count на границе окна, скользящий журнал - не больше count
+    limiter = RateLimiter({"all": {"count": 3, "time": 1}, "default": {"count": 2, "time": 10}})
+    allowed = [t for t in (9.9, 9.95, 10.0, 10.05) if not limiter.try_acquire(["guild", "channel"], now=t)]
+    print(f"разрешено: {allowed}, ждать: {limiter.time_until_allowed(['guild', 'channel'], now=10.05):.2f}s")
+    assert allowed == [9.9, 9.95]
+    assert limiter.time_until_allowed(["other"], now=10.05) == 0.0  # свой лимит у другого канала
+
+    for n in range(100000):
+        limiter.try_acquire([f"channel{n}"], now=100 + n * 0.5)
+    print(f"ключей после 100000 каналов: {len(limiter)}")
+
+    start_time = time.perf_counter()
+    for n in range(100000):
+        limiter.try_acquire(["guild", f"channel{n % 1000}"], now=1e6 + n)
+    print(f"{(time.perf_counter() - start_time) / 100000 * 1e6:.2f} мкс на проверку")
@@ -1,27 +1,44 @@
+import atexit
 import multiprocessing
+import queue
 import random
 import string
 import threading
 import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-import numpy as np
 import pyaudio
-import speech_recognition as sr
 import webrtcvad
 from functions import random_string
 
 import secret
-from base_classes import sql_database
+from base_classes import barge_in
 from base_logger import Logs
+from endpointer import Endpointer
+from pcm_ring import PCMRingBuffer
+from stt_backends import get_stt_backend
 from tts_tools import get_device_index_by_name
 
 recognize_lang = secret.recognize_lang
 recognize_extra_logs = secret.recognize_extra_logs
+stt_backend_name = secret.stt_backend
+stt_workers = secret.stt_workers
+vosk_model_path = secret.vosk_model_path
 
 logger = Logs(warnings=recognize_extra_logs, name="record")
 
 
+class _Utterance:
+    """Фраза в очереди распознавания: номера кадров в кольцевом буфере и время"""
+
+    def __init__(self):
+        self.frames = queue.Queue()
+        self.created = time.monotonic()
+        self.ended = float("inf")  # пока фраза не закончилась, она не устаревает
+
+
 class AudioProcessor:
     def __init__(self, input_device_name=None, embedding_tools=None):
         self.audio_queue = multiprocessing.Queue()
@@ -35,13 +52,46 @@ class AudioProcessor:
         self.embedding_tools = embedding_tools
         self.embedding_interval = secret.embedding_interval
 
-    def stereo_to_mono(self, data):
-        """Преобразование стерео в моно."""
-        stereo_data = np.frombuffer(data, dtype=np.int16)
-        if len(stereo_data) % 2 != 0:
-            stereo_data = stereo_data[:-1]  # Убедимся, что длина четная
-        mono_data = stereo_data.reshape(-1, 2).mean(axis=1).astype(np.int16)
-        return mono_data.tobytes()
+        self.endpointer = Endpointer(
+            frame_ms=self.CHUNK * 1000 // self.RATE,
+            silence_duration=self.SILENCE_DURATION,
+            pre_roll=secret.pre_roll_duration,
+            max_utterance=secret.max_utterance_duration,
+            adaptive=secret.adaptive_silence
+        )
+        # Все кадры записи лежат в общем кольцевом буфере, в audio_queue идут только их номера
+        self.ring = PCMRingBuffer(
+            capacity_frames=int(self.RATE / self.CHUNK * secret.record_buffer_seconds),
+            frame_samples=self.CHUNK
+        )
+        atexit.register(self.close)
+        self.stt_backend = get_stt_backend(stt_backend_name, lang=recognize_lang, vosk_model_path=vosk_model_path)
+        self.stt_workers = stt_workers
+        self.max_utterance_age = secret.stt_max_utterance_age
+        self.coalesce_utterances = secret.stt_coalesce_utterances
+
+        self._stats_lock = threading.Lock()
+        self._counters = {"recognized": 0, "coalesced": 0, "dropped": 0, "busy_workers": 0,
+                          "queue_depth": 0, "max_queue_depth": 0}
+        self._metrics = {"wait": deque(maxlen=200), "latency": deque(maxlen=200)}
+
+    def __getstate__(self):
+        # для запуска в multiprocessing.Process: блокировка не передаётся, у процесса свои метрики
+        state = self.__dict__.copy()
+        del state["_stats_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._stats_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def close(self):
+        """Освобождает кольцевой буфер: процесс-владелец удаляет shared memory, остальные только отключаются"""
+        try:
+            self.ring.close()
+        except Exception as e:
+            logger.logging(f"Error closing PCM ring buffer: {e}")
 
     def record_audio(self):
         """Запись аудио с микрофона или Stereo Mix с использованием VAD."""
@@ -100,9 +150,9 @@ class AudioProcessor:
 
         vad = webrtcvad.Vad(1)  # Уровень агрессивности VAD
         logger.logging("Говорите...")
-        frames = []  # Буфер для аудиоданных
-        silence_threshold = int(self.RATE / self.CHUNK * self.SILENCE_DURATION)  # Количество блоков тишины
-        silent_chunks = 0
+        # Пока человек говорит, в audio_queue сразу уходят номера кадров в self.ring:
+        # (utterance_id, первый кадр, количество, конец_фразы)
+        utterance_id = None
         speech_chunks = 0  # Счетчик блоков речи
         speech_duration_threshold = int(
             self.RATE / self.CHUNK * self.STOP_ON_SPEECH_DURATION)  # 2 секунды в блоках (66.67 блоков при 30 мс)
@@ -112,17 +162,28 @@ class AudioProcessor:
         while True:
             try:
                 data = stream.read(self.CHUNK)
+                # Стерео сводится в моно прямо в слот кольцевого буфера
+                index = self.ring.write(data, channels=channels)
                 if channels == 2:
-                    data = self.stereo_to_mono(data)  # Преобразуем стерео в моно для VAD
+                    data = self.ring.frame(index).tobytes()  # webrtcvad принимает только bytes
                 is_speech = vad.is_speech(data, self.RATE)
 
+                # Границы фраз: pre-roll, обрезка тишины, ограничение длины, адаптивная пауза
+                for event in self.endpointer.process(index, is_speech):
+                    if event[0] == "speech":
+                        if utterance_id is None:
+                            utterance_id = uuid.uuid4().hex
+                        self.audio_queue.put((utterance_id, event[1], event[2], False))
+                    else:
+                        logger.logging(f"Put voice data (пауза {self.endpointer.silence_duration:.2f}s)")
+                        self.audio_queue.put((utterance_id, event[1], 0, True))
+                        utterance_id = None
+
                 if is_speech:
-                    frames.append(data)
-                    silent_chunks = 0  # Сбрасываем счётчик тишины
                     speech_chunks += 1  # Увеличиваем счетчик блоков речи
                     # Если речь длится X секунды или больше
                     if speech_chunks >= speech_duration_threshold:
-                        sql_database['time_stop_playing'] = time.time()
+                        barge_in.stop()
                         logger.logging(
                             f"Речь длительностью {self.STOP_ON_SPEECH_DURATION} секунды обнаружена, остановка воспроизведения")
 
@@ -138,15 +199,7 @@ class AudioProcessor:
                             ).start()
                             last_embedding_time = current_time
                 else:  # Тишина
-                    frames.append(data)
-                    silent_chunks += 1
                     speech_chunks = 0  # Сбрасываем счетчик речи при тишине
-                    if silent_chunks >= silence_threshold and frames:  # Достигнута пауза и есть данные
-                        audio_data = b''.join(frames)
-                        logger.logging("Put voice data")
-                        self.audio_queue.put(sr.AudioData(audio_data, self.RATE, 2))
-                        frames = []
-                        silent_chunks = 0
 
             except KeyboardInterrupt:
                 self.audio_queue.put(None)
@@ -156,37 +209,143 @@ class AudioProcessor:
         stream.close()
         p.terminate()
 
-    def recognize_audio(self, callback):
-        """Распознавание аудио из очереди."""
-        recognizer = sr.Recognizer()
-        while True:
-            try:
-                logger.logging("Getting voice data...")
-                audio_data = self.audio_queue.get(timeout=1)
-                if audio_data is None:
-                    logger.logging("Data is None!")
-                    continue
+    def _record_metric(self, name: str, value: float):
+        with self._stats_lock:
+            self._metrics[name].append(value)
 
-                logger.logging("start recognize")
-                text = recognizer.recognize_google(audio_data, language=recognize_lang)
-                logger.logging(f"recognized: {text}")
+    def _count(self, name: str, value: int = 1):
+        with self._stats_lock:
+            self._counters[name] += value
+
+    def recognition_stats(self) -> dict:
+        """
+        Метрики распознавания для подбора stt_workers:
+        queue_depth - фраз ждут воркера, wait - ожидание воркера (сек),
+        latency - от конца речи до готового текста (сек), busy_workers - занято воркеров
+        """
+        with self._stats_lock:
+            stats = dict(self._counters)
+            for name, values in self._metrics.items():
+                ordered = sorted(values)
+                stats[f"{name}_avg"] = round(sum(ordered) / len(ordered), 3) if ordered else 0.0
+                stats[f"{name}_p95"] = round(ordered[int(len(ordered) * 0.95)], 3) if ordered else 0.0
+        return stats
+
+    def _recognize_utterance(self, batch, callback, partial_callback, previous_done, done, free_workers):
+        """
+        Распознаёт фразы batch (обычно одну, при отставании - несколько подряд одним запросом)
+        по мере поступления кадров. Итоговые тексты отдаются в порядке фраз
+        """
+        text = ""
+        try:
+            started = time.monotonic()
+            for utterance in batch:
+                self._record_metric("wait", started - utterance.created)
+            stream = self.stt_backend.create_stream(self.RATE)
+            for utterance in batch:
+                while True:
+                    index = utterance.frames.get()
+                    if index is None:  # конец речи по VAD
+                        break
+                    if not self.ring.is_available(index):
+                        logger.logging(f"Кадр {index} уже перезаписан в кольцевом буфере, распознавание отстаёт")
+                        continue
+                    partial = stream.accept(self.ring.frame(index))  # view без копирования
+                    if partial and partial_callback:
+                        partial_callback(partial)
+
+            logger.logging("start recognize")
+            text = stream.finish()
+            self._record_metric("latency", time.monotonic() - batch[-1].ended)
+            logger.logging(f"recognized: {text}")
+        except Exception as e:
+            logger.logging(f"Ошибка распознавания: {e}")
+        finally:
+            free_workers.release()
+            self._count("busy_workers", -1)
+            previous_done.wait(timeout=60)  # предыдущая фраза должна уйти в callback первой
+            try:
                 if text:
                     callback(text.strip())
-            except (sr.UnknownValueError, multiprocessing.queues.Empty):
-                continue
-            except sr.RequestError as e:
-                logger.logging(f"Ошибка: {e}")
-            except Exception as e:
-                logger.logging(f"Critical error: {e}")
+            finally:
+                done.set()
+
+    def _dispatch(self, waiting: deque, pool, free_workers, callback, partial_callback, last_done):
+        """
+        Отдаёт ждущие фразы свободным воркерам.
+        Фраза, которая закончилась больше stt_max_utterance_age назад и за которой уже есть новая, отбрасывается:
+        ответ на неё всё равно отменит более новый. Остальные ждущие фразы склеиваются в один запрос
+        """
+        while waiting and free_workers.acquire(blocking=False):
+            now = time.monotonic()
+            while len(waiting) > 1 and now - waiting[0].ended > self.max_utterance_age:
+                waiting.popleft()
+                self._count("dropped")
+                logger.logging("Фраза устарела в очереди распознавания, отброшена")
+            batch = [waiting.popleft()]
+            while self.coalesce_utterances and waiting:
+                batch.append(waiting.popleft())
+            self._count("coalesced", len(batch) - 1)
+            self._count("recognized")
+            self._count("busy_workers")
+            done = threading.Event()
+            pool.submit(self._recognize_utterance, batch, callback, partial_callback, last_done, done, free_workers)
+            last_done = done
+        with self._stats_lock:
+            self._counters["queue_depth"] = len(waiting)
+            self._counters["max_queue_depth"] = max(self._counters["max_queue_depth"], len(waiting))
+        return last_done
+
+    def recognize_audio(self, callback, partial_callback=None):
+        """
+        Распознавание фраз из очереди. Фраза получает воркер из пула stt_workers сразу, если он свободен;
+        если все заняты - ждёт, и при отставании ждущие фразы склеиваются, а устаревшие отбрасываются
+        """
+        utterances = {}  # utterance_id -> фраза, которая ещё не закончилась
+        waiting = deque()  # фразы, которым не достался воркер
+        free_workers = threading.Semaphore(self.stt_workers)
+        last_done = threading.Event()
+        last_done.set()
+        last_stats = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.stt_workers, thread_name_prefix="stt") as pool:
+            while True:
+                try:
+                    message = self.audio_queue.get(timeout=0.05)
+                except queue.Empty:
+                    message = ()
+                if message is None:
+                    logger.logging("Data is None!")
+                elif message:
+                    utterance_id, offset, length, is_final = message
+                    utterance = utterances.get(utterance_id)
+                    if utterance is None:
+                        utterance = _Utterance()
+                        utterances[utterance_id] = utterance
+                        waiting.append(utterance)
+                    for index in range(offset, offset + length):
+                        utterance.frames.put(index)
+                    if is_final:
+                        utterance.ended = time.monotonic()
+                        utterance.frames.put(None)
+                        del utterances[utterance_id]
+
+                last_done = self._dispatch(waiting, pool, free_workers, callback, partial_callback, last_done)
+                if time.monotonic() - last_stats > 60:
+                    last_stats = time.monotonic()
+                    logger.logging(f"STT: {self.recognition_stats()}")
 
 
 def print_text(text):
     print("print_text", text)
 
 
+def print_partial(text):
+    print("partial", text)
+
+
 if __name__ == "__main__":
     processor = AudioProcessor(input_device_name="Стерео микшер")  # Для динамиков
-    recognize_process = multiprocessing.Process(target=processor.recognize_audio, args=(print_text,))
+    recognize_process = multiprocessing.Process(target=processor.recognize_audio, args=(print_text, print_partial))
     record_process = multiprocessing.Process(target=processor.record_audio)
 
     recognize_process.start()
@@ -0,0 +1,205 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+
+from base_logger import Logs
+
+logger = Logs(warnings=True, name="reply-scheduler")
+
+# Приоритеты ответов: меньше - важнее
+PRIORITY_DM = 0
+PRIORITY_PING = 1
+PRIORITY_NAME = 2
+PRIORITY_EVERY_MESSAGE = 3
+PRIORITY_NO_REPLY = 4  # сообщение только сохраняется в историю
+
+
+class ReplyScheduler:
+    """
+    Очередь ответов по каналам с ограниченным числом воркеров.
+
+    submit(channel_id, priority, item) кладёт сообщение в очередь канала. Свободный воркер берёт канал
+    с самым важным сообщением, при равенстве - тот, что ждёт дольше; канал обслуживается одним воркером
+    за раз, а после обработки встаёт в очередь заново, поэтому один шумный канал не занимает весь пул.
+    Сообщения канала, накопившиеся за время ожидания, уходят в handler одной пачкой (coalesce).
+    Если даже самое новое сообщение канала ждало дольше max_wait, пачка отдаётся с shed=True:
+    без ответа, только сохранение в историю.
+    handler: async (channel_id, items, shed). Если он вернул число секунд (например, до освобождения лимита
+    сообщений), пачка возвращается в начало очереди канала и выдаётся снова не раньше, чем через это время:
+    ожидание не занимает воркер.
+    """
+
+    def __init__(self, handler, workers: int = 3, max_wait: float = 120, coalesce: bool = True):
+        self.handler = handler
+        self.workers = workers
+        self.max_wait = max_wait
+        self.coalesce = coalesce
+
+        self._pending = {}  # channel_id -> {"priority", "first", "last", "items", "not_before"}
+        self._active = set()
+        self._changed = asyncio.Event()
+        self._tasks = []
+        self._waits = deque(maxlen=200)
+        self._counters = {"handled": 0, "shed": 0, "deferred": 0, "max_queue_depth": 0}
+        self._last_stats = time.monotonic()
+
+    def submit(self, channel_id: str, priority: int, item):
+        if not self._tasks:  # воркеры стартуют в event loop бота при первом сообщении
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        now = time.monotonic()
+        entry = self._pending.get(channel_id)
+        if entry is None:
+            entry = self._pending[channel_id] = {"priority": priority, "first": now, "last": now, "items": [],
+                                                 "not_before": 0.0}
+        entry["priority"] = min(entry["priority"], priority)
+        entry["last"] = now
+        entry["items"].append((priority, item))
+        self._counters["max_queue_depth"] = max(self._counters["max_queue_depth"], self.queue_depth())
+        self._changed.set()
+
+    def queue_depth(self) -> int:
+        """Сколько сообщений ждут воркера"""
+        return sum(len(entry["items"]) for entry in self._pending.values())
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            **self._counters,
+            "queue_depth": self.queue_depth(),
+            "waiting_channels": len(self._pending),
+            "busy_workers": len(self._active),
+            "wait_avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "wait_p95": round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0
+        }
+
+    def _pick(self):
+        """Канал с самым важным и самым давним сообщением среди тех, что сейчас никто не обслуживает"""
+        now = time.monotonic()
+        candidates = [(entry["priority"], entry["first"], channel_id)
+                      for channel_id, entry in self._pending.items()
+                      if channel_id not in self._active and entry["not_before"] <= now]
+        if not candidates:
+            return None, None
+        _, _, channel_id = min(candidates)
+        entry = self._pending[channel_id]
+        if self.coalesce or len(entry["items"]) == 1:
+            del self._pending[channel_id]
+            return channel_id, entry
+        # Без склейки - по одному сообщению, остальные остаются в очереди канала
+        item = entry["items"].pop(0)
+        entry["priority"] = min(priority for priority, _ in entry["items"])
+        split = {**entry, "items": [item]}
+        entry["not_before"] = 0.0  # срок отложенной пачки переходит к выданному сообщению, остаток ждёт воркера
+        return channel_id, split
+
+    def _defer(self, channel_id: str, entry: dict, delay: float):
+        """Возвращает пачку в начало очереди канала; воркерам она выдаётся не раньше, чем через delay секунд"""
+        items = entry["items"]
+        last = entry["last"]
+        pending = self._pending.get(channel_id)
+        if pending is not None:  # сообщения, пришедшие во время обработки, идут после отложенных
+            items = items + pending["items"]
+            last = pending["last"]
+        self._pending[channel_id] = {"priority": min(priority for priority, _ in items), "first": entry["first"],
+                                     "last": last, "items": items, "not_before": time.monotonic() + delay}
+
+    def _next_due(self):
+        """
+        Через сколько секунд освободится ближайший отложенный канал (None - ждать нечего).
+        Каналы в обработке и прошедшие сроки не считаются: их разбудит _changed, иначе воркер крутится вхолостую
+        """
+        now = time.monotonic()
+        due = [entry["not_before"] for channel_id, entry in self._pending.items()
+               if channel_id not in self._active and entry["not_before"] > now]
+        return min(due) - now if due else None
+
+    async def _worker(self):
+        while True:
+            channel_id, entry = self._pick()
+            if channel_id is None:
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self._next_due())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.monotonic()
+            # Отложенная пачка считает ожидание с момента, когда её снова можно было выдать
+            shed = now - max(entry["last"], entry["not_before"]) > self.max_wait
+            if shed:
+                self._counters["shed"] += len(entry["items"])
+                logger.logging(f"Канал {channel_id}: {len(entry['items'])} сообщений ждали дольше "
+                               f"{self.max_wait}s, ответ пропущен")
+            if now - self._last_stats > 60:
+                self._last_stats = now
+                logger.logging(f"Очередь ответов: {self.stats()}")
+
+            self._active.add(channel_id)
+            delay = None
+            try:
+                delay = await self.handler(channel_id, [item for _, item in entry["items"]], shed)
+            except Exception:
+                logger.logging(f"Ошибка ответа в {channel_id}: {traceback.format_exc()}")
+            finally:
+                if delay and not shed:
+                    self._counters["deferred"] += len(entry["items"])
+                    self._defer(channel_id, entry, delay)
+                else:
+                    self._waits.append(now - entry["first"])
+                    self._counters["handled"] += len(entry["items"])
+                self._active.discard(channel_id)
+                self._changed.set()  # канал мог накопить новые сообщения
+
+
+if __name__ == "__main__":
+    # 2 воркера, шумный канал с 20 сообщениями, ЛС/пинги в других каналах; "other" не дождётся воркера,
+    # "limited" упирается в лимит сообщений и откладывается, не занимая воркер
+    async def demo():
+        order = []
+        limited = []
+
+        async def handler(channel_id, items, shed):
+            if channel_id == "limited" and not limited:
+                limited.append(items)
+                return 0.3  # лимит освободится через 0.3s
+            order.append((channel_id, items, shed))
+            await asyncio.sleep(0.1)  # как запрос к GPT
+
+        scheduler = ReplyScheduler(handler, workers=2, max_wait=0.15)
+        for n in range(20):
+            scheduler.submit("noisy", PRIORITY_EVERY_MESSAGE, f"spam{n}")
+        scheduler.submit("limited", PRIORITY_DM, "limited")
+        scheduler.submit("dm", PRIORITY_DM, "dm")
+        scheduler.submit("ping", PRIORITY_PING, "ping")
+        scheduler.submit("chat", PRIORITY_NAME, "name")
+        scheduler.submit("other", PRIORITY_EVERY_MESSAGE, "late")
+        await asyncio.sleep(0.15)
+        scheduler.submit("noisy", PRIORITY_EVERY_MESSAGE, "spam-late")
+        await asyncio.sleep(0.6)
+        for channel_id, items, shed in order:
+            print(f"{channel_id}: {len(items)} сообщений{' (shed)' if shed else ''}")
+        print(scheduler.stats())
+
+        # Без склейки: первое сообщение отложено, остальные выдаются по одному. Пока канал в обработке,
+        # воркеры не должны крутиться вхолостую - считаем вызовы _pick
+        picks = []
+        single = []
+
+        async def single_handler(channel_id, items, shed):
+            if not single:
+                single.append(items)
+                return 0.2
+            single.append(items)
+            await asyncio.sleep(0.3)
+
+        scheduler = ReplyScheduler(single_handler, workers=2, max_wait=5, coalesce=False)
+        pick = scheduler._pick
+        scheduler._pick = lambda: picks.append(1) or pick()
+        for n in range(3):
+            scheduler.submit("single", PRIORITY_DM, f"msg{n}")
+        await asyncio.sleep(1.4)
+        print(f"без склейки: {single[1:]}, вызовов _pick: {len(picks)}")
+
+    asyncio.run(demo())
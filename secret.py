@@ -10,18 +10,31 @@ cohere_api_keys = ["COHERE_API"]
 auth_token_discord = "ABCCCC.DEFFF..."  # Токен discord
 
 cohere_proxies = None  # Прокси для Cohere: {"http": proxy, "https": proxy}
+cohere_pool_size = 16  # максимум одновременных соединений с Cohere
+cohere_calls_per_minute = 100  # лимит запросов в минуту на один ключ Cohere
 discord_proxies = None  # Прокси для Discord: {"http": proxy, "https": proxy}
 
 # Настройка STT
 device_input = "CABLE-A Output"  # Основной микрофон STT
 recognize_lang = "ru-RU"
+stt_backend = "google"  # Движок STT: "google" (сеть, без промежуточных результатов) или "vosk" (офлайн, потоковый)
+vosk_model_path = "models/vosk-model-small-ru-0.22"  # Модель Vosk: https://alphacephei.com/vosk/models
+stt_workers = 3  # сколько фраз распознаётся параллельно
+stt_coalesce_utterances = True  # если распознавание отстаёт, ждущие фразы распознаются одним запросом
+stt_max_utterance_age = 10  # фраза, ждущая распознавания дольше (сек после конца речи), отбрасывается, если за ней есть новая
+record_buffer_seconds = 60  # размер кольцевого буфера записи (сек). Распознавание не должно отставать сильнее
 silence_duration = 0.7  # Длина тишины (сек), после которой начинается распознавание
+adaptive_silence = True  # подстраивать silence_duration под паузы говорящего (в пределах 0.4-1.5 сек)
+pre_roll_duration = 0.3  # сколько аудио до срабатывания VAD добавлять в начало фразы (сек)
+max_utterance_duration = 15  # фраза длиннее (сек) режется на ближайшей паузе
 stop_on_speech_duration = 3  # длительность речи (сек), после которой прекратится TTS. Нужно чтобы нейросеть не перебивала других людей
+max_voice_turns = 2  # сколько голосовых ответов может готовиться одновременно
+barge_in_sql_fallback = False  # дублировать сигнал перебивания в SQLite (если запись и TTS в разных процессах)
 recognize_extra_logs = False  # Логировать о начале и конце распознавания
 embedding_interval = 10  # как часто будет подгружаться embedding модель (для высокой скорости)
 
 # Настройка TTS
-devices_output = ["CABLE-B Input"]  # Динамик для TTS. Можно указать несколько
+devices_output = ["CABLE-B Input"]  # Динамик для TTS. Можно указать несколько. "null" - без звуковой карты
 translit_lang = 'ru'  # Для транслита английских слов на русский. None для отключения
 
 voice_id = ""  # ID голоса Hailuo TTS
@@ -35,7 +48,7 @@ handling_chat_ids = ["CHAT_ID"]  # список ID чатов, в которых
 handling_guild_ids = ["None", "GUILD_ID"]  # список ID гильдий. None - ЛС
 # Лимит на отправку сообщений (максимум X сообщение за X секунд)
 # all - общий лимит на отправку сообщений
-# "ID" - лимит на отправку сообщений в канале/гильдии
+# "ID" - лимит на отправку сообщений в канале/гильдии/пользователю (для пользователя - только если задан его ID)
 # default - лимит для ID, у которых не задан конкретный лимит
 # Формат: {"ключ": {"count": 1, "time": X}}
 send_message_limit = {
@@ -45,14 +58,24 @@ send_message_limit = {
     "default": {"count": 1, "time": 3}  # 1 сообщение за 3 секунды
 }
 
+max_reply_delay = 30  # если лимит освободится раньше (сек), ответ откладывается, иначе ставится реакция ⏳
+persist_rate_limits = True  # сохранять счётчики лимитов между перезапусками
+
 reply_on_every_message = False  # Отвечать на все сообщения
 # Если 'False' - реагирует только на свой ник в Discord, имя персонажа или упоминание (кроме @everyone и @here)
+known_users_flush_interval = 30  # раз в сколько секунд изменённые ники пользователей сохраняются в базу
+coalesce_messages = True  # сообщения, пришедшие пока бот отвечает в канале, обрабатываются одним запросом
+reply_workers = 3  # сколько ответов готовится одновременно (ЛС > пинг > имя > reply_on_every_message)
+max_reply_wait = 120  # сообщения, ждавшие ответа дольше (сек), только сохраняются в историю
 say_greeting_text = True  # приветствовать пользователей по имени при заходе в войс-чат
 max_reactions = 3  # Максимальное количество реакций на 1 сообщение
 message_delay = 5  # промежуток отправки сообщений, если их несколько
 max_event_length = 750  # Максимальный размер запоминаемых событий
 max_length_history_messages = 15  # Максимальный размер истории (количество сообщений)
 max_length_history = 2000  # Максимальный размер истории (количество символов)
+chat_history_path = "chat_history.db"  # история сообщений по каналам (SQLite)
+chat_history_keep_messages = 2000  # сколько последних сообщений хранить на канал (None - без ограничения)
+chat_history_max_age_days = None  # удалять сообщения старше N дней (None - без ограничения)
 
 # Настройки ChatGPT
 # - Не рекомендую использовать 'думающие модели из-за задержки'
@@ -61,8 +84,24 @@ chat_gpt_model = GptModels.chatgpt_4o  # 'chatgpt-4o'.
 voice_gpt_model = GptModels.chatgpt_4o  # 'chatgpt-4o'.
 search_dataset_model = GptModels.gpt_4o_mini  # Можно указать "gpt-4o-mini" - более быструю модель
 internet_access = False  # Доступ в интернет. Может замедлить ответ если 'True'
+# Отправлять действия ответа по мере разбора JSON. Даёт выигрыш только с потоковым источником ответа:
+# network_client.chatgpt_api отдаёт ответ целиком, поэтому по умолчанию ответ разбирается после получения
+stream_reply_actions = False
 clear_history_on_restart = False  # очищать историю сообщений (в войс-чате) при перезапуске кода
 max_results_deepsearch = 15  # Количество результатов поиска при режиме 'deepsearch' эмбеддингов
+memories_latency_budget = 8  # сколько секунд ответ в чате ждёт поиск по памяти, потом отвечает с тем, что готово
+dataset_check_interval = 5  # как часто (сек) проверять изменения файлов dataset_embeddings на диске
+# Поиск по памяти: "exact" - точный перебор, "ivf" - приближённый индекс для очень больших датасетов
+# ann_nprobe - точность/скорость для "ivf": больше - точнее, но медленнее. Сравнение: python ann_index.py dataset/dataset_embeddings
+memory_search_backend = "exact"
+ann_nprobe = 8
+ann_index_path = "dataset/ann_index.npz"
+# Формат dataset_embeddings: "json" или "npy" (бинарные матрицы + memmap, в ~10 раз компактнее и быстрее загрузка)
+# Перевести существующие JSON: python embedding_store.py dataset/dataset_embeddings float32
+embeddings_storage = "json"
+embeddings_storage_dtype = "float32"  # для "npy": float32 или float16 (в 2 раза меньше на диске)
+embedding_cache_path = "embedding_cache.db"  # постоянный кэш эмбеддингов (переживает перезапуски)
+embedding_cache_max_mb = 512  # максимальный размер кэша эмбеддингов, старые записи удаляются
 
 character_name = "CHAT_NAME"
 #  слова, на которые отзывается в чате.
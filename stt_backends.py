@@ -0,0 +1,202 @@
+import json
+import sys
+from abc import ABC, abstractmethod
+import threading
+import time
+import wave
+
+from base_logger import Logs
+
+try:
+    import speech_recognition as sr
+except Exception as e:
+    sr = None
+    print(f"Cant import speech_recognition. Google STT wont work. Error: {e}")
+
+try:
+    import vosk
+except Exception:
+    vosk = None  # необязательная зависимость: pip install vosk
+
+logger = Logs(warnings=True, name="stt")
+
+
+class STTStream(ABC):
+    """Распознавание одной фразы. accept() вызывается на каждый кадр PCM int16 mono"""
+
+    @abstractmethod
+    def accept(self, data):
+        """
+        Кадр аудио (bytes-like). Возвращает промежуточную гипотезу (str) или None.
+        data может быть view кольцевого буфера: сохранять его нельзя, только копировать
+        """
+
+    @abstractmethod
+    def finish(self) -> str:
+        """Конец речи по VAD. Возвращает итоговый текст ('' если ничего не распознано)"""
+
+
+class STTBackend(ABC):
+    """Интерфейс движка распознавания: создаёт поток на каждую фразу"""
+    name = ""
+    streaming = False  # выдаёт ли промежуточные гипотезы во время речи
+
+    @abstractmethod
+    def create_stream(self, sample_rate: int) -> STTStream:
+        """Новый поток распознавания для одной фразы"""
+
+
+class _GoogleStream(STTStream):
+    def __init__(self, backend, sample_rate: int):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.audio = bytearray()
+
+    def accept(self, data):
+        self.audio += memoryview(data).cast('B')
+        return None
+
+    def finish(self) -> str:
+        audio_data = sr.AudioData(bytes(self.audio), self.sample_rate, 2)
+        try:
+            return sr.Recognizer().recognize_google(audio_data, language=self.backend.lang)
+        except sr.UnknownValueError:
+            return ""
+
+
+class GoogleSTT(STTBackend):
+    """recognize_google: без промежуточных гипотез, фраза уходит в сеть целиком после конца речи"""
+    name = "google"
+
+    def __init__(self, lang: str):
+        self.lang = lang
+
+    def create_stream(self, sample_rate: int) -> STTStream:
+        return _GoogleStream(self, sample_rate)
+
+
+class _VoskStream(STTStream):
+    def __init__(self, model, sample_rate: int):
+        self.recognizer = vosk.KaldiRecognizer(model, sample_rate)
+        self.segments = []  # куски, которые Vosk уже завершил внутри фразы
+
+    def _text(self, text: str) -> str:
+        return " ".join(self.segments + [text]).strip()
+
+    def accept(self, data):
+        if self.recognizer.AcceptWaveform(bytes(data)):
+            segment = json.loads(self.recognizer.Result()).get("text", "")
+            if segment:
+                self.segments.append(segment)
+            return self._text("")
+        return self._text(json.loads(self.recognizer.PartialResult()).get("partial", ""))
+
+    def finish(self) -> str:
+        return self._text(json.loads(self.recognizer.FinalResult()).get("text", ""))
+
+
+class VoskSTT(STTBackend):
+    """Офлайн потоковое распознавание на CPU (Vosk/Kaldi). Модель загружается один раз и общая для всех потоков"""
+    name = "vosk"
+    streaming = True
+
+    def __init__(self, model_path: str):
+        if vosk is None:
+            raise ImportError("vosk is not installed: pip install vosk")
+        self.model_path = model_path
+        self._model = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"model_path": self.model_path}  # модель загрузится заново в другом процессе
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                vosk.SetLogLevel(-1)
+                start_time = time.time()
+                self._model = vosk.Model(self.model_path)
+                logger.logging(f"Vosk model loaded: {self.model_path} ({time.time() - start_time:.1f}s)")
+            return self._model
+
+    def create_stream(self, sample_rate: int) -> STTStream:
+        return _VoskStream(self.model, sample_rate)
+
+
+def get_stt_backend(name: str, lang: str = "ru-RU", vosk_model_path: str = None) -> STTBackend:
+    if name == "google":
+        return GoogleSTT(lang)
+    if name == "vosk":
+        return VoskSTT(vosk_model_path)
+    raise ValueError(f"Unknown STT backend: {name}")
+
+
+def read_wav_frames(path: str, frame_ms: int = 30):
+    """Кадры PCM int16 mono из WAV (как их отдаёт record_audio) и частота"""
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+            raise ValueError(f"{path}: нужен WAV 16 bit mono")
+        sample_rate = wav.getframerate()
+        frame_size = sample_rate * frame_ms // 1000
+        frames = []
+        while True:
+            data = wav.readframes(frame_size)
+            if not data:
+                break
+            frames.append(data)
+    return frames, sample_rate
+
+
+def benchmark(backend: STTBackend, wav_paths: list, realtime: bool = False) -> list:
+    """
+    Прогон WAV-фикстур через движок. Возвращает по словарю на файл:
+    first_partial - когда появилась первая гипотеза (от начала фразы, None - гипотез не было),
+    final_latency - сколько ждать текст после конца речи, rtf - время обработки / длительность аудио
+    """
+    results = []
+    for path in wav_paths:
+        frames, sample_rate = read_wav_frames(path)
+        duration = len(frames) * 0.03
+        stream = backend.create_stream(sample_rate)
+        first_partial = None
+
+        start_time = time.perf_counter()
+        for n, data in enumerate(frames):
+            if realtime:
+                time.sleep(max(0.0, start_time + n * 0.03 - time.perf_counter()))
+            partial = stream.accept(data)
+            if partial and first_partial is None:
+                first_partial = time.perf_counter() - start_time
+        end_of_speech = time.perf_counter()
+        text = stream.finish()
+        finished = time.perf_counter()
+
+        results.append({
+            "path": path,
+            "audio": duration,
+            "first_partial": first_partial,
+            "final_latency": finished - end_of_speech,
+            "rtf": (finished - start_time) / duration,
+            "text": text
+        })
+    return results
+
+
+if __name__ == "__main__":
+    # python stt_backends.py vosk models/vosk-model-small-ru-0.22 a.wav b.wav
+    # python stt_backends.py google ru-RU a.wav b.wav
+    backend_name, option, *paths = sys.argv[1:]
+    if backend_name == "vosk":
+        stt_backend = get_stt_backend("vosk", vosk_model_path=option)
+    else:
+        stt_backend = get_stt_backend(backend_name, lang=option)
+    for result in benchmark(stt_backend, [path for path in paths if path != "--realtime"], realtime="--realtime" in paths):
+        first_partial = result["first_partial"]
+        print(f"{result['path']}: audio={result['audio']:.2f}s "
+              f"first_partial={'-' if first_partial is None else f'{first_partial:.2f}s'} "
+              f"final_latency={result['final_latency']:.2f}s "
+              f"rtf={result['rtf']:.2f}\n  {result['text']}")
@@ -0,0 +1,82 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+import endpointer
+from endpointer import Endpointer, evaluate, segments_from_events, vad_decisions
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SPEECH_WAV = os.path.join(FIXTURES, "speech_8k.wav")
+
+
+def run(decisions: list, ep: Endpointer) -> list:
+    events = []
+    for index, is_speech in enumerate(decisions):
+        events.extend(ep.process(index, is_speech))
+    events.extend(ep.flush())
+    return segments_from_events(events, ep.frame_ms)
+
+
+class EndpointerFixtureTest(unittest.TestCase):
+    """speech_8k.wav: три размеченные фразы (speech_8k.json) и одиночный щелчок между первыми двумя"""
+
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(FIXTURES, "speech_8k.json"), 'r', encoding='utf-8') as f:
+            cls.labels = json.load(f)["segments"]
+        # Порог по энергии вместо webrtcvad: решения VAD одинаковы на любой машине
+        with mock.patch.object(endpointer, "webrtcvad", None):
+            cls.decisions = vad_decisions(SPEECH_WAV)
+
+    def test_defaults_match_labels(self):
+        ep = Endpointer()
+        report = evaluate(self.decisions, self.labels, ep)
+        self.assertEqual(report["detected"], report["labelled"])  # щелчок не открыл фразу
+        self.assertEqual(report["clipped_onsets"], 0)
+        # Начало фразы раньше размеченного не больше чем на pre-roll + окно старта
+        self.assertLessEqual(report["mean_start_error"], 0.3 + 0.15 + 0.03)
+        # После конца речи в распознавание уходит не больше keep_trailing на фразу
+        self.assertLessEqual(report["trailing_silence"], len(self.labels) * (0.15 + 0.03))
+
+    def test_trailing_trim_beats_plain_pause(self):
+        trimmed = evaluate(self.decisions, self.labels, Endpointer())
+        plain = evaluate(self.decisions, self.labels, Endpointer(pre_roll=0.0, keep_trailing=0.7, adaptive=False))
+        self.assertLess(trimmed["trailing_silence"], plain["trailing_silence"])
+        self.assertLess(trimmed["shipped_ratio"], plain["shipped_ratio"])
+
+    def test_segments_cover_labels(self):
+        segments = run(self.decisions, Endpointer())
+        for (start, end), (segment_start, segment_end, _) in zip(self.labels, segments):
+            self.assertLessEqual(segment_start, start)
+            self.assertGreaterEqual(segment_end, end)
+
+
+class EndpointerRulesTest(unittest.TestCase):
+    def test_click_does_not_open_utterance(self):
+        self.assertEqual(run([False] * 10 + [True] + [False] * 40, Endpointer()), [])
+
+    def test_pre_roll_is_shipped(self):
+        segments = run([False] * 30 + [True] * 20 + [False] * 40, Endpointer(pre_roll=0.3, adaptive=False))
+        self.assertEqual(len(segments), 1)
+        # Перед первым кадром речи - весь pre-roll (и не больше pre-roll + окна старта)
+        self.assertLessEqual(segments[0][0], 30 * 0.03 - 0.3 + 1e-9)
+        self.assertGreaterEqual(segments[0][0], 30 * 0.03 - 0.3 - 0.15 - 1e-9)
+
+    def test_long_utterance_is_split(self):
+        segments = run([True] * 1000, Endpointer(max_utterance=3.0, adaptive=False))
+        self.assertGreater(len(segments), 1)
+        for start, end, _ in segments:
+            self.assertLessEqual(end - start, 3.0 * 1.25 + 0.03)
+
+    def test_flush_closes_open_utterance(self):
+        ep = Endpointer()
+        for index in range(20):
+            ep.process(index, True)
+        self.assertTrue(ep.in_utterance)
+        self.assertEqual(ep.flush()[-1][0], "end")
+        self.assertFalse(ep.in_utterance)
+
+
+if __name__ == "__main__":
+    unittest.main()
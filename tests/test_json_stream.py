@@ -0,0 +1,69 @@
+import json
+import os
+import unittest
+
+from json_stream import JsonArrayStreamParser, split_chunks
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def parse(chunks) -> tuple:
+    parser = JsonArrayStreamParser()
+    objects = []
+    for chunk in chunks:
+        objects.extend(parser.feed(chunk))
+    return objects, parser
+
+
+class JsonArrayStreamParserTest(unittest.TestCase):
+    def setUp(self):
+        self.answer = read_fixture("llm_answer.txt")
+        self.expected = json.loads(read_fixture("llm_answer.expected.json"))
+
+    def test_whole_answer(self):
+        objects, parser = parse([self.answer])
+        self.assertEqual(objects, self.expected)
+        self.assertTrue(parser.finished)
+        self.assertEqual(parser.errors, 1)  # {"text": oops}
+
+    def test_every_chunk_size(self):
+        for size in range(1, 40):
+            with self.subTest(size=size):
+                self.assertEqual(parse(split_chunks(self.answer, size))[0], self.expected)
+
+    def test_every_split_point(self):
+        # Граница куска в любом месте: внутри строки, после '\\', между '{' и '"', внутри эмодзи-пары и т.д.
+        for split in range(len(self.answer) + 1):
+            with self.subTest(split=split):
+                objects, _ = parse([self.answer[:split], self.answer[split:]])
+                self.assertEqual(objects, self.expected)
+
+    def test_objects_arrive_as_soon_as_closed(self):
+        parser = JsonArrayStreamParser()
+        self.assertEqual(parser.feed('[{"text": "a"'), [])
+        self.assertEqual(parser.feed('}, {"text": "b'), [{"text": "a"}])
+        self.assertEqual(parser.feed('"}'), [{"text": "b"}])
+        self.assertFalse(parser.finished)
+        self.assertEqual(parser.feed(']'), [])
+        self.assertTrue(parser.finished)
+
+    def test_ignores_text_after_array(self):
+        parser = JsonArrayStreamParser()
+        self.assertEqual(parser.feed('[] [{"text": "a"}]'), [])
+        self.assertEqual(parser.feed('{"text": "b"}'), [])
+
+    def test_buffer_keeps_only_open_object(self):
+        parser = JsonArrayStreamParser()
+        parser.feed("[" + '{"text": "x"}, ' * 1000)
+        self.assertEqual(parser._buffer, "")
+        parser.feed('{"text": "unfinished')
+        self.assertEqual(parser._buffer, '{"text": "unfinished')
+
+
+if __name__ == "__main__":
+    unittest.main()
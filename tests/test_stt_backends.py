@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+import stt_backends
+from stt_backends import STTBackend, STTStream, benchmark, get_stt_backend, read_wav_frames
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SPEECH_WAV = os.path.join(FIXTURES, "speech_8k.wav")
+VOSK_MODEL_PATH = os.environ.get("VOSK_MODEL_PATH")
+
+
+class _EnergyStream(STTStream):
+    """Потоковый движок-заглушка: гипотеза на каждом громком кадре, в конце - число громких кадров"""
+
+    def __init__(self):
+        self.loud = 0
+
+    def accept(self, data):
+        if np.abs(np.frombuffer(data, dtype=np.int16)).mean() > 500:
+            self.loud += 1
+            return f"{self.loud}"
+        return None
+
+    def finish(self) -> str:
+        return f"{self.loud} loud frames"
+
+
+class _EnergyBackend(STTBackend):
+    name = "energy"
+    streaming = True
+
+    def create_stream(self, sample_rate: int) -> STTStream:
+        return _EnergyStream()
+
+
+class STTBackendsTest(unittest.TestCase):
+    def test_read_wav_frames(self):
+        frames, sample_rate = read_wav_frames(SPEECH_WAV)
+        self.assertEqual(sample_rate, 8000)
+        self.assertTrue(all(len(frame) == 240 * 2 for frame in frames[:-1]))  # 30 мс при 8000 Гц
+        with wave.open(SPEECH_WAV, 'rb') as wav:
+            self.assertEqual(sum(len(frame) for frame in frames), wav.getnframes() * 2)
+
+    def test_read_wav_frames_rejects_stereo(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "stereo.wav")
+            with wave.open(path, 'wb') as wav:
+                wav.setnchannels(2)
+                wav.setsampwidth(2)
+                wav.setframerate(16000)
+                wav.writeframes(bytes(1600))
+            with self.assertRaises(ValueError):
+                read_wav_frames(path)
+
+    def test_incomplete_backend_is_rejected(self):
+        class NoFinish(STTStream):
+            def accept(self, data):
+                return None
+
+        with self.assertRaises(TypeError):
+            NoFinish()
+        with self.assertRaises(TypeError):
+            STTBackend()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_stt_backend("unknown")
+
+    def test_benchmark_on_fixture(self):
+        result, = benchmark(_EnergyBackend(), [SPEECH_WAV])
+        self.assertAlmostEqual(result["audio"], 8.0, delta=0.03)
+        self.assertIsNotNone(result["first_partial"])  # streaming-движок даёт гипотезы во время речи
+        # Три фразы speech_8k.json (3.3 с) - около 110 громких кадров
+        self.assertAlmostEqual(int(result["text"].split()[0]), 110, delta=10)
+        self.assertLess(result["rtf"], 1.0)
+
+    @unittest.skipIf(stt_backends.vosk is None or not VOSK_MODEL_PATH, "нужны vosk и VOSK_MODEL_PATH")
+    def test_vosk_on_fixture(self):
+        backend = get_stt_backend("vosk", vosk_model_path=VOSK_MODEL_PATH)
+        result, = benchmark(backend, [SPEECH_WAV])
+        self.assertIsInstance(result["text"], str)
+        self.assertLess(result["rtf"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
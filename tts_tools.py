@@ -1,18 +1,19 @@
 import os
 import queue
+import re
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 try:
-    import sounddevice as sd
     import soundfile as sf
     from transliterate import translit
 except Exception as e:
-    print(f"Cant import one of: sounddevice, soundfile, transliterate. TTS module wont work. Error: {e}")
+    print(f"Cant import one of: soundfile, transliterate. TTS module wont work. Error: {e}")
 
-from base_classes import network_client, sql_database
+from base_classes import network_client, barge_in
 import secret
-from errors import DeviceNotFound
+from audio_output import AudioOutputEngine, get_device_index_by_name
 from base_logger import Logs
 
 tts_extra_logs = secret.tts_extra_logs
@@ -21,45 +22,47 @@ logger = Logs(warnings=tts_extra_logs, name="tts-tools")
 devices_output = secret.devices_output
 translit_lang = secret.translit_lang
 
-def get_device_index_by_name(device_name):
-    devices = sd.query_devices()
-    for i, device in enumerate(devices):
-        if device_name.lower() in device['name'].lower():
-            return i
-    raise DeviceNotFound(f"Нет такого устройства: {device_name}. Устройства: {devices}")
+def decode_audio_file(audio_file: str):
+    """Декодирует чанк TTS в PCM float32 (frames, channels) и сразу удаляет файл"""
+    try:
+        data, samplerate = sf.read(audio_file, dtype='float32', always_2d=True)
+    finally:
+        try:
+            os.remove(audio_file)
+        except OSError:
+            pass
+    return data, samplerate
 
 
 class TTSQueue:
     _queue = queue.Queue()
     _thread = None
     _running = False
+    _engine = None  # AudioOutputEngine на все устройства из devices_output
+
+    @classmethod
+    def _get_engine(cls) -> AudioOutputEngine:
+        if cls._engine is None:
+            cls._engine = AudioOutputEngine(devices_output, stop_signal=barge_in)
+        return cls._engine
 
     @classmethod
     def _process_queue(cls):
         while cls._running:
             try:
-                audio_file, creation_time = cls._queue.get(timeout=1)
-                # logger.logging(f"got audio_file: {audio_file}, created at: {creation_time}")
-
-                time_stop_playing = float(sql_database.get('time_stop_playing', 0))
-                if time_stop_playing > creation_time:
-                    logger.logging(f"Skipping {audio_file} due to time_stop_playing")
-                    try:
-                        os.remove(audio_file)
-                    except:
-                        pass
-                    cls._queue.task_done()
-                    continue
-
-                cls.play_sound_v2(audio_file, creation_time)
-                try:
-                    os.remove(audio_file)
-                except:
-                    pass
-                cls._queue.task_done()
+                pcm, samplerate, creation_time = cls._queue.get(timeout=1)
             except queue.Empty:
                 continue
 
+            if barge_in.stopped_after(creation_time):
+                logger.logging("Skipping audio chunk due to barge-in")
+            else:
+                try:
+                    cls._get_engine().write(pcm, samplerate, creation_time)
+                except Exception as e:
+                    logger.logging(f"Error in audio output: {e}")
+            cls._queue.task_done()
+
     @classmethod
     def start(cls):
         if cls._thread is None or not cls._thread.is_alive():
@@ -72,62 +75,175 @@ class TTSQueue:
         cls._running = False
         if cls._thread:
             cls._thread.join()
+        if cls._engine:
+            cls._engine.close()
+        cls._engine = None
 
     @classmethod
     def add_to_queue(cls, audio_file: str):
+        """Чанк от tts_api: декодируется сразу, файл удаляется, в очередь попадает PCM"""
         creation_time = time.time()
-        cls._queue.put((audio_file, creation_time))
-
-    @staticmethod
-    def play_sound_v2(mp3_filepath, creation_time):
-        # logger.logging("got mp3_filepath", mp3_filepath)
-        def play_sound_wrapped(device_index):
-            nonlocal data
-            time_stop_playing = float(sql_database.get('time_stop_playing', 0))
-            if time_stop_playing > creation_time:
-                logger.logging(">> Пропуск аудио")
-                return
-
-            stream = sd.play(data, samplerate, device=device_index)
-            while sd.get_stream().active:
-                time_stop_playing = float(sql_database.get('time_stop_playing', 0))
-                if time_stop_playing > creation_time:
-                    logger.logging(">> Остановлено аудио")
-                    sd.stop()
-                    return
-                time.sleep(0.1)
-            sd.wait()
-
-        data, samplerate = sf.read(mp3_filepath)
-        sd.wait()
-
-        devices_output_index = [get_device_index_by_name(device_output) for device_output in devices_output]
-        threads = [threading.Thread(target=play_sound_wrapped, args=(index,)) for index in devices_output_index]
-
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
+        try:
+            pcm, samplerate = decode_audio_file(audio_file)
+        except Exception as e:
+            logger.logging(f"Error decoding {audio_file}: {e}")
+            return
+        cls._queue.put((pcm, samplerate, creation_time))
 
+    @classmethod
+    def add_pcm(cls, pcm, samplerate: int):
+        """PCM float32 (frames, channels) без файла"""
+        cls._queue.put((pcm, samplerate, time.time()))
 
-def tts_audio_with_play(text: str, speed, lang, voice_id, model_id, stop_event):
-    logger.logging("Request to play")
-    sql_database['time_stop_playing'] = time.time() - 1
-    time_play_start = time.time()
 
-    # Поправляем произношение
+def prepare_tts_text(text: str) -> str:
+    """Поправляем произношение перед отправкой в TTS"""
     text = text.lower()
     while text.count("хмм"):
         text = text.replace("хмм", "хм")
 
     if translit_lang:
         text = translit(text, translit_lang)
+    return text.replace("хм", "hmmmm")
+
+
+class SentenceSplitter:
+    """
+    Режет поток текста LLM на предложения для TTS.
+    Короткие предложения ('Хмм..', 'Оо..') склеиваются со следующими до min_chars,
+    слишком длинные режутся по запятой/пробелу около max_chars.
+    """
+    _boundary = re.compile(r'(?<=[.!?…])["»)]*\s+|\n+')
+
+    def __init__(self, min_chars: int = 20, max_chars: int = 250):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+        self._pending = ""  # накопленные короткие предложения
 
-    model = "hailuo"
+    def _emit(self, sentence: str) -> list:
+        self._pending = f"{self._pending} {sentence}".strip() if self._pending else sentence.strip()
+        if len(self._pending) >= self.min_chars:
+            ready, self._pending = self._pending, ""
+            return [ready]
+        return []
+
+    def feed(self, chunk: str) -> list:
+        sentences = []
+        self._buffer += chunk
+        while True:
+            match = self._boundary.search(self._buffer)
+            if match:
+                sentence, self._buffer = self._buffer[:match.start()], self._buffer[match.end():]
+            elif len(self._buffer) > self.max_chars:
+                cut = self._buffer.rfind(",", 0, self.max_chars)
+                if cut <= 0:
+                    cut = self._buffer.rfind(" ", 0, self.max_chars)
+                cut = cut + 1 if cut > 0 else self.max_chars
+                sentence, self._buffer = self._buffer[:cut], self._buffer[cut:]
+            else:
+                break
+            if sentence.strip():
+                sentences.extend(self._emit(sentence))
+        return sentences
+
+    def flush(self) -> list:
+        """Остаток текста после конца ответа"""
+        rest = f"{self._pending} {self._buffer}".strip()
+        self._buffer = self._pending = ""
+        return [rest] if rest else []
+
+
+def tts_stream_with_play(text_chunks, speed, lang, voice_id, model_id, stop_event, workers: int = 2):
+    """
+    Потоковая озвучка: text_chunks - итератор кусков ответа LLM.
+    Каждое законченное предложение сразу уходит в TTS (до workers предложений синтезируются параллельно),
+    аудио попадает в TTSQueue строго в порядке предложений.
+    stop_event или barge_in (перебивание) обрывают сразу всё: чтение LLM, синтез и очередь.
+    """
+    logger.logging("Request to play (stream)")
+    barge_in.stop(time.time() - 1)
+    time_play_start = time.time()
+
+    def interrupted() -> bool:
+        if stop_event and stop_event.is_set():
+            return True
+        return barge_in.stopped_after(time_play_start)
+
+    def synthesize(sentence: str, output: queue.Queue):
+        try:
+            if interrupted():
+                return
+            for audio_file, status in network_client.tts_api(
+                    prompt=prepare_tts_text(sentence),
+                    model="hailuo",
+                    speed=speed,
+                    lang=lang,
+                    voice_id=voice_id,
+                    model_id=model_id
+            ):
+                if interrupted():
+                    break
+                logger.logging(f"Got TTS: {audio_file}, {status}")
+                if status == "stream":
+                    output.put(audio_file)
+        except Exception as e:
+            logger.logging(f"Error in TTS for '{sentence[:30]}': {e}")
+        finally:
+            output.put(None)
+
+    sentence_outputs = queue.Queue()  # очереди аудио по предложениям, в порядке предложений
+
+    def play_in_order():
+        while True:
+            output = sentence_outputs.get()
+            if output is None:
+                return
+            while True:
+                audio_file = output.get()
+                if audio_file is None:
+                    break
+                if interrupted():
+                    try:
+                        os.remove(audio_file)
+                    except OSError:
+                        pass
+                    continue
+                TTSQueue.add_to_queue(audio_file)
+
+    orderer = threading.Thread(target=play_in_order, daemon=True)
+    orderer.start()
+
+    def submit(executor, sentence: str):
+        output = queue.Queue()
+        sentence_outputs.put(output)
+        executor.submit(synthesize, sentence, output)
+
+    splitter = SentenceSplitter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts") as executor:
+        try:
+            for chunk in text_chunks:
+                if interrupted():
+                    logger.logging("Thread interrupted during stream TTS")
+                    break
+                for sentence in splitter.feed(chunk):
+                    submit(executor, sentence)
+            else:
+                for sentence in splitter.flush():
+                    submit(executor, sentence)
+        finally:
+            sentence_outputs.put(None)
+    orderer.join()
+
+
+def tts_audio_with_play(text: str, speed, lang, voice_id, model_id, stop_event):
+    logger.logging("Request to play")
+    barge_in.stop(time.time() - 1)
+    time_play_start = time.time()
 
     for audio_file, status in network_client.tts_api(
-            prompt=text.replace("хм", "hmmmm"),
-            model=model,
+            prompt=prepare_tts_text(text),
+            model="hailuo",
             speed=speed,
             lang=lang,
             voice_id=voice_id,
@@ -136,10 +252,9 @@ def tts_audio_with_play(text: str, speed, lang, voice_id, model_id, stop_event):
         if stop_event and stop_event.is_set():
             print("Thread interrupted after TTS")
             return
-        time_stop_playing = float(sql_database.get('time_stop_playing', 0))
-        if time_stop_playing > time_play_start:
+        if barge_in.stopped_after(time_play_start):
             logger.logging("skip tts")
             continue
         logger.logging(f"Got TTS: {audio_file}, {status}")
         if status == "stream":
-            TTSQueue.add_to_queue(audio_file)
\ No newline at end of file
+            TTSQueue.add_to_queue(audio_file)
@@ -0,0 +1,105 @@
+import atexit
+import re
+import threading
+
+from base_logger import Logs
+
+logger = Logs(warnings=True, name="user-directory")
+
+MENTION_PATTERN = re.compile(r"<@(\d+)>")
+
+
+class UserDirectory:
+    """
+    Известные пользователи (id -> ник) в памяти процесса.
+
+    Словарь читается из DictSQL один раз. remember() меняет только память и помечает справочник
+    изменённым, если ник новый или другой; в базу он пишется целиком фоновым потоком раз в
+    flush_interval секунд (и при выходе), а не на каждое сообщение.
+    """
+
+    def __init__(self, sql_database, sql_key: str = "known_users", flush_interval: float = 30):
+        self.sql_database = sql_database
+        self.sql_key = sql_key
+        self.flush_interval = flush_interval
+        self._users = dict(sql_database.get(sql_key, {}))
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        threading.Thread(target=self._flush_loop, daemon=True, name="user-directory").start()
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, user_id, default=None):
+        return self._users.get(str(user_id), default)
+
+    def remember(self, user_id, nickname: str):
+        user_id = str(user_id)
+        if self._users.get(user_id) == nickname:
+            return
+        with self._lock:
+            self._users[user_id] = nickname
+            self._dirty = True
+
+    def rewrite_mentions(self, text: str, self_id: str, self_name: str) -> str:
+        """
+        Заменяет <@id> на ники за один проход: своё упоминание - на self_name,
+        неизвестные пользователи остаются как есть
+        """
+        def replace(match):
+            user_id = match.group(1)
+            if user_id == self_id:
+                return self_name
+            return self._users.get(user_id, match.group(0))
+
+        return MENTION_PATTERN.sub(replace, text)
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            users = dict(self._users)
+            self._dirty = False
+        try:
+            self.sql_database[self.sql_key] = users
+        except Exception as e:
+            with self._lock:
+                self._dirty = True  # повторим при следующем сбросе
+            logger.logging(f"Не удалось сохранить {self.sql_key}: {e}")
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+if __name__ == "__main__":
+    import time
+
+    class SlowDict(dict):
+        """DictSQL: запись сериализует весь словарь"""
+        writes = 0
+
+        def __setitem__(self, key, value):
+            SlowDict.writes += 1
+            str(value)
+            super().__setitem__(key, value)
+
+    database = SlowDict(known_users={str(n): f"user{n}" for n in range(20000)})
+    directory = UserDirectory(database, flush_interval=3600)
+    message = "Привет <@15> и <@19999>, где <@1>? <@42424242> и <@777> тоже"
+    start_time = time.perf_counter()
+    for n in range(10000):
+        directory.remember(str(n % 200), f"user{n % 200}")
+        text = directory.rewrite_mentions(message, self_id="777", self_name="Бот")
+    print(f"{(time.perf_counter() - start_time) / 10000 * 1e6:.1f} мкс на сообщение, записей в базу: {SlowDict.writes}")
+    print(text)
+    directory.remember("1", "новый ник")
+    directory.close()
+    print(f"после close: записей {SlowDict.writes}, ник: {database['known_users']['1']}")